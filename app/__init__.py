@@ -1,7 +1,17 @@
+import atexit
+import io
+import json
 import os
-import pkgutil
-import importlib
-from app.commands import CommandHandler, Command, CommandHistoryManager
+import shlex
+import sys
+import time
+from app.commands import CommandHandler, CommandHistoryManager
+from app.commands.plugin_cache import DEFAULT_MANIFEST_PATH, LazyCommand
+from app.commands.plugin_registry import PluginRegistry
+from app.commands.session import CommandSession, session_io, using_session
+from app.commands.worker_pool import PreforkWorkerPool
+from app.instrumentation import configure_instrumentation, metrics
+from app.logging_pipeline import install_log_pipeline, options_from_environment
 from app.plugins.menu import MenuCommand
 import logging
 from dotenv import load_dotenv
@@ -9,10 +19,12 @@ from dotenv import load_dotenv
 class App:
     def __init__(self):  # Constructor
         os.makedirs('logs', exist_ok=True)  # Ensure the logs directory exists
+        load_dotenv()  # Loaded first so the LOG_* settings in .env apply to the logging setup
         self.configure_logging()
-        load_dotenv()
         self.settings = self.load_environment_variables()
         self.settings.setdefault('ENVIRONMENT', 'PRODUCTION')
+        configure_instrumentation(self.settings)  # METRICS, METRICS_SNAPSHOT and PROFILE from .env
+        CommandHistoryManager.configure(self.settings)  # HISTORY_BACKEND and friends from .env
         self.command_handler = CommandHandler()
     
     def load_environment_variables(self):
@@ -33,35 +45,47 @@ class App:
 
     def configure_logging(self):
         log_file_path = 'logs/app.log'
-        logging.basicConfig(filename=log_file_path, level=logging.INFO,
-                            format='%(asctime)s - %(levelname)s - %(message)s', filemode='a')
+        if os.environ.get('LOG_ASYNC', '1').lower() in ('0', 'false', 'no'):
+            logging.basicConfig(filename=log_file_path, level=logging.INFO,
+                                format='%(asctime)s - %(levelname)s - %(message)s', filemode='a')
+        else:
+            # Log calls only enqueue records, a background thread writes them to the file in batches
+            install_log_pipeline(log_file_path, level=logging.INFO, **options_from_environment(os.environ))
         logging.info("Logging configured.")
 
     def load_plugins(self):
-        plugins_package = 'app.plugins'
-        for _, plugin_name, is_pkg in pkgutil.iter_modules([plugins_package.replace('.', '/')]):
-            logging.info(f"Found plugin: {plugin_name}")  # Log for debugging/record-keeping
-            if is_pkg and plugin_name != "menu":  # Ensure it's a package
-                try:
-                    plugin_module = importlib.import_module(f'{plugins_package}.{plugin_name}')
-                    for item_name in dir(plugin_module):
-                        item = getattr(plugin_module, item_name)
-                        try:
-                            if isinstance(item, type) and issubclass(item, Command) and item is not Command:
-                                self.command_handler.register_command(plugin_name, item())
-                                logging.info(f"Registered command: {plugin_name}")  # Logging
-                        except TypeError as e:
-                            # Check the exception message to determine if it's the specific TypeError we want to ignore
-                            if str(e) == "issubclass() arg 1 must be a class":
-                                continue  # Ignore this specific TypeError
-                            else:
-                                raise  # Move on to the next item without logging this specific error
-                except Exception as e:
-                    logging.error(f"Error loading plugin {plugin_name}: {e}")  # Logging errors
+        with metrics.timer('app.load_plugins'):
+            self.register_plugins()
+        self.start_worker_pool()
+
+    def start_worker_pool(self):
+        """Forks WORKER_POOL_SIZE workers for the cpu_bound commands (none by default).
+
+        The plugins are imported first, so the workers inherit them ready to use. A worker is
+        replaced after WORKER_MAX_TASKS tasks (0 keeps it for good) and whenever it crashes.
+        """
+        size = int(self.settings.get('WORKER_POOL_SIZE') or 0)
+        if size <= 0 or self.command_handler.worker_pool is not None:
+            return self.command_handler.worker_pool
+        for command in self.command_handler.commands.values():
+            getattr(command, 'instance', None)  # LazyCommand imports its plugin here
+        pool = PreforkWorkerPool(size, max_tasks_per_worker=int(self.settings.get('WORKER_MAX_TASKS') or 0),
+                                 command_handler=self.command_handler).start()
+        atexit.register(pool.close)
+        self.command_handler.worker_pool = pool
+        return pool
+
+    def register_plugins(self):
+        manifest_path = self.settings.get('PLUGIN_MANIFEST_PATH', DEFAULT_MANIFEST_PATH)
+        # The registry is built once per process, from the manifest when it is still fresh
+        registry = PluginRegistry.for_package('app.plugins', packages=True, exclude=('menu',), manifest_path=manifest_path)
+        for entry in registry:
+            # Commands are imported on their first execution, not at startup
+            self.command_handler.register_command(entry.name, LazyCommand(entry.module_name, entry.class_name))
+            logging.info(f"Registered command: {entry.name}")  # Logging
         # Since menu command would need a separate argument - which is list of all registered commands, we have to manually register it.
         self.command_handler.register_command("menu", MenuCommand(self.command_handler))
 
-
     def print_main_menu(self):
         print("\nAvailable commands:")  # Retained for user interaction
         self.command_handler.list_commands()
@@ -95,6 +119,89 @@ class App:
                 logging.error("Only numbers are allowed, wrong input.")  # Logging error
                 print("Only numbers are allowed, wrong input.")  # User feedback
 
+    def run_batch(self, lines, output=None, results_format='text'):
+        """
+        Runs a script of commands without prompting (batch mode).
+
+        Each line is either ``command answer answer ...`` or a JSON object such as
+        ``{"command": "calculator", "inputs": ["1", "2", "3", "0"]}``; the answers are fed to the
+        command's prompts in order. With ``results_format='jsonl'`` one JSON result per command is
+        written to ``output``, otherwise the commands' own output is streamed as is.
+        """
+        output = output or sys.stdout
+        self.load_plugins()
+        logging.info("Application starting in batch mode...")
+        command_history = CommandHistoryManager()  # Get the singleton instance
+        summary = {'executed': 0, 'failed': 0}
+        start = time.perf_counter()
+        with session_io():
+            for line_number, line in enumerate(lines, start=1):
+                try:
+                    request = parse_batch_line(line)
+                except (ValueError, KeyError) as e:
+                    logging.error(f"Invalid batch line {line_number}: {e}")
+                    request = ('', [])
+                if request is None:
+                    continue  # Blank line or comment
+                command_name, inputs = request
+                result, stop = self.run_batch_command(command_name, inputs, output, results_format)
+                result['line'] = line_number
+                if results_format == 'jsonl':
+                    output.write(json.dumps(result) + "\n")
+                if result['status'] == 'ok':
+                    summary['executed'] += 1
+                    command_history.add_command(result['command'])
+                else:
+                    summary['failed'] += 1
+                if stop:
+                    break
+        summary['elapsed'] = time.perf_counter() - start
+        logging.info(f"Batch finished: {summary['executed']} executed, {summary['failed']} failed "
+                     f"in {summary['elapsed']:.3f}s")
+        return summary
+
+    def run_batch_command(self, command_name, inputs, output, results_format):
+        """Runs one scripted command; returns its result record and whether the batch should stop."""
+        if command_name.isdigit():
+            command_name = self.command_handler.get_command_by_index(int(command_name) - 1) or command_name
+        result = {'command': command_name, 'status': 'ok'}
+        if command_name not in self.command_handler.commands:
+            result.update(status='error', error=f"No such command: {command_name}")
+            logging.warning(f"Batch: no such command '{command_name}'")
+            return result, False
+        captured = io.StringIO() if results_format == 'jsonl' else output
+        session = CommandSession(inputs, output=captured)
+        stop = False
+        start = time.perf_counter()
+        try:
+            with using_session(session):
+                self.command_handler.execute_command(command_name)
+        except SystemExit:
+            stop = True  # exit (or menu -> 0) ends the batch just like it ends the REPL
+            result['status'] = 'exit'
+        except EOFError:
+            result.update(status='error', error='Command asked for more input than the script provided')
+        except Exception as e:  # pylint: disable=broad-exception-caught
+            logging.error(f"Batch command '{command_name}' failed: {e}")
+            result.update(status='error', error=str(e))
+        result['elapsed_ms'] = round((time.perf_counter() - start) * 1000, 3)
+        if results_format == 'jsonl':
+            result['output'] = captured.getvalue()
+        return result, stop
+
+
+def parse_batch_line(line):
+    """Turns one script line into (command, inputs), or None for blank lines and comments."""
+    line = line.strip()
+    if not line or line.startswith('#'):
+        return None
+    if line.startswith('{'):
+        request = json.loads(line)
+        return str(request['command']), [str(value) for value in request.get('inputs', request.get('args', []))]
+    command_name, *inputs = shlex.split(line)
+    return command_name, inputs
+
+
 if __name__ == "__main__":
     app = App()
     app.start()
\ No newline at end of file
@@ -1,10 +1,23 @@
 from abc import ABC, abstractmethod
-import pandas as pd
+import atexit
+import inspect
+import logging
+import threading
 from datetime import datetime
-import os
 from util.constants import MAX_HISTORY_RECORDS
+from app.instrumentation import metrics
+from app.lazy_import import lazy_import
+from app.commands.history_buffer import HistoryRingBuffer
+from app.commands.history_index import HistoryIndex
+from app.commands.history_store import HISTORY_COLUMNS, TIMESTAMP_FORMAT, create_history_backend
+
+asyncio = lazy_import('asyncio')  # Only needed once a command's execute() turns out to be a coroutine
 
 class Command(ABC):
+    # Commands that need no input and mostly burn CPU set this; with a worker pool running
+    # they are executed in a pre-forked worker process (see app/commands/worker_pool.py)
+    cpu_bound = False
+
     @abstractmethod
     def execute(self):
         pass
@@ -12,27 +25,85 @@ class Command(ABC):
 class CommandHandler:
     def __init__(self):
         self.commands = {}
+        # Index-addressable view of the registrations, kept in sync on every (un)registration
+        self._names = []
+        self._indexes = {}
+        self._menu_cache = {}
+        self.worker_pool = None  # A PreforkWorkerPool for the cpu_bound commands, when one is started
 
     def register_command(self, command_name: str, command_instance: Command):
+        if command_name not in self.commands:
+            self._indexes[command_name] = len(self._names)
+            self._names.append(command_name)
+            self._menu_cache.clear()
         self.commands[command_name] = command_instance
 
+    def unregister_command(self, command_name: str):
+        """Removes a command; the commands after it move up one position."""
+        if command_name not in self.commands:
+            return False
+        del self.commands[command_name]
+        index = self._indexes.pop(command_name)
+        del self._names[index]
+        for name in self._names[index:]:
+            self._indexes[name] -= 1
+        self._menu_cache.clear()
+        return True
+
     def execute_command(self, command_name: str):
+        """Runs the command and returns what its execute() returned (None if it failed in a worker)."""
         # Easier to Ask for Forgiveness than Permission (EAFP)
         try:
-            self.commands[command_name].execute()
+            command = self.commands[command_name]
         except KeyError: # Catch the exception if the operation fails
             print(f"No such command: {command_name}") # Exception caught and handled gracefully
+            return None
+        with metrics.timer(f"command.{command_name}"):
+            if self.worker_pool is not None and command.cpu_bound:
+                return self._execute_in_worker(command_name)
+            result = command.execute()
+            if inspect.iscoroutine(result):
+                # Commands with an async execute() still work from the synchronous REPL
+                result = asyncio.run(result)
+            return result
 
-    def list_commands(self):
-        for index, command_name in enumerate(self.commands, start=1):
-            print(f"{index}. {command_name}")
+    def _execute_in_worker(self, command_name: str):
+        """Runs the command in a worker, prints its output and returns its result.
 
-    def get_command_by_index(self, index: int):
+        A failure in the worker is reported, not raised.
+        """
         try:
-            command_name = list(self.commands.keys())[index]
-            return command_name
-        except IndexError:
+            output, result = self.worker_pool.run_command(command_name)
+        except Exception as e:  # pylint: disable=broad-exception-caught
+            logging.error(f"Command '{command_name}' failed in a worker process: {e}")
+            print(f"Command {command_name} failed: {e}")
             return None
+        print(output, end='')
+        return result
+
+    def render_menu(self, capitalize: bool = False) -> str:
+        """The numbered command list, rendered once and reused until the registrations change."""
+        menu = self._menu_cache.get(capitalize)
+        if menu is None:
+            menu = "\n".join(f"{index}. {name.capitalize() if capitalize else name}"
+                             for index, name in enumerate(self._names, start=1))
+            self._menu_cache[capitalize] = menu
+        return menu
+
+    def list_commands(self):
+        if self._names:
+            print(self.render_menu())
+
+    def get_command_by_index(self, index: int):
+        if 0 <= index < len(self._names):
+            return self._names[index]
+        return None
+
+    def get_index_of_command(self, command_name: str):
+        return self._indexes.get(command_name)
+
+    def __len__(self):
+        return len(self._names)
 
 class Singleton(type):
     _instances = {}
@@ -42,35 +113,183 @@ class Singleton(type):
         return cls._instances[cls]
 
 class CommandHistoryManager(metaclass=Singleton):
-    def __init__(self):
-        self.history_file = 'data/command_history.csv'
-        if os.path.exists(self.history_file):
-            self.history = pd.read_csv(self.history_file)
-            # Ensure that only the latest MAX_HISTORY_RECORDS are loaded
-            self.history = self.history.tail(MAX_HISTORY_RECORDS)
-        else:
-            self.history = pd.DataFrame(columns=['Timestamp', 'Command'])
+    def __init__(self, history_file=None, max_records=MAX_HISTORY_RECORDS, fsync_every=0, backend='csv',
+                 **backend_options):
+        # 'csv', 'columnar', 'shared' or 'sqlite'; see app/commands/history_store.py
+        self.backend = backend
+        self.max_records = max_records
+        # New commands are appended to the log instead of rewriting the whole file every time
+        self.log = create_history_backend(backend, history_file, max_records, fsync_every=fsync_every,
+                                          **backend_options)
+        self.history_file = self.log.path
+        atexit.register(self.log.close)  # Make sure batched appends reach the disk
+        # The history is read from the log the first time it is used, so startup does not pay for it
+        self._buffer = None
+        self._index = None
+        self._version = None  # self.log.version() when the in-memory history was read
+        # Commands from several threads (e.g. server sessions) may add to and rewrite the history
+        self._lock = threading.RLock()
+
+    @classmethod
+    def configure(cls, settings):
+        """Creates the singleton from the HISTORY_* settings read from .env and returns it.
+
+        Without any HISTORY_* settings an existing instance is kept as it is.
+        """
+        options = {}
+        if settings.get('HISTORY_BACKEND'):
+            options['backend'] = settings['HISTORY_BACKEND'].lower()
+        if settings.get('HISTORY_FILE'):
+            options['history_file'] = settings['HISTORY_FILE']
+        if settings.get('HISTORY_MAX_RECORDS'):
+            options['max_records'] = int(settings['HISTORY_MAX_RECORDS'])
+        if settings.get('HISTORY_FSYNC_EVERY'):
+            options['fsync_every'] = int(settings['HISTORY_FSYNC_EVERY'])
+        if settings.get('HISTORY_BATCH_SIZE') and options.get('backend') == 'sqlite':
+            options['batch_size'] = int(settings['HISTORY_BATCH_SIZE'])
+        existing = Singleton._instances.get(cls)
+        if existing is not None:
+            if not options:
+                return existing
+            existing.log.close()
+            del Singleton._instances[cls]
+        return cls(**options)
+
+    def _load(self):
+        with self._lock:
+            version = self.log.version()
+            if self._buffer is not None and version == self._version:
+                return  # Another thread loaded it first
+            # Taken before reading, so a record appended meanwhile shows up on the next read
+            self._set_records(self.log.read_tail())
+            self._version = version
+
+    def _is_stale(self):
+        """True before the first read, and when other instances changed a shared history since."""
+        return self._buffer is None or (self.log.shared and self.log.version() != self._version)
+
+    def _set_records(self, records):
+        # Only the latest MAX_HISTORY_RECORDS are kept in memory, each append overwrites the oldest
+        index = HistoryIndex()
+        buffer = HistoryRingBuffer(self.max_records, records)
+        index.load_columns(buffer.timestamps(), buffer.codes(), buffer.names())
+        self._index = index
+        self._buffer = buffer
+
+    @property
+    def _records(self):
+        if self._is_stale():
+            self._load()
+        return self._buffer
+
+    @property
+    def index(self):
+        if self._is_stale():  # The buffer is set last, once the index is complete
+            self._load()
+        return self._index
+
+    @property
+    def history(self):
+        """The in-memory history as a DataFrame, built only when it is asked for."""
+        return self._records.to_frame()
+
+    @history.setter
+    def history(self, frame):
+        self._buffer = HistoryRingBuffer(self.max_records, frame[HISTORY_COLUMNS].itertuples(index=False, name=None))
+        self._index = HistoryIndex()
+        self._reindex()
+
+    def _reindex(self):
+        self._index.load_columns(self._buffer.timestamps(), self._buffer.codes(), self._buffer.names())
 
     def add_command(self, command_name):
-        now = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-        new_entry = pd.DataFrame([[now, command_name]], columns=['Timestamp', 'Command'])
-        self.history = pd.concat([self.history, new_entry], ignore_index=True).tail(MAX_HISTORY_RECORDS)
-        self.save_history()
+        with metrics.timer('history.add'), self._lock:
+            moment = datetime.now().replace(microsecond=0)
+            seconds = HistoryRingBuffer.epoch(moment)
+            self._records.append(seconds, command_name)
+            self.index.add(seconds, command_name)
+            while len(self.index) > len(self._records):
+                self.index.evict_oldest()  # The ring buffer overwrote its oldest record
+            self.log.append(moment.strftime(TIMESTAMP_FORMAT), command_name)
 
     def get_history(self):
         # Return a list of command names for backward compatibility
-        return self.history['Command'].tolist()
+        return self._records.commands()
+
+    def _edit(self, edit):
+        """Persists ``edit(records)`` as the new latest records and keeps the in-memory history in step.
+
+        A shared backend applies the edit to the records of every instance, read again under its
+        lock; the others rewrite the log from the in-memory records, which are all there is.
+        """
+        with metrics.timer('history.save'), self._lock:
+            if self.log.shared:
+                records = self.log.update(edit)
+            else:
+                records = list(edit(self._records.records()))
+                self.log.rewrite(records)
+            self._set_records(records)
 
     def clear_history(self):
-        self.history = pd.DataFrame(columns=['Timestamp', 'Command'])
-        self.save_history()
+        self._edit(lambda records: [])
+
+    def delete_record(self, index: int):
+        """Deletes the record at the given zero-based position and persists the change."""
+        def without_record(records):
+            kept = list(records)
+            del kept[index]  # IndexError when there is no such record, before anything is written
+            return kept
+        self._edit(without_record)
+
+    def history_count(self):
+        """Number of stored records (at most ``max_records``)."""
+        return self.log.count()
+
+    def history_page(self, page: int, page_size: int = 20):
+        """One page of the stored records, oldest first; only that page is read from storage."""
+        return self.log.read_page(page * page_size, page_size)
+
+    def query(self, start=None, end=None, command=None):
+        """(timestamp, command) records with start <= timestamp <= end, optionally of one command.
+
+        Like count, top_commands and delete_where, this only covers the latest ``max_records``
+        records, which are all the backends keep. Bounds may be datetimes or 'YYYY-MM-DD HH:MM:SS' strings; None leaves that side open.
+        """
+        return self.index.records(start, end, command)
+
+    def count(self, command=None, start=None, end=None):
+        """How many times ``command`` (or any command) ran between ``start`` and ``end``."""
+        return self.index.count(command, start, end)
+
+    def top_commands(self, n=5, start=None, end=None):
+        """The ``n`` most used commands between ``start`` and ``end`` as (command, count) pairs."""
+        return self.index.top(n, start, end)
+
+    def delete_where(self, predicate) -> int:
+        """Deletes every record for which ``predicate(timestamp, command)`` is true; returns how many."""
+        deleted = 0
+
+        def without_matches(records):
+            nonlocal deleted
+            kept = [record for record in records if not predicate(*record)]
+            deleted = len(records) - len(kept)
+            return kept
+        self._edit(without_matches)
+        return deleted
 
     def save_history(self):
-        """Saves the current command history to a CSV file."""
-        self.history.to_csv(self.history_file, index=False)
+        """Saves the current command history to the history file.
+
+        A shared history is never overwritten with this instance's view: saving compacts it instead.
+        """
+        if self.log.shared:
+            with metrics.timer('history.save'), self._lock:
+                self.log.compact()
+                self._set_records(self.log.read_tail())
+            return
+        self._edit(lambda records: records)
 
     def load_history(self):
-        """Loads the command history from a CSV file into a DataFrame."""
-        if os.path.exists(self.history_file):
-            return pd.read_csv(self.history_file)
-        return pd.DataFrame(columns=['Timestamp', 'Command'])
+        """Loads the latest command history records from the history file into a DataFrame."""
+        with metrics.timer('history.load'):
+            return self.log.load_frame()
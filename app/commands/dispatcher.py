@@ -0,0 +1,148 @@
+import asyncio
+import contextvars
+import inspect
+import io
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+from app.commands import CommandHandler
+from app.commands.session import CommandSession, session_io, using_session
+from app.instrumentation import metrics
+
+
+def is_async_command(command) -> bool:
+    """True when the command (or the plugin behind a lazy proxy) defines ``async def execute``."""
+    command = getattr(command, 'instance', command)
+    return inspect.iscoroutinefunction(command.execute)
+
+
+class DispatchResult:
+    def __init__(self, command_name, status, output='', error=None, wall_time=0.0, queue_time=0.0):
+        self.command_name = command_name
+        self.status = status
+        self.output = output
+        self.error = error
+        self.wall_time = wall_time  # Seconds from start of execution to completion
+        self.queue_time = queue_time  # Seconds spent waiting for a free slot
+
+    def __repr__(self):
+        return f"DispatchResult({self.command_name!r}, {self.status!r}, wall_time={self.wall_time:.4f})"
+
+
+class AsyncCommandDispatcher:
+    """Runs many commands concurrently on an asyncio event loop.
+
+    Commands with an ``async def execute`` run on the loop itself; legacy synchronous
+    commands are handed to a thread pool, where they run through
+    CommandHandler.execute_command like in the REPL (metrics timer, worker pool for the
+    ``cpu_bound`` ones), so they cannot block the loop. At most
+    ``max_concurrency`` commands run at once, the rest wait in the queue. Every command
+    gets its own CommandSession, so scripted input and output never mix between commands.
+    """
+
+    def __init__(self, command_handler: CommandHandler, max_concurrency: int = 8, max_threads: int = None):
+        self.command_handler = command_handler
+        self.max_concurrency = max_concurrency
+        self.max_threads = max_threads or max_concurrency
+        self._executor = None  # Created by start(), shut down by close(); a closed dispatcher can start again
+        self._semaphore = None
+        self._session_io = None
+        self.queue_depth = 0
+        self.max_queue_depth = 0
+        self.running = 0
+        self.wall_times = {}  # command name -> list of wall times in seconds
+
+    async def __aenter__(self):
+        self.start()
+        return self
+
+    async def __aexit__(self, *exc_info):
+        self.close()
+
+    def start(self):
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.max_threads, thread_name_prefix='command')
+        if self._session_io is None:
+            self._session_io = session_io()
+            self._session_io.__enter__()  # pylint: disable=unnecessary-dunder-call
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+        self._semaphore = None  # Bound to the loop it was first used on; the next start may run on another
+        if self._session_io is not None:
+            self._session_io.__exit__(None, None, None)
+            self._session_io = None
+
+    async def submit(self, command_name: str, inputs=(), session: CommandSession = None) -> DispatchResult:
+        """Queues one command and waits for its result.
+
+        Without ``session`` the command gets a CommandSession with ``inputs`` and its output is
+        captured in the result; a caller-provided session (e.g. a remote client) is used as is.
+        """
+        self.start()
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        command = self.command_handler.commands.get(command_name)
+        if command is None:
+            return DispatchResult(command_name, 'error', error=f"No such command: {command_name}")
+        queued_at = time.perf_counter()
+        self.queue_depth += 1
+        self.max_queue_depth = max(self.max_queue_depth, self.queue_depth)
+        async with self._semaphore:
+            self.queue_depth -= 1
+            self.running += 1
+            started_at = time.perf_counter()
+            if session is None:
+                session = CommandSession(inputs, output=io.StringIO())
+            try:
+                await self._execute(command_name, command, session)
+                status, error = 'ok', None
+            except SystemExit:
+                status, error = 'exit', None
+            except Exception as e:  # pylint: disable=broad-exception-caught
+                logging.error(f"Dispatched command '{command_name}' failed: {e}")
+                status, error = 'error', str(e)
+            finally:
+                self.running -= 1
+            finished_at = time.perf_counter()
+        wall_time = finished_at - started_at
+        self.wall_times.setdefault(command_name, []).append(wall_time)
+        output = session.output.getvalue() if isinstance(session.output, io.StringIO) else ''
+        return DispatchResult(command_name, status, output, error,
+                              wall_time=wall_time, queue_time=started_at - queued_at)
+
+    async def run_many(self, requests):
+        """Runs (command_name, inputs) pairs concurrently; results come back in request order."""
+        return await asyncio.gather(*(self.submit(name, inputs) for name, inputs in requests))
+
+    async def _execute(self, command_name, command, session):
+        if is_async_command(command):
+            with metrics.timer(f"command.{command_name}"), using_session(session):
+                await command.execute()
+            return
+        # Legacy synchronous command: run it on the thread pool, in a copy of the caller's context
+        loop = asyncio.get_running_loop()
+        context = contextvars.copy_context()
+        await loop.run_in_executor(self._executor, context.run, _run_in_session, session,
+                                   self.command_handler.execute_command, command_name)
+
+    def stats(self):
+        """Per-command call counts and wall times plus the current and peak queue depth."""
+        commands = {}
+        for name, times in self.wall_times.items():
+            ordered = sorted(times)
+            commands[name] = {
+                'calls': len(ordered),
+                'mean': sum(ordered) / len(ordered),
+                'max': ordered[-1],
+                'p95': ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))],
+            }
+        return {'queue_depth': self.queue_depth, 'max_queue_depth': self.max_queue_depth,
+                'running': self.running, 'commands': commands}
+
+
+def _run_in_session(session, func, *args):
+    with using_session(session):
+        return func(*args)
@@ -0,0 +1,112 @@
+import calendar
+from app.lazy_import import lazy_import
+from app.commands.history_store import HISTORY_COLUMNS, format_timestamps, parse_timestamps
+
+np = lazy_import('numpy')
+pd = lazy_import('pandas')  # Only for to_frame(), the buffer itself never needs it
+
+
+class HistoryRingBuffer:
+    """Fixed-capacity in-memory history: 12 bytes per record instead of a DataFrame row.
+
+    Timestamps live in an int64 array (epoch seconds of the naive wall-clock time) and
+    command names in a uint32 array of codes into an intern table. Appending writes one
+    slot and, once full, overwrites the oldest record, so both are O(1). Lists and frames
+    are only built when asked for.
+    """
+
+    def __init__(self, capacity, records=()):
+        self.capacity = capacity
+        self._times = np.zeros(capacity, dtype=np.int64)
+        self._codes = np.zeros(capacity, dtype=np.uint32)
+        self._names = []  # code -> command name
+        self._lookup = {}  # command name -> code
+        self._name_array = None  # self._names as an object array, rebuilt when a name is added
+        self._start = 0  # Slot of the oldest record
+        self._size = 0
+        self.extend(records)
+
+    def intern(self, command):
+        code = self._lookup.get(command)
+        if code is None:
+            code = self._lookup[command] = len(self._names)
+            self._names.append(command)
+            self._name_array = None
+        return code
+
+    def append(self, seconds, command):
+        """Adds a record; when the buffer is full the oldest one is overwritten."""
+        if self.capacity <= 0:
+            return
+        if self._size < self.capacity:
+            slot = (self._start + self._size) % self.capacity
+            self._size += 1
+        else:
+            slot = self._start
+            self._start = (self._start + 1) % self.capacity
+        self._times[slot] = seconds
+        self._codes[slot] = self.intern(command)
+
+    def extend(self, records):
+        """Appends (timestamp string, command) records, keeping only the last ``capacity``."""
+        records = list(records)[-self.capacity:] if self.capacity > 0 else []
+        if not records:
+            return
+        seconds = parse_timestamps(timestamp for timestamp, _ in records)
+        for value, (_, command) in zip(seconds.tolist(), records):
+            self.append(value, command)
+
+    def clear(self):
+        self._start = self._size = 0
+
+    def __len__(self):
+        return self._size
+
+    def _ordered(self, column):
+        """The column oldest first: a view while the records do not wrap around, else a copy."""
+        stop = self._start + self._size
+        if stop <= self.capacity:
+            return column[self._start:stop]
+        return np.concatenate((column[self._start:], column[:stop - self.capacity]))
+
+    def timestamps(self):
+        return self._ordered(self._times)
+
+    def codes(self):
+        return self._ordered(self._codes)
+
+    def commands(self):
+        if not self._size:
+            return []
+        if self._name_array is None:
+            self._name_array = np.asarray(self._names, dtype=object)
+        return self._name_array.take(self.codes()).tolist()
+
+    def names(self):
+        """The intern table: ``codes()`` index into it."""
+        return list(self._names)
+
+    def records(self):
+        return list(zip(format_timestamps(self.timestamps()), self.commands()))
+
+    def __iter__(self):
+        return iter(self.records())
+
+    def __delitem__(self, index):
+        records = self.records()
+        del records[index]
+        self.clear()
+        self.extend(records)
+
+    def to_frame(self):
+        commands = pd.Categorical.from_codes(self.codes().astype(np.int64), categories=self._names)
+        return pd.DataFrame({'Timestamp': format_timestamps(self.timestamps()), 'Command': commands},
+                            columns=HISTORY_COLUMNS)
+
+    def nbytes(self):
+        return self._times.nbytes + self._codes.nbytes
+
+    @staticmethod
+    def epoch(moment):
+        """Epoch seconds of a naive datetime, read as UTC like the rest of the history code."""
+        return calendar.timegm(moment.timetuple())
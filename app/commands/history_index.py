@@ -0,0 +1,180 @@
+import bisect
+import calendar
+import time
+from array import array
+from datetime import datetime
+from app.commands.history_store import TIMESTAMP_FORMAT, parse_timestamps
+from app.lazy_import import lazy_import
+
+np = lazy_import('numpy')
+
+
+def to_epoch(value):
+    """A datetime, formatted timestamp or epoch seconds as int seconds (naive time read as UTC)."""
+    if value is None:
+        return None
+    if isinstance(value, datetime):
+        return calendar.timegm(value.timetuple())
+    if isinstance(value, str):
+        return calendar.timegm(time.strptime(value.strip(), TIMESTAMP_FORMAT))
+    return int(value)
+
+
+def format_epoch(seconds):
+    return time.strftime(TIMESTAMP_FORMAT, time.gmtime(seconds))
+
+
+class _Column:
+    """Sorted, append-only list with amortized O(1) removal from the front.
+
+    With a ``typecode`` the values are kept in a compact ``array`` instead of a list.
+    """
+
+    __slots__ = ('items', 'head')
+
+    def __init__(self, typecode=None, values=None):
+        if typecode is None:
+            self.items = [] if values is None else list(values)
+        else:
+            self.items = array(typecode)
+            if values is not None:
+                self.items.frombytes(np.ascontiguousarray(values, dtype=np.int64).tobytes())
+        self.head = 0
+
+    def append(self, value):
+        self.items.append(value)
+
+    def popleft(self):
+        value = self.items[self.head]
+        self.head += 1
+        if self.head > 1024 and self.head * 2 > len(self.items):
+            del self.items[:self.head]  # Drop the dead prefix once it is most of the list
+            self.head = 0
+        return value
+
+    def bisect_left(self, value):
+        return bisect.bisect_left(self.items, value, self.head) - self.head
+
+    def bisect_right(self, value):
+        return bisect.bisect_right(self.items, value, self.head) - self.head
+
+    def slice(self, start, stop):
+        return self.items[self.head + start:self.head + stop]
+
+    def __getitem__(self, position):
+        return self.items[self.head + position]
+
+    def __len__(self):
+        return len(self.items) - self.head
+
+
+class HistoryIndex:
+    """Time index and per-command inverted index over the history records.
+
+    Every record gets a monotonically increasing sequence number. Timestamps are kept in
+    sequence order, so a time range maps to a sequence range with two binary searches;
+    each command keeps the sequence numbers of its own records. Adding a record and
+    evicting the oldest one are O(1), so eviction never invalidates the index. Arbitrary
+    deletes rebuild it, as they rewrite the history file anyway.
+
+    A timestamp older than the previous one (the clock went back) is indexed at the
+    previous timestamp to keep the time index sorted.
+    """
+
+    def __init__(self, records=()):
+        self._next_seq = 0
+        self._first_seq = 0
+        self._times = _Column('q')  # Epoch seconds, in sequence order
+        self._commands = _Column()
+        self._postings = {}  # command -> _Column('q') of sequence numbers
+        self.rebuild(records)
+
+    def rebuild(self, records):
+        records = list(records)
+        lookup = {}
+        codes = [lookup.setdefault(command, len(lookup)) for _, command in records]
+        # Parse all timestamps in one vectorized pass
+        self.load_columns(parse_timestamps(timestamp for timestamp, _ in records), codes, list(lookup))
+
+    def load_columns(self, seconds, codes, names):
+        """Rebuilds the index from epoch seconds and command codes into ``names``, e.g. a HistoryRingBuffer's."""
+        self._first_seq = self._next_seq
+        self._postings = {}
+        if not len(codes):
+            self._times = _Column('q')
+            self._commands = _Column()
+            return
+        codes = np.asarray(codes, dtype=np.int64)
+        self._times = _Column('q', np.maximum.accumulate(np.asarray(seconds, dtype=np.int64)))  # Keep it sorted
+        self._commands = _Column(values=np.asarray(names, dtype=object).take(codes).tolist())
+        # Group the sequence numbers by code in one stable sort: each group starts at its first record
+        order = np.argsort(codes, kind='stable')
+        counts = np.bincount(codes, minlength=len(names))
+        bounds = np.concatenate(([0], np.cumsum(counts)))
+        present = np.flatnonzero(counts)  # Interned names may no longer have any record
+        for code in present[np.argsort(order[bounds[present]])].tolist():  # Commands in first-seen order
+            self._postings[names[code]] = _Column('q', order[bounds[code]:bounds[code + 1]] + self._first_seq)
+        self._next_seq = self._first_seq + len(codes)
+
+    def add(self, timestamp, command):
+        seconds = to_epoch(timestamp)
+        if len(self._times) and seconds < self._times[len(self._times) - 1]:
+            seconds = self._times[len(self._times) - 1]
+        self._times.append(seconds)
+        self._commands.append(command)
+        self._postings.setdefault(command, _Column('q')).append(self._next_seq)
+        self._next_seq += 1
+
+    def evict_oldest(self):
+        """Drops the record with the lowest sequence number."""
+        if not len(self._times):
+            return
+        self._times.popleft()
+        command = self._commands.popleft()
+        posting = self._postings[command]
+        posting.popleft()
+        if not len(posting):
+            del self._postings[command]
+        self._first_seq += 1
+
+    def __len__(self):
+        return len(self._times)
+
+    def commands(self):
+        return list(self._postings)
+
+    def count(self, command=None, start=None, end=None):
+        """Number of records (of ``command``, if given) with start <= timestamp <= end."""
+        low, high = self._seq_range(start, end)
+        if command is None:
+            return high - low
+        posting = self._postings.get(command)
+        if posting is None:
+            return 0
+        return posting.bisect_left(high) - posting.bisect_left(low)
+
+    def records(self, start=None, end=None, command=None):
+        """(timestamp, command) records in the time range, oldest first."""
+        low, high = self._seq_range(start, end)
+        offset = self._first_seq
+        if command is None:
+            times = self._times.slice(low - offset, high - offset)
+            return [(format_epoch(seconds), name)
+                    for seconds, name in zip(times, self._commands.slice(low - offset, high - offset))]
+        posting = self._postings.get(command)
+        if posting is None:
+            return []
+        seqs = posting.slice(posting.bisect_left(low), posting.bisect_left(high))
+        return [(format_epoch(self._times[seq - offset]), command) for seq in seqs]
+
+    def top(self, n=5, start=None, end=None):
+        """The ``n`` most frequent commands in the time range as (command, count), ties by name."""
+        counts = ((command, self.count(command, start, end)) for command in self._postings)
+        ranked = sorted((item for item in counts if item[1]), key=lambda item: (-item[1], item[0]))
+        return ranked[:n]
+
+    def _seq_range(self, start, end):
+        """Half-open sequence range [low, high) of the records with start <= timestamp <= end."""
+        low = self._times.bisect_left(to_epoch(start)) if start is not None else 0
+        high = self._times.bisect_right(to_epoch(end)) if end is not None else len(self._times)
+        return self._first_seq + low, self._first_seq + max(low, high)
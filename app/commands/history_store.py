@@ -0,0 +1,862 @@
+import argparse
+import calendar
+import contextlib
+import csv
+import functools
+import heapq
+import io
+import json
+import logging
+import os
+import sqlite3
+import struct
+import sys
+import threading
+import time
+from abc import ABC, abstractmethod
+import uuid
+from collections import deque
+from app.instrumentation import metrics
+from app.lazy_import import lazy_import
+
+np = lazy_import('numpy')  # Imported on first use, see app/lazy_import.py
+pd = lazy_import('pandas')
+
+try:
+    import fcntl
+except ImportError:  # Windows has no flock; the shared backend then only coordinates threads
+    fcntl = None
+
+HISTORY_COLUMNS = ['Timestamp', 'Command']
+TIMESTAMP_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+
+class HistoryBackend(ABC):
+    """Storage interface for the command history.
+
+    Records are (timestamp, command) tuples with the timestamp formatted as
+    ``TIMESTAMP_FORMAT``; how they are laid out on disk is up to the backend.
+    """
+
+    shared = False  # True when other processes write the same history at the same time
+
+    def __init__(self, path, max_records):
+        self.path = path
+        self.max_records = max_records
+
+    @abstractmethod
+    def read_tail(self):
+        """Returns the latest ``max_records`` records as (timestamp, command) tuples."""
+
+    @abstractmethod
+    def iter_records(self):
+        """Yields every stored record, oldest first (used for migrations)."""
+
+    @abstractmethod
+    def append(self, timestamp, command):
+        """Adds one record to the end of the history."""
+
+    @abstractmethod
+    def rewrite(self, records):
+        """Replaces the whole history with ``records``."""
+
+    def update(self, edit):
+        """Replaces the latest ``max_records`` records with ``edit(records)``; returns the new records.
+
+        Backends shared between processes apply ``edit`` to what is stored right now, under
+        their lock, so records that other writers appended are kept.
+        """
+        records = list(edit(self.read_tail()))
+        self.rewrite(records)
+        return records
+
+    def version(self):
+        """Changes whenever another process changed the stored history; None if only this one writes it."""
+        return None
+
+    def load_frame(self):
+        """The latest ``max_records`` records as a DataFrame."""
+        return pd.DataFrame(self.read_tail(), columns=HISTORY_COLUMNS)
+
+    def count(self):
+        """Number of records ``read_tail`` would return."""
+        return len(self.read_tail())
+
+    def read_page(self, offset, limit):
+        """``limit`` records of the latest ``max_records``, starting ``offset`` records after the oldest."""
+        return self.read_tail()[offset:offset + limit]
+
+    def close(self):
+        """Releases open files; appended records must be on disk afterwards."""
+
+
+class AppendOnlyHistoryLog(HistoryBackend):
+    """Append-only (write-ahead) storage for the command history CSV.
+
+    Every new record is appended to the file as a single line, so adding a command
+    costs the same no matter how long the history already is. Once the file grows
+    past ``compact_threshold`` records, a background thread rewrites it down to the
+    latest ``max_records`` rows and atomically swaps it in.
+    """
+
+    def __init__(self, path, max_records, fsync_every=0, compact_threshold=None):
+        super().__init__(path, max_records)
+        self.fsync_every = fsync_every  # 0 -> never fsync explicitly, N -> fsync every N appends
+        self.compact_threshold = compact_threshold or max(2 * max_records, max_records + 100)
+        self._lock = threading.Lock()
+        self._handle = None
+        self._unsynced = 0
+        self._line_count = 0
+        self._generation = 0  # Bumped on every full rewrite so a running compaction can back off
+        self._compactor = None
+
+    def read_tail(self):
+        """Returns the latest ``max_records`` records as (timestamp, command) tuples."""
+        if not os.path.exists(self.path):
+            return []
+        with self._lock, open(self.path, newline='', encoding='utf-8') as handle:
+            metrics.increment('history.bytes_read', os.fstat(handle.fileno()).st_size)
+            reader = csv.reader(handle)
+            next(reader, None)  # Skip the header
+            tail = deque(maxlen=self.max_records)
+            count = 0
+            for row in reader:
+                if len(row) >= 2:
+                    tail.append((row[0], row[1]))
+                    count += 1
+            self._line_count = count
+        return list(tail)
+
+    def iter_records(self):
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, newline='', encoding='utf-8') as handle:
+            reader = csv.reader(handle)
+            next(reader, None)
+            for row in reader:
+                if len(row) >= 2:
+                    yield row[0], row[1]
+
+    def load_frame(self):
+        if not os.path.exists(self.path):
+            return pd.DataFrame(columns=HISTORY_COLUMNS)
+        metrics.increment('history.bytes_read', os.path.getsize(self.path))
+        return pd.read_csv(self.path).tail(self.max_records).reset_index(drop=True)
+
+    def append(self, timestamp, command):
+        """Appends one record to the end of the log."""
+        line = self._format_rows([(timestamp, command)])
+        with self._lock:
+            handle = self._open_for_append()
+            handle.write(line)
+            handle.flush()
+            metrics.increment('history.bytes_written', len(line.encode('utf-8')))
+            self._line_count += 1
+            self._unsynced += 1
+            if self.fsync_every and self._unsynced >= self.fsync_every:
+                os.fsync(handle.fileno())
+                self._unsynced = 0
+            needs_compaction = self._line_count > self.compact_threshold
+        if needs_compaction:
+            self.compact_in_background()
+
+    def rewrite(self, records):
+        """Replaces the whole log with ``records`` (used by save, clear and delete)."""
+        with self._lock:
+            self._close_handle()
+            self._write_atomically(self._format_rows(records, header=True))
+            self._line_count = len(records)
+            self._generation += 1
+
+    def compact_in_background(self):
+        """Starts a compaction thread unless one is already running."""
+        with self._lock:
+            if self._compactor is not None and self._compactor.is_alive():
+                return
+            self._compactor = threading.Thread(target=self.compact, name='history-compactor', daemon=True)
+            self._compactor.start()
+
+    def compact(self):
+        """Trims the log file down to the latest ``max_records`` records.
+
+        The bulk of the file is read without holding the lock; only the records that
+        were appended while compacting are copied over under the lock.
+        """
+        if not os.path.exists(self.path):
+            return
+        with self._lock:
+            if self._handle is not None:
+                self._handle.flush()
+            snapshot_size = os.path.getsize(self.path)
+            generation = self._generation
+        with open(self.path, 'rb') as handle:
+            head = handle.read(snapshot_size).decode('utf-8')
+        reader = csv.reader(io.StringIO(head, newline=''))
+        next(reader, None)
+        tail = deque(((row[0], row[1]) for row in reader if len(row) >= 2), maxlen=self.max_records)
+        kept = self._format_rows(tail, header=True)
+        with self._lock:
+            if generation != self._generation:
+                return  # The log was rewritten meanwhile, nothing left to compact
+            self._close_handle()
+            with open(self.path, 'rb') as handle:
+                handle.seek(snapshot_size)
+                appended = handle.read().decode('utf-8')
+            self._write_atomically(kept + appended)
+            self._line_count = len(tail) + appended.count('\n')
+        logging.info(f"Compacted command history to {len(tail)} records.")
+
+    def wait_for_compaction(self):
+        compactor = self._compactor
+        if compactor is not None:
+            compactor.join()
+
+    def close(self):
+        """Flushes, fsyncs and closes the append handle."""
+        self.wait_for_compaction()
+        with self._lock:
+            self._close_handle()
+
+    def _open_for_append(self):
+        if self._handle is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            is_new = not os.path.exists(self.path) or os.path.getsize(self.path) == 0
+            self._handle = open(self.path, 'a', newline='', encoding='utf-8')  # pylint: disable=consider-using-with
+            if is_new:
+                self._handle.write(self._format_rows([], header=True))
+        return self._handle
+
+    def _close_handle(self):
+        if self._handle is not None:
+            self._handle.flush()
+            if self._unsynced:
+                os.fsync(self._handle.fileno())
+                self._unsynced = 0
+            self._handle.close()
+            self._handle = None
+
+    def _write_atomically(self, text):
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        temp_path = f"{self.path}.tmp"
+        metrics.increment('history.bytes_written', len(text.encode('utf-8')))
+        with open(temp_path, 'w', newline='', encoding='utf-8') as handle:
+            handle.write(text)
+            handle.flush()
+            os.fsync(handle.fileno())
+        os.replace(temp_path, self.path)
+
+    @staticmethod
+    def _format_rows(records, header=False):
+        buffer = io.StringIO()
+        writer = csv.writer(buffer, lineterminator='\n')
+        if header:
+            writer.writerow(HISTORY_COLUMNS)
+        writer.writerows(records)
+        return buffer.getvalue()
+
+
+def parse_timestamps(timestamps):
+    """Formatted timestamps -> int64 seconds, reading the naive wall-clock time as UTC."""
+    # NumPy parses 'YYYY-MM-DD HH:MM:SS' directly, so reading the history does not need pandas
+    return np.array(list(timestamps), dtype='datetime64[s]').astype(ColumnarHistoryLog.TIMESTAMP_DTYPE)
+
+
+@functools.lru_cache(maxsize=64)  # Commands often arrive within the same second
+def timestamp_to_epoch(timestamp):
+    return calendar.timegm(time.strptime(timestamp, TIMESTAMP_FORMAT))
+
+
+def format_timestamps(seconds):
+    """int64 seconds -> formatted timestamps; datetime_as_string is far faster than strftime."""
+    iso = np.datetime_as_string(np.asarray(seconds, dtype=np.int64).astype('datetime64[s]'), unit='s')
+    return [value.replace('T', ' ') for value in iso.tolist()]
+
+
+class ColumnarHistoryLog(HistoryBackend):
+    """Binary columnar storage: one raw file per column inside the ``path`` directory.
+
+    ``timestamps.i8`` holds int64 epoch seconds and ``commands.u4`` uint32 codes into
+    ``dictionary.json``, the list of distinct command names. An append writes 12 bytes.
+    A rewrite writes both columns as a new generation (``timestamps.<n>.i8``,
+    ``commands.<n>.u4``) and commits it by replacing ``columns.json``, which names the
+    current generation and its length, so a crash never leaves the two columns of
+    different rewrites side by side.
+    Loading memory-maps both columns and only touches the last ``max_records`` rows, so
+    startup time does not depend on how long the history is. Timestamps are the naive
+    wall-clock time encoded as if it were UTC, which makes them round-trip exactly.
+    """
+
+    TIMESTAMPS = 'timestamps.i8'
+    COMMANDS = 'commands.u4'
+    DICTIONARY = 'dictionary.json'
+    MARKER = 'columns.json'
+    TIMESTAMP_DTYPE = '<i8'
+    CODE_DTYPE = '<u4'
+
+    def __init__(self, path, max_records, fsync_every=0, compact_threshold=None):
+        super().__init__(path, max_records)
+        self.fsync_every = fsync_every
+        self.compact_threshold = compact_threshold or max(2 * max_records, max_records + 100)
+        self._lock = threading.Lock()
+        self._handles = None
+        self._unsynced = 0
+        self._dictionary = self._read_dictionary()
+        self._codes = {name: code for code, name in enumerate(self._dictionary)}
+        self._generation = 0  # Generation 0 is the plain file names of logs written before the marker
+        self._length = self._repair()
+
+    def __len__(self):
+        return self._length
+
+    def read_tail(self):
+        timestamps, codes = self._tail_columns()
+        names = np.asarray(self._dictionary, dtype=object)[codes].tolist()
+        return list(zip(format_timestamps(timestamps), names))
+
+    def count(self):
+        return min(self._length, self.max_records)
+
+    def read_page(self, offset, limit):
+        with self._lock:
+            self._flush_handles()
+            start = max(0, self._length - self.max_records) + offset
+            timestamps, codes = self._columns(start, min(start + limit, self._length))
+        names = np.asarray(self._dictionary, dtype=object)[codes].tolist()
+        return list(zip(format_timestamps(timestamps), names))
+
+    def iter_records(self, chunk_size=65_536):
+        with self._lock:
+            self._flush_handles()
+            length = self._length
+        for start in range(0, length, chunk_size):
+            timestamps, codes = self._columns(start, min(start + chunk_size, length))
+            names = np.asarray(self._dictionary, dtype=object)[codes].tolist()
+            yield from zip(format_timestamps(timestamps), names)
+
+    def load_frame(self):
+        timestamps, codes = self._tail_columns()
+        # The command column stays dictionary-encoded: a categorical over the stored names
+        commands = pd.Categorical.from_codes(codes.astype(np.int64), categories=self._dictionary)
+        return pd.DataFrame({'Timestamp': format_timestamps(timestamps), 'Command': commands},
+                            columns=HISTORY_COLUMNS)
+
+    def append(self, timestamp, command):
+        seconds = timestamp_to_epoch(timestamp)
+        with self._lock:
+            code = self._intern([command])[0]
+            timestamps, commands = self._open_for_append()
+            timestamps.write(struct.pack('<q', seconds))
+            commands.write(struct.pack('<I', code))
+            metrics.increment('history.bytes_written', 12)
+            timestamps.flush()
+            commands.flush()
+            self._length += 1
+            self._unsynced += 1
+            if self.fsync_every and self._unsynced >= self.fsync_every:
+                self._fsync_handles()
+            if self._length > self.compact_threshold:
+                # Only the last max_records rows are copied, so this stays cheap however old the file is
+                self._write_columns(*self._columns(self._length - self.max_records, self._length))
+                logging.info(f"Compacted command history to {self.max_records} records.")
+
+    def rewrite(self, records):
+        records = list(records)
+        timestamps = parse_timestamps(timestamp for timestamp, _ in records)
+        with self._lock:
+            codes = np.asarray(self._intern([command for _, command in records]), dtype=self.CODE_DTYPE)
+            self._write_columns(timestamps, codes)
+
+    def close(self):
+        with self._lock:
+            self._close_handles()
+
+    def _file(self, name):
+        return os.path.join(self.path, name)
+
+    def _read_dictionary(self):
+        try:
+            with open(self._file(self.DICTIONARY), encoding='utf-8') as handle:
+                return json.load(handle)
+        except FileNotFoundError:
+            return []
+
+    def _read_marker(self):
+        try:
+            with open(self._file(self.MARKER), encoding='utf-8') as handle:
+                return json.load(handle)
+        except FileNotFoundError:
+            return {'generation': 0, 'length': 0}
+
+    def _column_file(self, name, generation=None):
+        """Path of a column file of ``generation``, by default the current one."""
+        generation = self._generation if generation is None else generation
+        if not generation:
+            return self._file(name)
+        stem, extension = os.path.splitext(name)
+        return self._file(f"{stem}.{generation}{extension}")
+
+    def _intern(self, commands):
+        """Codes for ``commands``; new names are added to the dictionary before any row uses them."""
+        added = False
+        for command in commands:
+            if command not in self._codes:
+                self._codes[command] = len(self._dictionary)
+                self._dictionary.append(command)
+                added = True
+        if added:
+            os.makedirs(self.path, exist_ok=True)
+            temp_path = f"{self._file(self.DICTIONARY)}.tmp"
+            with open(temp_path, 'w', encoding='utf-8') as handle:
+                json.dump(self._dictionary, handle)
+            os.replace(temp_path, self._file(self.DICTIONARY))
+        return [self._codes[command] for command in commands]
+
+    def _repair(self):
+        """Returns to the last committed state: the marker's generation, cut to its complete rows.
+
+        Files of any other generation belong to a rewrite that crashed before its marker, or to
+        the generation it replaced, and are removed. Appends only add to the end of both columns,
+        so a crash can leave at most half an append there.
+        """
+        marker = self._read_marker()
+        self._generation = marker['generation']
+        current = {os.path.basename(self._column_file(name)) for name in (self.TIMESTAMPS, self.COMMANDS)}
+        if os.path.isdir(self.path):
+            for name in os.listdir(self.path):
+                if name.startswith(('timestamps.', 'commands.')) and name not in current:
+                    os.remove(self._file(name))
+        columns = ((self._column_file(self.TIMESTAMPS), self.TIMESTAMP_DTYPE),
+                   (self._column_file(self.COMMANDS), self.CODE_DTYPE))
+        sizes = {path: os.path.getsize(path) if os.path.exists(path) else 0 for path, _ in columns}
+        length = min(sizes[path] // np.dtype(dtype).itemsize for path, dtype in columns)
+        if length < marker['length']:
+            logging.error(f"Command history columns in '{self.path}' hold {length} rows, "
+                          f"{marker['length']} were committed; the missing rows are lost.")
+        for path, dtype in columns:
+            if sizes[path] != length * np.dtype(dtype).itemsize:
+                os.truncate(path, length * np.dtype(dtype).itemsize)
+        return length
+
+    def _tail_columns(self):
+        with self._lock:
+            self._flush_handles()
+            return self._columns(max(0, self._length - self.max_records), self._length)
+
+    def _columns(self, start, stop):
+        """Rows ``start:stop`` of both columns, read through a memory map."""
+        if stop <= start:
+            return np.empty(0, self.TIMESTAMP_DTYPE), np.empty(0, self.CODE_DTYPE)
+        columns = []
+        for name, dtype in ((self.TIMESTAMPS, self.TIMESTAMP_DTYPE), (self.COMMANDS, self.CODE_DTYPE)):
+            mapped = np.memmap(self._column_file(name), dtype=dtype, mode='r', offset=start * np.dtype(dtype).itemsize,
+                               shape=(stop - start,))
+            columns.append(np.array(mapped))  # Copy so the mapping is released right away
+            metrics.increment('history.bytes_read', mapped.nbytes)
+            del mapped
+        return tuple(columns)
+
+    def _write_columns(self, timestamps, codes):
+        """Writes both columns as the next generation and commits it by replacing the marker last."""
+        self._close_handles()
+        os.makedirs(self.path, exist_ok=True)
+        generation = self._generation + 1
+        for name, column in ((self.COMMANDS, codes), (self.TIMESTAMPS, timestamps)):
+            data = np.ascontiguousarray(column).tobytes()
+            metrics.increment('history.bytes_written', len(data))
+            with open(self._column_file(name, generation), 'wb') as handle:
+                handle.write(data)
+                handle.flush()
+                os.fsync(handle.fileno())
+        temp_path = f"{self._file(self.MARKER)}.tmp"
+        with open(temp_path, 'w', encoding='utf-8') as handle:
+            json.dump({'generation': generation, 'length': len(codes)}, handle)
+            handle.flush()
+            os.fsync(handle.fileno())
+        os.replace(temp_path, self._file(self.MARKER))  # The commit: a crash before it keeps the old generation
+        previous, self._generation = self._generation, generation
+        for name in (self.TIMESTAMPS, self.COMMANDS):
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(self._column_file(name, previous))
+        self._length = len(codes)
+
+    def _open_for_append(self):
+        if self._handles is None:
+            os.makedirs(self.path, exist_ok=True)
+            # pylint: disable=consider-using-with
+            self._handles = (open(self._column_file(self.TIMESTAMPS), 'ab'), open(self._column_file(self.COMMANDS), 'ab'))
+        return self._handles
+
+    def _flush_handles(self):
+        if self._handles is not None:
+            for handle in self._handles:
+                handle.flush()
+
+    def _fsync_handles(self):
+        for handle in self._handles:
+            os.fsync(handle.fileno())
+        self._unsynced = 0
+
+    def _close_handles(self):
+        if self._handles is not None:
+            self._flush_handles()
+            if self._unsynced:
+                self._fsync_handles()
+            for handle in self._handles:
+                handle.close()
+            self._handles = None
+
+
+class SharedHistoryLog(HistoryBackend):
+    """History that several app instances on one host can write at the same time.
+
+    ``path`` is a directory. Every writer appends to its own segment file, so appends from
+    different processes never contend; each line carries a nanosecond timestamp and
+    readers merge the segments and the compacted ``history.csv`` in timestamp order.
+    An advisory lock on ``.lock`` coordinates the processes: appends and reads hold it
+    shared, compaction and rewrites hold it exclusively while they fold the segments into
+    ``history.csv`` and delete them. A writer whose segment was folded away starts a new
+    one on its next append, so no record is lost.
+    """
+
+    BASE = 'history.csv'
+    LOCK = '.lock'
+    SEGMENT_PREFIX = 'segment-'
+    shared = True
+
+    def __init__(self, path, max_records, fsync_every=0, compact_threshold=None):
+        super().__init__(path, max_records)
+        self.fsync_every = fsync_every
+        self.compact_threshold = compact_threshold or max(2 * max_records, max_records + 100)
+        self._lock = threading.Lock()
+        self._lock_fd = None
+        self._segment_fd = None
+        self._segment_lines = 0
+        self._unsynced = 0
+        self._last_ns = 0
+        if fcntl is None:
+            logging.warning("File locking is not available; concurrent app instances may corrupt the history.")
+
+    def read_tail(self):
+        with self._lock, self._file_lock():
+            return [(timestamp, command) for _, timestamp, command
+                    in deque(self._merged(self._segment_names()), maxlen=self.max_records)]
+
+    def iter_records(self):
+        with self._lock, self._file_lock():
+            records = [(timestamp, command) for _, timestamp, command in self._merged(self._segment_names())]
+        yield from records
+
+    def append(self, timestamp, command):
+        with self._lock:
+            self._last_ns = max(time.time_ns(), self._last_ns + 1)  # Unique and increasing per writer
+            line = self._format_rows([(self._last_ns, timestamp, command)]).encode('utf-8')
+            with self._file_lock():
+                segment_fd = self._open_segment()
+                os.write(segment_fd, line)  # One write on an O_APPEND descriptor: the line lands whole
+                metrics.increment('history.bytes_written', len(line))
+                self._segment_lines += 1
+                self._unsynced += 1
+                if self.fsync_every and self._unsynced >= self.fsync_every:
+                    os.fsync(segment_fd)
+                    self._unsynced = 0
+            needs_compaction = self._segment_lines > self.compact_threshold
+        if needs_compaction:
+            self.compact()
+
+    def version(self):
+        """Name, size and mtime of history.csv and the segments: one directory scan, no file is read."""
+        try:
+            entries = [entry for entry in os.scandir(self.path)
+                       if entry.name == self.BASE or entry.name.startswith(self.SEGMENT_PREFIX)]
+        except FileNotFoundError:
+            return ()
+        versions = []
+        for entry in entries:
+            try:
+                stat = entry.stat()
+            except FileNotFoundError:
+                continue  # Folded away by a compaction while scanning
+            versions.append((entry.name, stat.st_size, stat.st_mtime_ns))
+        return tuple(sorted(versions))
+
+    def compact(self):
+        """Folds every writer's segment into ``history.csv``, keeping the latest ``max_records``."""
+        with self._lock, self._file_lock(exclusive=True):
+            segments = self._segment_names()
+            tail = deque(self._merged(segments), maxlen=self.max_records)
+            self._replace_base(tail, segments)
+        logging.info(f"Compacted shared command history to {len(tail)} records.")
+
+    def rewrite(self, records):
+        records = list(records)
+        with self._lock, self._file_lock(exclusive=True):
+            self._rewrite_locked(records, self._segment_names())
+
+    def update(self, edit):
+        """Applies ``edit`` to the merged latest records of every writer, all under the exclusive lock."""
+        with self._lock, self._file_lock(exclusive=True):
+            segments = self._segment_names()
+            tail = [(timestamp, command) for _, timestamp, command
+                    in deque(self._merged(segments), maxlen=self.max_records)]
+            records = list(edit(tail))
+            self._rewrite_locked(records, segments)
+        return records
+
+    def _rewrite_locked(self, records, segments):
+        # Merge keys on the same clock as append(), counting down from now in the given order, so
+        # later appends of every writer sort after them. The formatted timestamps are local time
+        # and would be hours off as keys in zones away from UTC.
+        self._last_ns = max(time.time_ns(), self._last_ns + len(records))
+        first_ns = self._last_ns - len(records) + 1
+        rows = [(first_ns + index, timestamp, command) for index, (timestamp, command) in enumerate(records)]
+        self._replace_base(rows, segments)
+
+    def close(self):
+        with self._lock:
+            self._close_segment()
+            if self._lock_fd is not None:
+                os.close(self._lock_fd)
+                self._lock_fd = None
+
+    def _file(self, name):
+        return os.path.join(self.path, name)
+
+    @contextlib.contextmanager
+    def _file_lock(self, exclusive=False):
+        if self._lock_fd is None:
+            os.makedirs(self.path, exist_ok=True)
+            self._lock_fd = os.open(self._file(self.LOCK), os.O_RDWR | os.O_CREAT, 0o644)
+        if fcntl is None:
+            yield
+            return
+        fcntl.flock(self._lock_fd, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+        try:
+            yield
+        finally:
+            fcntl.flock(self._lock_fd, fcntl.LOCK_UN)
+
+    def _segment_names(self):
+        return sorted(name for name in os.listdir(self.path)
+                      if name.startswith(self.SEGMENT_PREFIX) and name.endswith('.csv'))
+
+    def _open_segment(self):
+        if self._segment_fd is not None and os.fstat(self._segment_fd).st_nlink == 0:
+            self._close_segment()  # Another instance compacted our segment into history.csv
+        if self._segment_fd is None:
+            name = f"{self.SEGMENT_PREFIX}{os.getpid()}-{uuid.uuid4().hex[:8]}.csv"
+            self._segment_fd = os.open(self._file(name), os.O_WRONLY | os.O_APPEND | os.O_CREAT | os.O_EXCL, 0o644)
+            self._segment_lines = 0
+        return self._segment_fd
+
+    def _close_segment(self):
+        if self._segment_fd is not None:
+            if self._unsynced:
+                os.fsync(self._segment_fd)
+                self._unsynced = 0
+            os.close(self._segment_fd)
+            self._segment_fd = None
+
+    def _read_rows(self, name):
+        """(ns, timestamp, command) rows of one file; an unfinished last line is ignored."""
+        try:
+            with open(self._file(name), 'rb') as handle:
+                data = handle.read()
+        except FileNotFoundError:
+            return []
+        metrics.increment('history.bytes_read', len(data))
+        text = data[:data.rfind(b'\n') + 1].decode('utf-8')
+        rows = []
+        for row in csv.reader(io.StringIO(text, newline='')):
+            if len(row) >= 3 and row[0].isdigit():
+                rows.append((int(row[0]), row[1], row[2]))
+        return rows
+
+    def _merged(self, segments):
+        """All rows in timestamp order; each file is already sorted, so this is a k-way merge."""
+        sources = [self._read_rows(self.BASE)] + [self._read_rows(name) for name in segments]
+        return heapq.merge(*sources, key=lambda row: row[0])
+
+    def _replace_base(self, rows, segments):
+        temp_path = self._file(f"{self.BASE}.{os.getpid()}.tmp")
+        text = self._format_rows(rows)
+        metrics.increment('history.bytes_written', len(text.encode('utf-8')))
+        with open(temp_path, 'w', newline='', encoding='utf-8') as handle:
+            handle.write(text)
+            handle.flush()
+            os.fsync(handle.fileno())
+        os.replace(temp_path, self._file(self.BASE))
+        for name in segments:
+            os.remove(self._file(name))
+        self._close_segment()
+
+    @staticmethod
+    def _format_rows(rows):
+        buffer = io.StringIO()
+        csv.writer(buffer, lineterminator='\n').writerows(rows)
+        return buffer.getvalue()
+
+
+class SqliteHistoryLog(HistoryBackend):
+    """History in a local SQLite database file running in WAL mode.
+
+    Appends are buffered and inserted with one prepared ``executemany`` per ``batch_size``
+    records, or once ``flush_interval`` seconds have passed; reads and ``close`` flush
+    first. Timestamps are stored as epoch seconds, both columns are indexed and pages are
+    read with LIMIT/OFFSET, so a long history is never loaded in full.
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS history (
+            id INTEGER PRIMARY KEY,
+            timestamp INTEGER NOT NULL,
+            command TEXT NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS history_timestamp ON history (timestamp);
+        CREATE INDEX IF NOT EXISTS history_command ON history (command, timestamp);
+    """
+    INSERT = 'INSERT INTO history (timestamp, command) VALUES (?, ?)'
+    SELECT_PAGE = 'SELECT timestamp, command FROM history ORDER BY id LIMIT ? OFFSET ?'
+
+    def __init__(self, path, max_records, fsync_every=0, compact_threshold=None, batch_size=64,
+                 flush_interval=1.0):
+        super().__init__(path, max_records)
+        self.compact_threshold = compact_threshold or max(2 * max_records, max_records + 100)
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.synchronous = 'FULL' if fsync_every else 'NORMAL'  # NORMAL is safe with WAL, just not durable
+        self._lock = threading.Lock()
+        self._connection = None
+        self._pending = []
+        self._last_flush = time.monotonic()
+        self._rows = 0  # Rows in the table, kept up to date to avoid COUNT(*) queries
+
+    def read_tail(self):
+        return self.read_page(max(0, self.count() - self.max_records), self.max_records)
+
+    def iter_records(self, chunk_size=10_000):
+        last_id = -1
+        while True:
+            with self._lock:
+                self._flush()
+                rows = self._connect().execute('SELECT id, timestamp, command FROM history WHERE id > ? '
+                                               'ORDER BY id LIMIT ?', (last_id, chunk_size)).fetchall()
+            if not rows:
+                return
+            last_id = rows[-1][0]
+            yield from zip(format_timestamps([row[1] for row in rows]), [row[2] for row in rows])
+
+    def count(self):
+        with self._lock:
+            self._flush()
+            return min(self._rows, self.max_records)
+
+    def read_page(self, offset, limit):
+        with self._lock:
+            self._flush()
+            start = max(0, self._rows - self.max_records) + offset
+            rows = self._connect().execute(self.SELECT_PAGE, (limit, start)).fetchall()
+        return list(zip(format_timestamps([row[0] for row in rows]), [row[1] for row in rows]))
+
+    def append(self, timestamp, command):
+        with self._lock:
+            self._connect()
+            self._pending.append((timestamp_to_epoch(timestamp), command))
+            if len(self._pending) >= self.batch_size or time.monotonic() - self._last_flush >= self.flush_interval:
+                self._flush()
+
+    def rewrite(self, records):
+        records = list(records)
+        rows = zip(parse_timestamps(timestamp for timestamp, _ in records).tolist(),
+                   [command for _, command in records])
+        with self._lock:
+            self._pending.clear()
+            connection = self._connect()
+            with connection:
+                connection.execute('DELETE FROM history')
+                connection.executemany(self.INSERT, rows)
+            self._rows = len(records)
+
+    def close(self):
+        with self._lock:
+            if self._connection is not None:
+                self._flush()
+                self._connection.close()
+                self._connection = None
+
+    def _connect(self):
+        if self._connection is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            # Calls are serialised by self._lock, so the connection may move between threads
+            connection = sqlite3.connect(self.path, check_same_thread=False)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute(f'PRAGMA synchronous={self.synchronous}')
+            connection.executescript(self.SCHEMA)
+            self._rows = connection.execute('SELECT COUNT(*) FROM history').fetchone()[0]
+            self._connection = connection
+        return self._connection
+
+    def _flush(self):
+        self._last_flush = time.monotonic()
+        if not self._pending:
+            self._connect()
+            return
+        connection = self._connect()
+        with connection:  # One transaction per batch
+            connection.executemany(self.INSERT, self._pending)
+            self._rows += len(self._pending)
+            self._pending.clear()
+            if self._rows > self.compact_threshold:
+                connection.execute('DELETE FROM history WHERE id <= (SELECT id FROM history ORDER BY id DESC '
+                                   'LIMIT 1 OFFSET ?)', (self.max_records,))
+                self._rows = self.max_records
+
+
+HISTORY_BACKENDS = {'csv': AppendOnlyHistoryLog, 'columnar': ColumnarHistoryLog, 'shared': SharedHistoryLog,
+                    'sqlite': SqliteHistoryLog}
+DEFAULT_HISTORY_PATHS = {'csv': 'data/command_history.csv', 'columnar': 'data/command_history',
+                         'shared': 'data/command_history.d', 'sqlite': 'data/command_history.db'}
+
+
+def create_history_backend(kind, path=None, max_records=5, **options) -> HistoryBackend:
+    """Builds the history backend registered under ``kind`` (a key of HISTORY_BACKENDS)."""
+    if kind not in HISTORY_BACKENDS:
+        raise ValueError(f"Unknown history backend '{kind}', expected one of {sorted(HISTORY_BACKENDS)}")
+    return HISTORY_BACKENDS[kind](path or DEFAULT_HISTORY_PATHS[kind], max_records, **options)
+
+
+def migrate_history(source: HistoryBackend, target: HistoryBackend) -> int:
+    """Copies every record from ``source`` into ``target``, replacing its contents."""
+    records = list(source.iter_records())
+    target.rewrite(records)
+    target.close()
+    return len(records)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Convert the command history between storage formats.")
+    parser.add_argument('action', choices=['migrate'])
+    parser.add_argument('--from', dest='source', choices=sorted(HISTORY_BACKENDS), default='csv')
+    parser.add_argument('--to', dest='target', choices=sorted(HISTORY_BACKENDS), default='columnar')
+    parser.add_argument('--source-path', help="defaults to the backend's file under data/")
+    parser.add_argument('--target-path', help="defaults to the backend's file under data/")
+    args = parser.parse_args(argv)
+    source_path = args.source_path or DEFAULT_HISTORY_PATHS[args.source]
+    target_path = args.target_path or DEFAULT_HISTORY_PATHS[args.target]
+    if os.path.abspath(source_path) == os.path.abspath(target_path):
+        parser.error("source and target must be different paths")
+    # Migrations copy the full history, so no record limit applies
+    source = create_history_backend(args.source, source_path, max_records=sys.maxsize)
+    target = create_history_backend(args.target, target_path, max_records=sys.maxsize)
+    count = migrate_history(source, target)
+    print(f"Migrated {count} records from {args.source} ({source_path}) to {args.target} ({target_path}).")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
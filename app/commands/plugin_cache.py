@@ -0,0 +1,121 @@
+import hashlib
+import importlib
+import json
+import logging
+import os
+from app.commands import Command
+
+DEFAULT_MANIFEST_PATH = 'data/plugin_manifest.json'
+
+
+class LazyCommand(Command):
+    """Stands in for a plugin command until it is executed for the first time.
+
+    Only the module and class names are kept, so registering a plugin costs nothing;
+    the module is imported and the command instantiated on the first ``execute``.
+    """
+
+    def __init__(self, module_name: str, class_name: str):
+        self.module_name = module_name
+        self.class_name = class_name
+        self._instance = None
+
+    @property
+    def instance(self) -> Command:
+        if self._instance is None:
+            module = importlib.import_module(self.module_name)
+            self._instance = getattr(module, self.class_name)()
+            logging.info(f"Imported plugin command {self.module_name}.{self.class_name}")
+        return self._instance
+
+    @property
+    def cpu_bound(self) -> bool:
+        return self.instance.cpu_bound
+
+    @property
+    def is_loaded(self) -> bool:
+        return self._instance is not None
+
+    def execute(self, *args, **kwargs):
+        return self.instance.execute(*args, **kwargs)
+
+    def __reduce__(self):
+        # Sent to worker processes by name; the command is imported again on its first use there
+        return LazyCommand, (self.module_name, self.class_name)
+
+    def __getattr__(self, name):
+        # Only reached for attributes the proxy itself does not have
+        if name.startswith('_'):
+            raise AttributeError(name)
+        return getattr(self.instance, name)
+
+
+class PluginManifest:
+    """Persisted map of plugin name -> (module, class) for a plugins package.
+
+    The manifest stores a fingerprint (mtime, size and SHA-256) of every source file in the
+    package. It is only trusted while all fingerprints still match, so editing, adding or
+    removing any plugin file forces a fresh discovery.
+    """
+
+    def __init__(self, package: str, manifest_path: str = DEFAULT_MANIFEST_PATH):
+        self.package = package
+        self.package_dir = package.replace('.', '/')
+        self.manifest_path = manifest_path
+
+    def load(self):
+        """Returns the cached {plugin_name: [module, class]} entries, or None when the cache is stale."""
+        try:
+            with open(self.manifest_path, encoding='utf-8') as handle:
+                manifest = json.load(handle)
+        except (OSError, ValueError):
+            return None
+        if manifest.get('package') != self.package:
+            return None
+        files = manifest.get('files', {})
+        if set(files) != set(self.source_files()):
+            return None
+        refreshed = False
+        for path, (mtime_ns, size, digest) in files.items():
+            stat = os.stat(path)
+            if (stat.st_mtime_ns, stat.st_size) == (mtime_ns, size):
+                continue
+            # Touched but maybe not changed: the content hash has the final say
+            if stat.st_size != size or self.file_hash(path) != digest:
+                return None
+            files[path] = [stat.st_mtime_ns, stat.st_size, digest]
+            refreshed = True
+        if refreshed:
+            self.save(manifest['plugins'], files)
+        return manifest['plugins']
+
+    def save(self, plugins: dict, files: dict = None):
+        if files is None:
+            files = {}
+            for path in self.source_files():
+                stat = os.stat(path)
+                files[path] = [stat.st_mtime_ns, stat.st_size, self.file_hash(path)]
+        manifest = {'package': self.package, 'files': files, 'plugins': plugins}
+        directory = os.path.dirname(self.manifest_path)
+        try:
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            temp_path = f"{self.manifest_path}.tmp"
+            with open(temp_path, 'w', encoding='utf-8') as handle:
+                json.dump(manifest, handle, indent=1)
+            os.replace(temp_path, self.manifest_path)
+        except OSError as e:
+            logging.warning(f"Could not write the plugin manifest '{self.manifest_path}': {e}")
+
+    def source_files(self):
+        """All Python source files of the package, sub-packages included."""
+        found = []
+        for root, dirs, files in os.walk(self.package_dir):
+            dirs[:] = sorted(d for d in dirs if d != '__pycache__')
+            found.extend(os.path.join(root, name) for name in sorted(files) if name.endswith('.py'))
+        return found
+
+    @staticmethod
+    def file_hash(path):
+        with open(path, 'rb') as handle:
+            return hashlib.sha256(handle.read()).hexdigest()
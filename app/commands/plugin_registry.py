@@ -0,0 +1,261 @@
+import ast
+import importlib
+import importlib.machinery
+import logging
+import os
+import pkgutil
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from app.commands import Command
+from app.commands.plugin_cache import PluginManifest
+
+
+class PluginEntry:
+    """One registered plugin: its name and the command class behind it, imported on demand."""
+
+    def __init__(self, name: str, module_name: str, class_name: str, command_class=None, load_time: float = 0.0):
+        self.name = name
+        self.module_name = module_name
+        self.class_name = class_name
+        self.load_time = load_time  # Seconds spent importing and scanning the plugin module
+        self._command_class = command_class
+
+    @property
+    def entry_point(self) -> str:
+        return f"{self.module_name}:{self.class_name}"
+
+    @property
+    def is_loaded(self) -> bool:
+        return self._command_class is not None
+
+    def load(self):
+        """Returns the command class, importing its module the first time."""
+        if self._command_class is None:
+            start = time.perf_counter()
+            self._command_class = getattr(importlib.import_module(self.module_name), self.class_name)
+            self.load_time += time.perf_counter() - start
+        return self._command_class
+
+
+def _module_source(module_name):
+    """Source file of a module, found without importing its packages; plugins are looked up below the cwd first."""
+    base = module_name.replace('.', '/')
+    for path in (f"{base}.py", f"{base}/__init__.py"):
+        if os.path.isfile(path):
+            return path
+    search_path, prefix = None, []
+    for part in module_name.split('.'):
+        prefix.append(part)
+        spec = importlib.machinery.PathFinder.find_spec('.'.join(prefix), search_path)
+        if spec is None:
+            return None
+        search_path = spec.submodule_search_locations
+    return spec.origin if spec.origin and spec.origin.endswith('.py') else None
+
+
+def _is_abstract(function):
+    return any(getattr(decorator, 'id', getattr(decorator, 'attr', None)) == 'abstractmethod'
+               for decorator in function.decorator_list)
+
+
+class _CommandScanner:
+    """Finds the concrete Command subclasses of a module by parsing sources with ``ast``.
+
+    Base classes are followed through ``import`` and ``from ... import`` statements into the
+    other modules of the tree, so a plugin and the modules it imports (pandas, NumPy, ...)
+    stay unimported until its command is first used.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._modules = {}  # module name -> ({class name: ClassDef}, {local name: (module, name or None)})
+        self._abstract = {}  # (module, class) -> abstract method names, None when not a Command
+
+    def commands(self, module_name):
+        """Names of the concrete Command subclasses defined in the module, in source order."""
+        with self._lock:
+            classes, _ = self._parse(module_name)
+            return [name for name in classes if self._abstract_methods(module_name, name) == set()]
+
+    def _parse(self, module_name):
+        if module_name in self._modules:
+            return self._modules[module_name]
+        classes, names = {}, {}
+        path = _module_source(module_name)
+        if path is not None:
+            with open(path, encoding='utf-8') as handle:
+                tree = ast.parse(handle.read(), path)
+            package = module_name if path.endswith('__init__.py') else module_name.rpartition('.')[0]
+            for node in tree.body:
+                if isinstance(node, ast.ClassDef):
+                    classes[node.name] = node
+                elif isinstance(node, ast.ImportFrom):
+                    source = node.module or ''
+                    if node.level:
+                        parent = package.rsplit('.', node.level - 1)[0] if node.level > 1 else package
+                        source = f"{parent}.{source}" if source else parent
+                    for alias in node.names:
+                        names[alias.asname or alias.name] = (source, alias.name)
+                elif isinstance(node, ast.Import):
+                    for alias in node.names:
+                        if alias.asname:
+                            names[alias.asname] = (alias.name, None)
+                        else:
+                            top = alias.name.partition('.')[0]
+                            names[top] = (top, None)
+        self._modules[module_name] = classes, names
+        return classes, names
+
+    def _resolve(self, module_name, base):
+        """(module, class name) a base class expression of the module refers to."""
+        _, names = self._parse(module_name)
+        if isinstance(base, ast.Name):
+            return module_name, base.id
+        if isinstance(base, ast.Attribute) and isinstance(base.value, ast.Name) and base.value.id in names:
+            source, name = names[base.value.id]
+            return (source if name is None else f"{source}.{name}"), base.attr
+        return None
+
+    def _abstract_methods(self, module_name, class_name, depth=0):
+        loaded = getattr(sys.modules.get(module_name), class_name, None)
+        if isinstance(loaded, type):  # Already imported, e.g. Command itself: no need to parse it
+            return set(getattr(loaded, '__abstractmethods__', ())) if issubclass(loaded, Command) else None
+        classes, names = self._parse(module_name)
+        if class_name not in classes:  # Imported into the module: follow the import
+            source = names.get(class_name)
+            if source is None or source[1] is None or depth > 8:
+                return None
+            return self._abstract_methods(source[0], source[1], depth + 1)
+        node = classes[class_name]
+        key = (module_name, class_name)
+        if key in self._abstract:
+            return self._abstract[key]
+        self._abstract[key] = None  # Guards against cyclic bases
+        is_command = False
+        inherited = set()
+        for base in node.bases:
+            reference = self._resolve(module_name, base)
+            abstract = self._abstract_methods(*reference) if reference else None
+            if abstract is not None:
+                is_command = True
+                inherited |= abstract
+        if is_command:
+            own = {item.name: _is_abstract(item) for item in node.body
+                   if isinstance(item, (ast.FunctionDef, ast.AsyncFunctionDef))}
+            self._abstract[key] = {name for name in inherited if name not in own} | {
+                name for name, abstract in own.items() if abstract}
+        return self._abstract[key]
+
+
+class PluginRegistry:
+    """Ordered registry of the Command plugins found in a package.
+
+    Plugins are discovered once per process: ``for_package`` hands out the same registry
+    to every caller. Discovery parses the plugin sources with ``ast`` on a thread pool and
+    imports nothing; a plugin module is only imported by ``PluginEntry.load``. The time each
+    plugin took to scan and load is kept in ``load_times``. Plugins can also be registered by hand
+    with an entry-point string (``"package.module:ClassName"``) or a class.
+    """
+
+    _cache = {}
+    _cache_lock = threading.Lock()
+
+    def __init__(self, package: str, packages: bool = False, exclude=(), manifest_path: str = None, max_workers: int = 8):
+        self.package = package
+        self.packages = packages  # True: plugins are sub-packages, False: plugins are plain modules
+        self.exclude = set(exclude)
+        self.manifest_path = manifest_path
+        self.max_workers = max_workers
+        self._entries = []
+        self._by_name = {}
+
+    @classmethod
+    def for_package(cls, package: str, **kwargs) -> 'PluginRegistry':
+        """Returns the process-wide registry of ``package``, discovering it on first use."""
+        key = (package, kwargs.get('packages', False))
+        with cls._cache_lock:
+            registry = cls._cache.get(key)
+            if registry is None:
+                registry = cls(package, **kwargs)
+                registry.discover()
+                cls._cache[key] = registry
+        return registry
+
+    @classmethod
+    def clear_cache(cls):
+        with cls._cache_lock:
+            cls._cache.clear()
+
+    def register(self, name: str, target) -> PluginEntry:
+        """Registers a plugin from an entry-point string or a Command class."""
+        if isinstance(target, str):
+            module_name, _, class_name = target.partition(':')
+            entry = PluginEntry(name, module_name, class_name)
+        else:
+            entry = PluginEntry(name, target.__module__, target.__name__, command_class=target)
+        if name in self._by_name:
+            self._entries[self._entries.index(self._by_name[name])] = entry
+        else:
+            self._entries.append(entry)
+        self._by_name[name] = entry
+        return entry
+
+    def discover(self):
+        """Finds the plugins of the package, from the manifest when it is still fresh."""
+        manifest = PluginManifest(self.package, self.manifest_path) if self.manifest_path else None
+        cached = manifest.load() if manifest else None
+        if cached is not None:
+            for name, (module_name, class_name) in cached.items():
+                self.register(name, f"{module_name}:{class_name}")
+            return self
+        names = [name for _, name, is_pkg in sorted(pkgutil.iter_modules([self.package.replace('.', '/')]), key=lambda x: x[1])
+                 if is_pkg == self.packages and name not in self.exclude]
+        for name in names:
+            logging.info(f"Found plugin: {name}")  # Log for debugging/record-keeping
+        scanner = _CommandScanner()
+        with ThreadPoolExecutor(max_workers=max(1, min(self.max_workers, len(names)))) as pool:
+            results = list(pool.map(lambda name: self._scan_module(scanner, name), names))
+        for name, class_name, load_time in results:
+            if class_name is not None:
+                self.register(name, f"{self.package}.{name}:{class_name}").load_time = load_time
+                logging.info(f"Scanned plugin {self.package}.{name} in {load_time * 1000:.1f} ms")
+        if manifest:
+            manifest.save({entry.name: [entry.module_name, entry.class_name] for entry in self._entries})
+        return self
+
+    def _scan_module(self, scanner, name):
+        start = time.perf_counter()
+        try:
+            commands = scanner.commands(f"{self.package}.{name}")
+        except (OSError, SyntaxError, ValueError) as e:
+            logging.error(f"Error loading plugin {name}: {e}")  # Logging errors
+            return name, None, time.perf_counter() - start
+        # The last command defined in the plugin itself, not the ones it imports
+        return name, commands[-1] if commands else None, time.perf_counter() - start
+
+    def get(self, name: str):
+        return self._by_name.get(name)
+
+    def by_index(self, index: int):
+        """Zero-based lookup in discovery order."""
+        if 0 <= index < len(self._entries):
+            return self._entries[index]
+        return None
+
+    def names(self):
+        return [entry.name for entry in self._entries]
+
+    @property
+    def load_times(self) -> dict:
+        return {entry.name: entry.load_time for entry in self._entries}
+
+    def __iter__(self):
+        return iter(list(self._entries))
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, name):
+        return name in self._by_name
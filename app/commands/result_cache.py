@@ -0,0 +1,145 @@
+import json
+import logging
+import os
+import threading
+from collections import OrderedDict, defaultdict
+
+MISSING = object()
+
+
+class ResultCache:
+    """Bounded memo of computed results with LRU or LFU eviction.
+
+    Hits, misses and evictions are counted. With ``persist_path`` set the entries can be
+    written to a JSON file with ``save`` and are read back when the cache is created.
+    """
+
+    POLICIES = ('lru', 'lfu')
+
+    def __init__(self, max_size: int = 1024, policy: str = 'lru', persist_path: str = None):
+        if policy not in self.POLICIES:
+            raise ValueError(f"Unknown cache policy '{policy}', expected one of {self.POLICIES}")
+        self.max_size = max_size
+        self.policy = policy
+        self.persist_path = persist_path
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # key -> value, in recency order for LRU
+        # LFU bookkeeping: use count per key and, per count, the keys in recency order
+        self._counts = {}
+        self._by_count = defaultdict(OrderedDict)
+        self._min_count = 0
+        if persist_path:
+            self.load()
+
+    def get(self, key, default=MISSING):
+        with self._lock:
+            if key not in self._entries:
+                self.misses += 1
+                return default
+            self.hits += 1
+            self._touch(key)
+            return self._entries[key]
+
+    def put(self, key, value):
+        if self.max_size <= 0:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._entries[key] = value
+                self._touch(key)
+                return
+            if len(self._entries) >= self.max_size:
+                self._evict()
+            self._entries[key] = value
+            if self.policy == 'lfu':
+                self._counts[key] = 1
+                self._by_count[1][key] = None
+                self._min_count = 1
+
+    def get_or_compute(self, key, compute):
+        value = self.get(key)
+        if value is MISSING:
+            value = compute()
+            self.put(key, value)
+        return value
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._counts.clear()
+            self._by_count.clear()
+            self._min_count = 0
+
+    def reset_stats(self):
+        self.hits = self.misses = self.evictions = 0
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            'size': len(self._entries),
+            'max_size': self.max_size,
+            'policy': self.policy,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+        }
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def _touch(self, key):
+        if self.policy == 'lru':
+            self._entries.move_to_end(key)
+            return
+        count = self._counts[key]
+        del self._by_count[count][key]
+        if not self._by_count[count]:
+            del self._by_count[count]
+            if self._min_count == count:
+                self._min_count = count + 1
+        self._counts[key] = count + 1
+        self._by_count[count + 1][key] = None
+
+    def _evict(self):
+        if self.policy == 'lru':
+            self._entries.popitem(last=False)
+        else:
+            # Least frequently used; among equals the one used least recently
+            key, _ = self._by_count[self._min_count].popitem(last=False)
+            if not self._by_count[self._min_count]:
+                del self._by_count[self._min_count]
+            del self._counts[key]
+            del self._entries[key]
+        self.evictions += 1
+
+    def save(self):
+        """Writes the entries (least to most recently used) to ``persist_path``."""
+        if not self.persist_path:
+            return
+        with self._lock:
+            entries = [[list(key), value] for key, value in self._entries.items()]
+        directory = os.path.dirname(self.persist_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        temp_path = f"{self.persist_path}.tmp"
+        with open(temp_path, 'w', encoding='utf-8') as handle:
+            json.dump({'policy': self.policy, 'entries': entries}, handle)
+        os.replace(temp_path, self.persist_path)
+
+    def load(self):
+        try:
+            with open(self.persist_path, encoding='utf-8') as handle:
+                entries = json.load(handle)['entries']
+        except (OSError, ValueError, KeyError) as e:
+            if os.path.exists(self.persist_path):
+                logging.warning(f"Ignoring unreadable result cache '{self.persist_path}': {e}")
+            return
+        for key, value in entries[-self.max_size:] if self.max_size > 0 else []:
+            self.put(tuple(key), value)
@@ -0,0 +1,107 @@
+import builtins
+import contextlib
+import contextvars
+import sys
+import threading
+
+_current_session = contextvars.ContextVar('command_session', default=None)
+
+
+class CommandSession:
+    """Scripted input and captured output for commands run without a human at the prompt.
+
+    While a session is active (see ``using_session``), ``input()`` returns the scripted
+    answers one by one and everything printed goes to ``output``. Sessions are tracked in
+    a context variable, so threads and asyncio tasks can each run their own session.
+    """
+
+    def __init__(self, inputs=(), output=None):
+        self.inputs = list(inputs)
+        self.output = output
+        self._position = 0
+
+    def next_input(self, prompt=''):
+        if self._position >= len(self.inputs):
+            raise EOFError(f"No scripted input left for prompt {prompt!r}")
+        answer = self.inputs[self._position]
+        self._position += 1
+        return str(answer)
+
+    @property
+    def remaining_inputs(self):
+        return self.inputs[self._position:]
+
+
+def current_session():
+    return _current_session.get()
+
+
+@contextlib.contextmanager
+def using_session(session: CommandSession):
+    """Makes ``session`` the active session of the current thread/task."""
+    token = _current_session.set(session)
+    try:
+        yield session
+    finally:
+        _current_session.reset(token)
+
+
+class _SessionStdout:
+    """Replacement for sys.stdout that writes to the active session, if there is one."""
+
+    def __init__(self, fallback):
+        self.fallback = fallback
+
+    def _target(self):
+        session = _current_session.get()
+        if session is not None and session.output is not None:
+            return session.output
+        return self.fallback
+
+    def write(self, text):
+        return self._target().write(text)
+
+    def flush(self):
+        self._target().flush()
+
+    def __getattr__(self, name):
+        return getattr(self.fallback, name)
+
+
+_install_lock = threading.Lock()
+_install_count = 0
+_original_input = builtins.input  # What input() falls back to without a session; updated on install
+
+
+def _session_input(prompt=''):
+    session = _current_session.get()
+    if session is not None:
+        return session.next_input(prompt)
+    return _original_input(prompt)
+
+
+@contextlib.contextmanager
+def session_io():
+    """Routes input() and print() through the active session while the block runs.
+
+    Nested and concurrent uses are counted; the originals come back when the last one exits.
+    Outside a session (another thread or task without one) both keep their normal behaviour,
+    and a stream or input() that someone else installed in the meantime is left in place.
+    """
+    global _install_count, _original_input  # pylint: disable=global-statement
+    with _install_lock:
+        if _install_count == 0:
+            _original_input = builtins.input
+            sys.stdout = _SessionStdout(sys.stdout)
+            builtins.input = _session_input
+        _install_count += 1
+    try:
+        yield
+    finally:
+        with _install_lock:
+            _install_count -= 1
+            if _install_count == 0:
+                if isinstance(sys.stdout, _SessionStdout):
+                    sys.stdout = sys.stdout.fallback
+                if builtins.input is _session_input:
+                    builtins.input = _original_input
@@ -0,0 +1,372 @@
+"""Pre-forked worker processes for CPU-bound commands and functions.
+
+``PreforkWorkerPool.start`` starts its workers, normally right after the plugins are loaded,
+so they do not compete with the REPL for the GIL. The workers are forked from a fork server,
+a clean process started once that imports the cpu_bound commands' plugins, NumPy and pandas
+up front. Forking the app itself is not safe once its log writer and history compactor
+threads run: a lock one of them holds would stay locked in the child forever. Every worker
+gets the pool's cpu_bound commands. A task is a picklable function and its arguments; it
+goes to an idle worker over that worker's pipe. A command's return value comes back as a
+task result, after what it printed.
+
+Large NumPy arrays in the result, including the numeric columns of DataFrames, are written
+to ``multiprocessing.shared_memory`` by the worker. Only their names, dtypes and shapes
+travel through the pipe, so they are not pickled. A worker is replaced after
+``max_tasks_per_worker`` tasks, and also when it dies. A task whose worker dies raises
+WorkerCrashedError in the caller, and the REPL keeps running.
+"""
+import io
+import logging
+import mmap
+import os
+import pickle
+import queue
+import signal
+import threading
+import time
+import traceback
+from app.commands.session import CommandSession, session_io, using_session
+from app.instrumentation import metrics
+from app.lazy_import import lazy_import
+
+multiprocessing = lazy_import('multiprocessing')
+resource_tracker = lazy_import('multiprocessing.resource_tracker')
+shared_memory = lazy_import('multiprocessing.shared_memory')
+np = lazy_import('numpy')
+pd = lazy_import('pandas')
+
+# Smaller arrays are cheaper to pickle than to set up a shared memory block for
+SHARED_MEMORY_MIN_BYTES = 64 * 1024
+# Where POSIX shared memory blocks show up as files on Linux; elsewhere results are copied out
+SHARED_MEMORY_DIR = '/dev/shm'
+# Imported by the fork server for every worker, besides the modules of the cpu_bound commands
+PRELOAD_MODULES = ['app.commands.worker_pool', 'numpy', 'pandas']
+
+_active_pool = None  # The pool run_cpu_bound dispatches to, None inside the workers themselves
+
+
+class WorkerCrashedError(RuntimeError):
+    """The worker process running a task died before it sent a result."""
+
+
+class RemoteTaskError(RuntimeError):
+    """A task raised an exception that could not be sent back as itself; carries its traceback."""
+
+
+class _SharedArray:
+    """Stands in for an ndarray in a result; the data is in the shared memory block ``name``."""
+
+    __slots__ = ('name', 'dtype', 'shape')
+
+    def __init__(self, array):
+        block = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+        np.ndarray(array.shape, dtype=array.dtype, buffer=block.buf)[...] = array
+        self.name, self.dtype, self.shape = block.name, array.dtype.str, array.shape
+        block.close()  # The block lives on until the receiving side unlinks it
+        metrics.increment('workers.shared_bytes', array.nbytes)
+
+    def __getstate__(self):
+        return self.name, self.dtype, self.shape
+
+    def __setstate__(self, state):
+        self.name, self.dtype, self.shape = state
+
+    def load(self):
+        """The array, read from shared memory; the block's name is released right away."""
+        path = os.path.join(SHARED_MEMORY_DIR, self.name)
+        if os.path.exists(path):
+            # Map the block itself: the array needs no copy and the memory is freed with the array
+            with open(path, 'r+b') as file:
+                mapping = mmap.mmap(file.fileno(), 0)
+            os.unlink(path)
+            resource_tracker.unregister(f"/{self.name}", 'shared_memory')
+            return np.ndarray(self.shape, dtype=self.dtype, buffer=mapping)
+        block = shared_memory.SharedMemory(name=self.name)
+        try:
+            return np.ndarray(self.shape, dtype=self.dtype, buffer=block.buf).copy()
+        finally:
+            block.close()
+            block.unlink()
+
+
+class _SharedFrame:
+    """Stands in for a DataFrame: large numeric columns are _SharedArrays, the rest is pickled."""
+
+    def __init__(self, frame, threshold):
+        self.columns = frame.columns
+        self.index = frame.index
+        self.values = [pack_result(column.to_numpy(), threshold) if isinstance(column.dtype, np.dtype)
+                       else column for _, column in frame.items()]
+
+    def load(self):
+        frame = pd.DataFrame({position: unpack_result(values) for position, values in enumerate(self.values)},
+                             index=self.index)
+        frame.columns = self.columns
+        return frame
+
+
+def pack_result(value, threshold=SHARED_MEMORY_MIN_BYTES):
+    """Moves the large arrays and frames in ``value`` to shared memory; see unpack_result."""
+    module = type(value).__module__  # Checked first so NumPy and pandas are not imported for plain results
+    if module.startswith('numpy') and isinstance(value, np.ndarray):
+        if value.dtype.hasobject or value.nbytes < threshold:
+            return value
+        return _SharedArray(value)
+    if module.startswith('pandas') and isinstance(value, pd.DataFrame):
+        return _SharedFrame(value, threshold)
+    if isinstance(value, tuple):
+        packed = [pack_result(item, threshold) for item in value]
+        return type(value)(*packed) if hasattr(value, '_fields') else tuple(packed)
+    if isinstance(value, list):
+        return [pack_result(item, threshold) for item in value]
+    if isinstance(value, dict):
+        return {key: pack_result(item, threshold) for key, item in value.items()}
+    return value
+
+
+def unpack_result(value):
+    """The value pack_result was given, with the shared memory blocks read back and freed."""
+    if isinstance(value, (_SharedArray, _SharedFrame)):
+        return value.load()
+    if isinstance(value, tuple):
+        unpacked = [unpack_result(item) for item in value]
+        return type(value)(*unpacked) if hasattr(value, '_fields') else tuple(unpacked)
+    if isinstance(value, list):
+        return [unpack_result(item) for item in value]
+    if isinstance(value, dict):
+        return {key: unpack_result(item) for key, item in value.items()}
+    return value
+
+
+class _WorkerConfig:
+    """What a worker needs from its pool; sent to every new worker, so it must pickle."""
+
+    def __init__(self, pool):
+        handler = pool.command_handler
+        self.commands = {} if handler is None else {
+            name: command for name, command in handler.commands.items() if command.cpu_bound}
+        self.max_tasks_per_worker = pool.max_tasks_per_worker
+        self.shared_memory_threshold = pool.shared_memory_threshold
+        self.log_file = pool.log_file
+        self.has_handler = handler is not None
+
+    def command_handler(self):
+        if not self.has_handler:
+            return None
+        from app.commands import CommandHandler  # pylint: disable=import-outside-toplevel
+        handler = CommandHandler()
+        for name, command in self.commands.items():
+            handler.register_command(name, command)
+        return handler
+
+
+class _Worker:
+    """The parent's handle on one forked worker: its process, its pipe and how many tasks it ran."""
+
+    def __init__(self, process, connection):
+        self.process = process
+        self.connection = connection
+        self.tasks = 0
+
+    @property
+    def pid(self):
+        return self.process.pid
+
+
+class PreforkWorkerPool:
+    """A fixed number of forked worker processes; see the module docstring.
+
+    ``size`` defaults to one worker per CPU. ``run`` may be called from several threads at
+    once (e.g. by REPL server sessions); each call takes an idle worker or waits for one.
+    The workers can run the ``cpu_bound`` commands registered in ``command_handler`` when
+    the pool starts.
+    """
+
+    def __init__(self, size=None, max_tasks_per_worker=None, command_handler=None,
+                 shared_memory_threshold=SHARED_MEMORY_MIN_BYTES, log_file='logs/app.log'):
+        self.size = size or os.cpu_count() or 1
+        self.max_tasks_per_worker = max_tasks_per_worker or None
+        self.command_handler = command_handler  # Reachable from the workers, for run_command
+        self.shared_memory_threshold = shared_memory_threshold
+        self.log_file = log_file
+        self.workers = []
+        self._config = None
+        self._context = None
+        self._idle = queue.Queue()
+        self._lock = threading.Lock()
+        self.crashed = 0
+        self.recycled = 0
+
+    def start(self):
+        """Forks the workers; the pool becomes the one run_cpu_bound uses."""
+        global _active_pool  # pylint: disable=global-statement
+        # Workers must share the parent's resource tracker, which frees the blocks they leave behind
+        resource_tracker.ensure_running()
+        self._config = _WorkerConfig(self)
+        self._context = multiprocessing.get_context('forkserver')
+        modules = {type(getattr(command, 'instance', command)).__module__
+                   for command in self._config.commands.values()}
+        # Only takes effect when the fork server is not running yet; it is shared by every pool
+        self._context.set_forkserver_preload(PRELOAD_MODULES + sorted(modules - {'__main__'}))
+        for _ in range(self.size):
+            self._idle.put(self._spawn())
+        _active_pool = self
+        logging.info(f"Started {self.size} pre-forked workers: {[worker.pid for worker in self.workers]}")
+        return self
+
+    def _spawn(self):
+        parent_end, child_end = self._context.Pipe()
+        # Not daemonic, so a worker can still start its own process pool (as CsvCommand does)
+        process = self._context.Process(target=_worker_main, args=(self._config, child_end), name='command-worker')
+        process.start()
+        child_end.close()
+        worker = _Worker(process, parent_end)
+        with self._lock:
+            self.workers.append(worker)
+        return worker
+
+    def _retire(self, worker, kill=False):
+        with self._lock:
+            self.workers.remove(worker)
+        worker.connection.close()
+        if kill and worker.process.is_alive():
+            worker.process.kill()
+        worker.process.join(timeout=5)
+
+    def run(self, func, *args, **kwargs):
+        """Runs ``func(*args, **kwargs)`` in a worker and returns its result (or raises its exception)."""
+        task = (func, args, kwargs)
+        worker = self._idle.get()
+        replacement = worker
+        try:
+            with metrics.timer('workers.task'):
+                try:
+                    worker.connection.send(task)
+                    status, payload, recycle = worker.connection.recv()
+                except (EOFError, OSError) as e:
+                    self._retire(worker, kill=True)
+                    replacement = self._spawn()
+                    self.crashed += 1
+                    metrics.increment('workers.crashed')
+                    logging.error(f"Worker {worker.pid} died running {getattr(func, '__name__', func)} "
+                                  f"(exit code {worker.process.exitcode}); started worker {replacement.pid}")
+                    raise WorkerCrashedError(f"The worker process running {getattr(func, '__name__', func)} "
+                                             f"exited with code {worker.process.exitcode}") from e
+                except BaseException:
+                    # Interrupted while the task runs (Ctrl+C): the worker's reply would come out of turn
+                    self._retire(worker, kill=True)
+                    replacement = self._spawn()
+                    raise
+            worker.tasks += 1
+            if recycle:
+                self._retire(worker)
+                replacement = self._spawn()
+                self.recycled += 1
+                metrics.increment('workers.recycled')
+        finally:
+            self._idle.put(replacement)
+        if status == 'error':
+            exception, remote_traceback = payload
+            logging.error(f"Task {getattr(func, '__name__', func)} failed in a worker:\n{remote_traceback}")
+            raise exception
+        return unpack_result(payload)
+
+    def run_command(self, command_name):
+        """Runs a cpu_bound command in a worker without input; returns (what it printed, its result).
+
+        The result travels like any task result, so its large arrays and frames come back
+        through shared memory.
+        """
+        return self.run(_run_command, command_name)
+
+    def stats(self):
+        return {'size': self.size, 'workers': [worker.pid for worker in self.workers],
+                'idle': self._idle.qsize(), 'crashed': self.crashed, 'recycled': self.recycled}
+
+    def close(self, timeout=5.0):
+        """Asks the workers to exit, waits up to ``timeout`` seconds and kills the ones still running."""
+        global _active_pool  # pylint: disable=global-statement
+        if _active_pool is self:
+            _active_pool = None
+        for worker in list(self.workers):
+            try:
+                worker.connection.send(None)
+            except OSError:
+                pass
+        deadline = time.monotonic() + timeout
+        for worker in list(self.workers):
+            worker.process.join(timeout=max(0.0, deadline - time.monotonic()))
+            self._retire(worker, kill=True)
+
+
+def get_worker_pool():
+    return _active_pool
+
+
+def run_cpu_bound(func, *args, **kwargs):
+    """``func(*args, **kwargs)`` on the worker pool when one is running, otherwise right here."""
+    pool = _active_pool
+    if pool is None:
+        return func(*args, **kwargs)
+    return pool.run(func, *args, **kwargs)
+
+
+_worker_handler = None  # Inside a worker: the pool's cpu_bound commands
+
+
+def _run_command(command_name):
+    if _worker_handler is None:
+        raise RuntimeError("Commands can only run in the workers of a pool created with a command_handler")
+    output = io.StringIO()
+    result = None
+    with session_io(), using_session(CommandSession((), output=output)):
+        try:
+            result = _worker_handler.execute_command(command_name)
+        except SystemExit:
+            pass
+    return output.getvalue(), result
+
+
+def _reset_logging(log_file):
+    """Workers log to the file directly, not through the app's log pipeline thread."""
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)  # Not closed: the objects are copies of the parent's
+    if log_file:
+        handler = logging.FileHandler(log_file, mode='a')
+        handler.setFormatter(logging.Formatter('%(asctime)s - %(levelname)s - [worker %(process)d] %(message)s'))
+        root.addHandler(handler)
+
+
+def _worker_main(config, connection):
+    global _active_pool, _worker_handler  # pylint: disable=global-statement
+    _active_pool = None  # Tasks run right here, they are not dispatched again
+    signal.signal(signal.SIGINT, signal.SIG_IGN)  # Ctrl+C is for the REPL, which then replaces the worker
+    _reset_logging(config.log_file)
+    _worker_handler = config.command_handler()
+    tasks = 0
+    while True:
+        try:
+            task = connection.recv()
+        except (EOFError, OSError):
+            return  # The parent went away
+        if task is None:
+            return
+        func, args, kwargs = task
+        try:
+            reply = ('ok', pack_result(func(*args, **kwargs), config.shared_memory_threshold))
+        except BaseException as e:  # pylint: disable=broad-exception-caught
+            remote_traceback = traceback.format_exc()
+            try:
+                pickle.dumps(e)
+            except Exception:  # pylint: disable=broad-exception-caught
+                e = RemoteTaskError(f"{type(e).__name__}: {e}")
+            reply = ('error', (e, remote_traceback))
+        tasks += 1
+        recycle = config.max_tasks_per_worker is not None and tasks >= config.max_tasks_per_worker
+        try:
+            connection.send((*reply, recycle))
+        except Exception as e:  # pylint: disable=broad-exception-caught
+            connection.send(('error', (RemoteTaskError(f"The result could not be sent back: {e}"), ''), recycle))
+        if recycle:
+            return
@@ -0,0 +1,224 @@
+import atexit
+import contextlib
+import io
+import json
+import logging
+import math
+import os
+import threading
+import time
+from datetime import datetime
+from app.lazy_import import lazy_import
+
+# The profilers are only imported when PROFILE asks for them
+cProfile = lazy_import('cProfile')
+pstats = lazy_import('pstats')
+tracemalloc = lazy_import('tracemalloc')
+
+PROFILE_MODES = ('cprofile', 'tracemalloc')
+
+
+class LatencyHistogram:
+    """Log-linear histogram of durations: 8 buckets per power of two of microseconds.
+
+    Percentiles come from the bucket bounds, so they are accurate to about 6%, and
+    recording a value is one ``frexp`` and a dict update however many values there are.
+    """
+
+    SUB_BUCKETS = 8
+
+    def __init__(self):
+        self.buckets = {}  # bucket index -> count
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def record(self, seconds):
+        microseconds = seconds * 1e6
+        if microseconds < 1:
+            index = 0
+        else:
+            mantissa, exponent = math.frexp(microseconds)  # microseconds = mantissa * 2**exponent
+            index = exponent * self.SUB_BUCKETS + int((mantissa - 0.5) * 2 * self.SUB_BUCKETS)
+        self.buckets[index] = self.buckets.get(index, 0) + 1
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def _upper_bound(self, index):
+        if index == 0:
+            return 1e-6
+        exponent, sub_bucket = divmod(index, self.SUB_BUCKETS)
+        return 2.0 ** exponent * (0.5 + (sub_bucket + 1) / (2 * self.SUB_BUCKETS)) / 1e6
+
+    def percentile(self, fraction):
+        """Upper bound of the bucket holding the given fraction (0..1) of the values, in seconds."""
+        if not self.count:
+            return 0.0
+        target = fraction * self.count
+        seen = 0
+        for index in sorted(self.buckets):
+            seen += self.buckets[index]
+            if seen >= target:
+                return min(self._upper_bound(index), self.max)
+        return self.max
+
+    def summary(self):
+        return {
+            'count': self.count,
+            'total': self.total,
+            'mean': self.total / self.count if self.count else 0.0,
+            'p50': self.percentile(0.50),
+            'p95': self.percentile(0.95),
+            'p99': self.percentile(0.99),
+            'max': self.max,
+        }
+
+
+class _Timer:
+    __slots__ = ('metrics', 'name', 'start')
+
+    def __init__(self, metrics, name):
+        self.metrics = metrics
+        self.name = name
+        self.start = 0.0
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.metrics.observe(self.name, time.perf_counter() - self.start)
+
+
+_DISABLED_TIMER = contextlib.nullcontext()
+
+
+class Metrics:
+    """Process-wide latency histograms and counters.
+
+    Timers are named like ``command.greet`` or ``history.save``; counters like
+    ``csv.bytes_read``. While disabled, ``timer`` hands back a shared no-op context
+    manager and ``increment`` returns right away, so instrumented code pays almost nothing.
+    """
+
+    def __init__(self, enabled=True):
+        self.enabled = enabled
+        self.histograms = {}
+        self.counters = {}
+        self.profile = None  # ProfileCapture when profiling was requested
+        self._lock = threading.Lock()
+
+    def timer(self, name):
+        if not self.enabled:
+            return _DISABLED_TIMER
+        return _Timer(self, name)
+
+    def observe(self, name, seconds):
+        with self._lock:
+            histogram = self.histograms.get(name)
+            if histogram is None:
+                histogram = self.histograms[name] = LatencyHistogram()
+            histogram.record(seconds)
+
+    def increment(self, name, amount=1):
+        if not self.enabled:
+            return
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + amount
+
+    def reset(self):
+        with self._lock:
+            self.histograms.clear()
+            self.counters.clear()
+
+    def snapshot(self):
+        with self._lock:
+            snapshot = {
+                'generated_at': datetime.now().isoformat(timespec='seconds'),
+                'enabled': self.enabled,
+                'timers': {name: histogram.summary() for name, histogram in sorted(self.histograms.items())},
+                'counters': dict(sorted(self.counters.items())),
+            }
+        if self.profile is not None:
+            snapshot['profile'] = self.profile.summary()
+        return snapshot
+
+    def write_snapshot(self, path):
+        """Writes the snapshot as JSON (atomically) and returns the path."""
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        temp_path = f"{path}.tmp"
+        with open(temp_path, 'w', encoding='utf-8') as handle:
+            json.dump(self.snapshot(), handle, indent=2)
+        os.replace(temp_path, path)
+        return path
+
+
+class ProfileCapture:
+    """cProfile and/or tracemalloc capture for the whole session (PROFILE=cprofile,tracemalloc)."""
+
+    def __init__(self, modes, output_dir='logs', top=15):
+        unknown = set(modes) - set(PROFILE_MODES)
+        if unknown:
+            raise ValueError(f"Unknown profile mode(s) {sorted(unknown)}, expected {PROFILE_MODES}")
+        self.modes = tuple(modes)
+        self.output_dir = output_dir
+        self.top = top
+        self.profiler = None
+        self._allocations = None  # Last tracemalloc summary, kept once tracing stops
+
+    def start(self):
+        if 'cprofile' in self.modes and self.profiler is None:
+            self.profiler = cProfile.Profile()
+            self.profiler.enable()
+        if 'tracemalloc' in self.modes and not tracemalloc.is_tracing():
+            tracemalloc.start()
+        return self
+
+    def stop(self):
+        """Stops profiling and writes logs/profile.pstats when cProfile was on."""
+        if self.profiler is not None:
+            self.profiler.disable()
+            os.makedirs(self.output_dir, exist_ok=True)
+            self.profiler.dump_stats(os.path.join(self.output_dir, 'profile.pstats'))
+        if tracemalloc.is_tracing():
+            self._allocations = self._top_allocations()
+            tracemalloc.stop()
+
+    def summary(self):
+        summary = {'modes': list(self.modes)}
+        if self.profiler is not None:
+            buffer = io.StringIO()
+            pstats.Stats(self.profiler, stream=buffer).sort_stats('cumulative').print_stats(self.top)
+            summary['cprofile'] = buffer.getvalue().splitlines()
+        if tracemalloc.is_tracing():
+            summary['tracemalloc'] = self._top_allocations()
+        elif self._allocations is not None:
+            summary['tracemalloc'] = self._allocations
+        return summary
+
+    def _top_allocations(self):
+        current, peak = tracemalloc.get_traced_memory()
+        statistics = tracemalloc.take_snapshot().statistics('lineno')[:self.top]
+        return {'current_bytes': current, 'peak_bytes': peak,
+                'top': [f"{stat.traceback}: {stat.size} bytes in {stat.count} blocks" for stat in statistics]}
+
+
+metrics = Metrics()
+
+
+def configure_instrumentation(settings) -> Metrics:
+    """Applies the METRICS* and PROFILE settings (see readme) to the process-wide metrics."""
+    metrics.enabled = settings.get('METRICS', '1').lower() not in ('0', 'false', 'no')
+    modes = [mode.strip().lower() for mode in settings.get('PROFILE', '').split(',') if mode.strip()]
+    if modes and metrics.profile is None:
+        metrics.profile = ProfileCapture(modes).start()
+        atexit.register(metrics.profile.stop)
+        logging.info(f"Profiling enabled: {', '.join(modes)}")
+    snapshot_path = settings.get('METRICS_SNAPSHOT')
+    if snapshot_path and metrics.enabled:
+        atexit.register(metrics.write_snapshot, snapshot_path)
+    return metrics
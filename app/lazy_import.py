@@ -0,0 +1,44 @@
+import importlib
+import sys
+
+
+class LazyModule:
+    """Stands in for a module and imports it on the first attribute access.
+
+    ``np = lazy_import('numpy')`` at the top of a module keeps ``np.asarray(...)`` working
+    unchanged, but NumPy is only imported when that line first runs instead of when the
+    module is imported. Code that runs at import time (class attributes, annotations,
+    default arguments) must not touch the proxy, or the import happens right there.
+    """
+
+    def __init__(self, name):
+        self.__dict__['_name'] = name
+        self.__dict__['_module'] = None
+
+    def _load(self):
+        module = self.__dict__['_module']
+        if module is None:
+            module = self.__dict__['_module'] = importlib.import_module(self._name)
+        return module
+
+    @property
+    def loaded(self):
+        return self.__dict__['_module'] is not None or self._name in sys.modules
+
+    def __getattr__(self, attribute):
+        return getattr(self._load(), attribute)
+
+    def __setattr__(self, attribute, value):
+        setattr(self._load(), attribute, value)
+
+    def __dir__(self):
+        return dir(self._load())
+
+    def __repr__(self):
+        state = 'loaded' if self.loaded else 'not loaded'
+        return f"<lazy module '{self._name}' ({state})>"
+
+
+def lazy_import(name):
+    """The module itself when something already imported it, otherwise a LazyModule for it."""
+    return sys.modules.get(name) or LazyModule(name)
@@ -0,0 +1,263 @@
+import atexit
+import copy
+import json
+import logging
+import os
+import queue
+import sys
+import threading
+import time
+from logging.handlers import QueueHandler
+
+QUEUE_POLICIES = ('block', 'drop_new', 'drop_old')
+# Seconds a log call waits for room in a full queue before the record is dropped
+DEFAULT_BLOCK_TIMEOUT = 1.0
+
+
+class JsonLinesFormatter(logging.Formatter):
+    """Formats every record as one JSON object per line."""
+
+    def format(self, record):
+        entry = {
+            'time': self.formatTime(record),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            entry['exception'] = record.exc_text
+        return json.dumps(entry)
+
+
+class BoundedQueueHandler(QueueHandler):
+    """QueueHandler that applies a policy when the queue is full.
+
+    ``block`` (the default) waits up to ``block_timeout`` seconds for room, which slows the
+    logging call down instead of losing the record. ``drop_new`` discards the incoming record
+    and ``drop_old`` discards the oldest queued record to make room; both are opt-in.
+    """
+
+    def __init__(self, log_queue: queue.Queue, policy: str = 'block', block_timeout: float = DEFAULT_BLOCK_TIMEOUT):
+        super().__init__(log_queue)
+        if policy not in QUEUE_POLICIES:
+            raise ValueError(f"Unknown queue policy '{policy}', expected one of {QUEUE_POLICIES}")
+        self.policy = policy
+        self.block_timeout = block_timeout
+        self.dropped = 0
+
+    def prepare(self, record):
+        # Formatting happens on the writer thread; only resolve the message here. Resolving it in
+        # place is invisible to the other handlers, the traceback is only dropped from a copy.
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record = copy.copy(record)
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        if self.policy == 'block':
+            try:
+                self.queue.put(record, timeout=self.block_timeout)
+            except queue.Full:
+                self.dropped += 1
+            return
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            if self.policy == 'drop_old':
+                try:
+                    self.queue.get_nowait()
+                except queue.Empty:
+                    pass
+                try:
+                    self.queue.put_nowait(record)
+                    self.dropped += 1  # The oldest record made room for this one
+                    return
+                except queue.Full:
+                    pass
+            self.dropped += 1
+
+
+class RotatingBatchWriter:
+    """Writes formatted records to a file in batches and rotates it by size and/or age."""
+
+    def __init__(self, path: str, formatter: logging.Formatter, max_bytes: int = 0, backup_count: int = 5,
+                 rotate_seconds: float = 0):
+        self.path = path
+        self.formatter = formatter
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+        self.rotate_seconds = rotate_seconds
+        self._handle = None
+        self._opened_at = 0.0
+
+    def write(self, records):
+        text = "".join(f"{self.formatter.format(record)}\n" for record in records)
+        handle = self._open()
+        if self._should_rotate(len(text)):
+            self.rotate()
+            handle = self._open()
+        handle.write(text)
+        handle.flush()
+
+    def _open(self):
+        if self._handle is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            self._handle = open(self.path, 'a', encoding='utf-8')  # pylint: disable=consider-using-with
+            self._opened_at = time.monotonic()
+        return self._handle
+
+    def _should_rotate(self, incoming):
+        if self.max_bytes and self._handle.tell() and self._handle.tell() + incoming > self.max_bytes:
+            return True
+        return bool(self.rotate_seconds) and time.monotonic() - self._opened_at >= self.rotate_seconds
+
+    def rotate(self):
+        """Renames app.log -> app.log.1 -> app.log.2 ..., keeping ``backup_count`` old files."""
+        self.close()
+        if self.backup_count > 0:
+            for index in range(self.backup_count - 1, 0, -1):
+                source = f"{self.path}.{index}"
+                if os.path.exists(source):
+                    os.replace(source, f"{self.path}.{index + 1}")
+            if os.path.exists(self.path):
+                os.replace(self.path, f"{self.path}.1")
+        elif os.path.exists(self.path):
+            os.remove(self.path)
+
+    def close(self):
+        if self._handle is not None:
+            self._handle.close()
+            self._handle = None
+
+
+class LogPipeline:
+    """Non-blocking logging: records go through a bounded queue to a writer thread.
+
+    Logging calls only enqueue the record. A background thread drains the queue in batches
+    of up to ``batch_size`` records (or whatever arrived within ``flush_interval`` seconds)
+    and writes each batch with a single call.
+    """
+
+    def __init__(self, path: str, json_lines: bool = False, queue_size: int = 10_000, policy: str = 'block',
+                 block_timeout: float = DEFAULT_BLOCK_TIMEOUT, batch_size: int = 256, flush_interval: float = 0.2, max_bytes: int = 0, backup_count: int = 5,
+                 rotate_seconds: float = 0, fmt: str = '%(asctime)s - %(levelname)s - %(message)s'):
+        formatter = JsonLinesFormatter() if json_lines else logging.Formatter(fmt)
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.handler = BoundedQueueHandler(self.queue, policy=policy, block_timeout=block_timeout)
+        self.writer = RotatingBatchWriter(path, formatter, max_bytes=max_bytes, backup_count=backup_count,
+                                          rotate_seconds=rotate_seconds)
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.written = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    @property
+    def dropped(self):
+        return self.handler.dropped
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='log-writer', daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        """Writes whatever is still queued and stops the writer thread.
+
+        If records were dropped, a warning with their number is added to the log and printed.
+        """
+        if self._thread is not None:
+            self._stop.set()
+            self._thread.join()
+            self._thread = None
+        self._drain()
+        if self.dropped:
+            message = (f"{self.dropped} log records were dropped because the log queue was full "
+                       f"(LOG_QUEUE_POLICY={self.handler.policy})")
+            self._write([logging.makeLogRecord({'name': 'root', 'levelno': logging.WARNING,
+                                                'levelname': 'WARNING', 'msg': message})])
+            print(f"--- Logging warning: {message}", file=sys.stderr)
+        self.writer.close()
+
+    def _run(self):
+        while not self._stop.is_set():
+            batch = self._next_batch()
+            if batch:
+                self._write(batch)
+
+    def _next_batch(self):
+        try:
+            batch = [self.queue.get(timeout=self.flush_interval)]
+        except queue.Empty:
+            return []
+        # Give a burst a moment to fill the batch instead of writing one line at a time
+        deadline = time.monotonic() + self.flush_interval
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self.queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _drain(self):
+        batch = []
+        while True:
+            try:
+                batch.append(self.queue.get_nowait())
+            except queue.Empty:
+                break
+        if batch:
+            self._write(batch)
+
+    def _write(self, batch):
+        try:
+            self.writer.write(batch)
+            self.written += len(batch)
+        except OSError as e:
+            # The logging system itself cannot log here; report on stderr like logging does
+            print(f"--- Logging error: {e}", file=sys.stderr)
+
+
+_active_pipeline = None
+
+
+def install_log_pipeline(path: str, level=logging.INFO, **options) -> LogPipeline:
+    """Attaches a LogPipeline to the root logger once per process, like logging.basicConfig."""
+    global _active_pipeline  # pylint: disable=global-statement
+    root = logging.getLogger()
+    if _active_pipeline is not None or root.handlers:
+        return _active_pipeline
+    _active_pipeline = LogPipeline(path, **options).start()
+    root.addHandler(_active_pipeline.handler)
+    root.setLevel(level)
+    atexit.register(_active_pipeline.stop)
+    return _active_pipeline
+
+
+def options_from_environment(environ) -> dict:
+    """Reads the LOG_* settings (see docs) into LogPipeline keyword arguments."""
+    options = {
+        'json_lines': environ.get('LOG_FORMAT', 'text').lower() == 'json',
+        'policy': environ.get('LOG_QUEUE_POLICY', 'block').lower(),
+    }
+    numeric = {
+        'queue_size': ('LOG_QUEUE_SIZE', int), 'batch_size': ('LOG_BATCH_SIZE', int),
+        'flush_interval': ('LOG_FLUSH_INTERVAL', float), 'max_bytes': ('LOG_MAX_BYTES', int),
+        'backup_count': ('LOG_BACKUP_COUNT', int), 'rotate_seconds': ('LOG_ROTATE_SECONDS', float),
+        'block_timeout': ('LOG_BLOCK_TIMEOUT', float),
+    }
+    for option, (variable, cast) in numeric.items():
+        if environ.get(variable):
+            options[option] = cast(environ[variable])
+    return options
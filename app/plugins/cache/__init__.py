@@ -0,0 +1,51 @@
+import logging
+from app.commands import Command
+from app.plugins.calculator import get_result_cache
+
+class CacheCommand(Command):
+    def __init__(self):
+        self.cache = get_result_cache()
+        self.operations = {
+            "1": ("Show Statistics", self.show_statistics),
+            "2": ("Clear Cache", self.clear_cache),
+            "3": ("Save Cache", self.save_cache),
+        }
+
+    def execute(self):
+        while True:
+            print("\nCalculator Cache Operations:")
+            for key, (name, _) in self.operations.items():
+                print(f"{key}. {name}")
+            print("0. Back")
+
+            choice = input("Select an operation: ")
+            if choice == '0':
+                logging.info("User selected to go back from CacheCommand.")
+                break  # Exit to the main menu
+
+            operation = self.operations.get(choice)
+            if operation:
+                _, operation_func = operation
+                logging.info(f"Executing cache operation: {operation[0]}")
+                operation_func()
+            else:
+                logging.warning("Invalid selection in CacheCommand.")
+                print("Invalid selection. Please try again.")
+
+    def show_statistics(self):
+        stats = self.cache.stats()
+        print(f"Entries: {stats['size']}/{stats['max_size']} ({stats['policy'].upper()})")
+        print(f"Hits: {stats['hits']}, Misses: {stats['misses']}, Evictions: {stats['evictions']}")
+        print(f"Hit rate: {stats['hit_rate']:.1%}")
+
+    def clear_cache(self):
+        self.cache.clear()
+        self.cache.reset_stats()
+        print("Cache cleared successfully.")
+
+    def save_cache(self):
+        if self.cache.persist_path:
+            self.cache.save()
+            print(f"Cache saved to '{self.cache.persist_path}'.")
+        else:
+            print("Cache persistence is off, set CALC_CACHE_PERSIST=1 to keep results across restarts.")
@@ -1,50 +1,185 @@
-import pkgutil
-import importlib
+import atexit
 import logging
+import os
+from abc import abstractmethod
+from typing import NamedTuple
+import numpy as np
 from app.commands import Command
+from app.commands.plugin_registry import PluginRegistry
+from app.commands.result_cache import ResultCache
+from app.commands.worker_pool import run_cpu_bound
+from app.lazy_import import lazy_import
+
+pd = lazy_import('pandas')  # Only the batch mode reads and writes CSV files
+
+# Where the result cache is persisted when CALC_CACHE_PERSIST is on, next to the command history
+CACHE_FILE = 'data/calculator_cache.json'
+_result_cache = None
+
+
+def get_result_cache() -> ResultCache:
+    """The result cache shared by all calculator operations, configured from the environment.
+
+    CALC_CACHE_SIZE (default 1024) bounds the entries, CALC_CACHE_POLICY picks 'lru' or 'lfu'
+    and CALC_CACHE_PERSIST=1 keeps the cache across restarts.
+    """
+    global _result_cache  # pylint: disable=global-statement
+    if _result_cache is None:
+        persist = os.environ.get('CALC_CACHE_PERSIST', '').lower() in ('1', 'true', 'yes')
+        _result_cache = ResultCache(max_size=int(os.environ.get('CALC_CACHE_SIZE', 1024)),
+                                    policy=os.environ.get('CALC_CACHE_POLICY', 'lru').lower(),
+                                    persist_path=CACHE_FILE if persist else None)
+        if persist:
+            atexit.register(_result_cache.save)
+    return _result_cache
+
+
+class BatchResult(NamedTuple):
+    """Result of a vectorized batch evaluation: the values plus how many rows were rejected."""
+    values: np.ndarray
+    rejected: int
+
+
+class BinaryOperation(Command):
+    """Base class for the calculator operations that take two operands."""
+
+    @abstractmethod
+    def operate(self, a, b):
+        """Applies the operation; works element-wise on NumPy arrays as well as on floats."""
+
+    def calculate(self, a, b):
+        """Computes a single result through the shared result cache.
+
+        Keys and values are stored as float.hex() strings, so cached results are bit-identical
+        to computed ones (0.0 and -0.0 or NaN payloads never collide).
+        """
+        key = (self.__class__.__name__, float(a).hex(), float(b).hex())
+        cached = get_result_cache().get_or_compute(key, lambda: float(self.operate(a, b)).hex())
+        return float.fromhex(cached)
+
+    def apply(self, a, b):
+        """Applies the operation to floats or arrays; returns (values, rejected rows mask or None).
+
+        This is the hook the expression evaluator calls for every operator in an expression.
+        """
+        return self.operate(a, b), None
+
+    def evaluate(self, a, b) -> BatchResult:
+        """Evaluates the operation over whole operand columns in one vectorized call.
+
+        ``a`` and ``b`` can be NumPy arrays or any object supporting the buffer protocol
+        (``array.array``, ``memoryview``, ``bytes`` of doubles, ...).
+        """
+        a, b = as_operand_array(a), as_operand_array(b)
+        return BatchResult(self.operate(a, b), 0)
+
+
+def evaluate_file(operation: BinaryOperation, input_path: str, output_path: str) -> BatchResult:
+    """Evaluates the operand pairs of ``input_path`` and writes them with their results to ``output_path``."""
+    operands = pd.read_csv(input_path, header=None, usecols=[0, 1], dtype=np.float64)
+    result = operation.evaluate(operands[0].to_numpy(), operands[1].to_numpy())
+    pd.DataFrame({'a': operands[0], 'b': operands[1], 'result': result.values}).to_csv(output_path, index=False)
+    return result
+
+
+def as_operand_array(operand):
+    """Converts operands into a float64 NumPy array without copying when possible."""
+    if isinstance(operand, (bytes, bytearray)):
+        return np.frombuffer(operand, dtype=np.float64)
+    return np.asarray(operand, dtype=np.float64)
+
 
 class CalculatorCommand(Command):
     def __init__(self, plugins_package='app.plugins.calculator'):
         self.plugins_package = plugins_package
         self.operations = self.load_operations()
+        self._expressions = None  # ExpressionEvaluator over the loaded operations, built on first use
+
+    @property
+    def expressions(self):
+        if self._expressions is None:
+            # Imported here because the expression module builds on the classes defined above
+            from app.plugins.calculator.expression import ExpressionEvaluator  # pylint: disable=import-outside-toplevel
+            self._expressions = ExpressionEvaluator(self.operations.values())
+        return self._expressions
 
     def load_operations(self):
         operations = {}
-        plugin_paths = [self.plugins_package.replace('.', '/')]
-        found_plugins = pkgutil.iter_modules(plugin_paths)
-        # Sort plugins by name to ensure consistent order
-        sorted_plugins = sorted(found_plugins, key=lambda x: x[1])
-        for index, (finder, name, ispkg) in enumerate(sorted_plugins, start=1):
-            if ispkg:
-                continue  # Skip sub-packages
-            try:
-                plugin_module = importlib.import_module(f"{self.plugins_package}.{name}")
-                for attribute_name in dir(plugin_module):
-                    attribute = getattr(plugin_module, attribute_name)
-                    if issubclass(attribute, Command) and attribute is not Command:
-                        # Use numeric keys for operations based on their sorted order
-                        operations[str(index)] = attribute()
-                logging.info(f"Loaded calculator plugin: {name}")
-            except (ImportError, TypeError) as e:
-                if str(e) == "issubclass() arg 1 must be a class":
-                    continue  # Ignore this specific TypeError
-                else:
-                    logging.error(f"Error loading calculator plugin {name}: {e}")
-                    print(f"Error loading plugin {name}: {e}")  # Retain print for user feedback
-                    raise
+        # Discovery is shared with the rest of the app, so the package is only scanned once per process
+        registry = PluginRegistry.for_package(self.plugins_package)
+        for index, entry in enumerate(registry, start=1):
+            # Use numeric keys for operations based on their sorted order
+            operations[str(index)] = entry.load()()
+            logging.info(f"Loaded calculator plugin: {entry.name}")
         return operations
 
+    def run_batch(self, operation: BinaryOperation, input_path: str, output_path: str = None) -> BatchResult:
+        """Sends a whole CSV file of operand pairs (two columns, no header) through ``operation``.
+
+        With a worker pool running the file is processed in a worker process, and the result
+        values come back through shared memory.
+        """
+        if output_path is None:
+            root, _ = os.path.splitext(input_path)
+            output_path = f"{root}_results.csv"
+        result = run_cpu_bound(evaluate_file, operation, input_path, output_path)
+        logging.info(f"Batch {operation.__class__.__name__} on '{input_path}': {len(result.values)} rows, "
+                     f"{result.rejected} rejected, saved to '{output_path}'")
+        return result
+
+    def execute_batch(self):
+        choice = input("Select an operation for the batch: ")
+        operation = self.operations.get(choice)
+        if not isinstance(operation, BinaryOperation):
+            logging.warning("Invalid batch operation selected in CalculatorCommand.")
+            print("Invalid selection. Please try again.")
+            return
+        input_path = input("Enter the path of the operands file: ").strip()
+        try:
+            result = self.run_batch(operation, input_path)
+        except (OSError, ValueError) as e:
+            logging.error(f"Error running calculator batch on '{input_path}': {e}")
+            print(f"Could not process the batch file: {e}")
+            return
+        print(f"Processed {len(result.values)} rows, {result.rejected} rejected.")
+
+    def execute_expression(self):
+        from app.plugins.calculator.expression import ExpressionError  # pylint: disable=import-outside-toplevel
+        text = input("Enter an expression (e.g. a*b + c/d): ")
+        try:
+            compiled = self.expressions.compile(text)
+            values = {name: float(input(f"Enter {name}: ")) for name in compiled.variables}
+            result = compiled.evaluate(**values)
+        except (ExpressionError, ValueError) as e:
+            logging.warning(f"Invalid calculator expression '{text}': {e}")
+            print(f"Invalid expression: {e}")
+            return
+        if result.rejected:
+            logging.warning(f"Attempted division by zero in '{compiled.text}'.")
+            print("Cannot divide by zero. Please enter a valid expression.")
+            return
+        print(f"The result is {result.values}")
+        logging.info(f"Expression result: {compiled.text} = {result.values}")
+
     def execute(self):
         while True:
             print("\nCalculator Operations:")
             for key in sorted(self.operations.keys(), key=int):
                 print(f"{key}. {self.operations[key].__class__.__name__}")
+            print("b. Batch from file")
+            print("e. Evaluate expression")
             print("0. Back")
 
             choice = input("Select an operation: ")
             if choice == '0':
                 logging.info("User selected to go back from CalculatorCommand.")
                 break  # Exit to the main menu
+            if choice.lower() == 'b':
+                self.execute_batch()
+                continue
+            if choice.lower() == 'e':
+                self.execute_expression()
+                continue
 
             operation = self.operations.get(choice)
             if operation:
@@ -1,11 +1,14 @@
 import logging
-from app.commands import Command
+from app.plugins.calculator import BinaryOperation
+
+class Add(BinaryOperation):
+    def operate(self, a, b):
+        return a + b
 
-class Add(Command):
     def execute(self):
         logging.info("Executing Add command.")
         a = float(input("Enter first number: "))
         b = float(input("Enter second number: "))
-        result = a + b
+        result = self.calculate(a, b)
         print(f"The result is {result}")
         logging.info(f"Addition result: {result}")
\ No newline at end of file
@@ -1,17 +1,47 @@
 import logging
-from app.commands import Command
+import numpy as np
+from app.plugins.calculator import BinaryOperation, BatchResult, as_operand_array
+
+class Divide(BinaryOperation):
+    def operate(self, a, b):
+        return a / b
+
+    def apply(self, a, b):
+        """Divides floats or arrays; a zero divisor gives NaN and is reported in the mask instead of raising."""
+        zero_divisor = np.equal(b, 0)
+        if not zero_divisor.any():
+            return a / b, None
+        # One flag per result row, so a scalar zero divisor rejects every row of ``a``
+        zero_divisor = np.broadcast_to(zero_divisor, np.broadcast(a, b).shape)
+        values = np.divide(a, b, out=np.full(zero_divisor.shape, np.nan), where=~zero_divisor)
+        return values, zero_divisor
+
+    def evaluate(self, a, b, masked=False) -> BatchResult:
+        """Divides element-wise; rows with a zero divisor are rejected instead of raising.
+
+        Rejected rows come back as NaN, or masked when ``masked`` is True.
+        """
+        a, b = as_operand_array(a), as_operand_array(b)
+        values, zero_divisor = self.apply(a, b)
+        if zero_divisor is None:
+            zero_divisor = np.zeros(np.shape(values), dtype=bool)
+        rejected = int(np.count_nonzero(zero_divisor))
+        if rejected:
+            logging.warning(f"Rejected {rejected} rows with division by zero.")
+        if masked:
+            values = np.ma.masked_array(values, mask=zero_divisor)
+        return BatchResult(values, rejected)
 
-class Divide(Command):
     def execute(self):
         logging.info("Executing Divide command.")
         a = float(input("Enter first number: "))
         b = float(input("Enter second number: "))
-        
+
         # Look Before You Leap (LBYL)
         if b == 0: # Check before leaping
             logging.warning("Attempted division by zero.")
             print("Cannot divide by zero. Please enter a valid second number.")
         else:
-            result = a / b # No exception thrown, check performed beforehand
+            result = self.calculate(a, b) # No exception thrown, check performed beforehand
             print(f"The result is {result}")
-            logging.info(f"Division result: {result}")
\ No newline at end of file
+            logging.info(f"Division result: {result}")
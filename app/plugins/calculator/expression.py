@@ -0,0 +1,142 @@
+import ast
+import operator
+import os
+import numpy as np
+from app.commands.result_cache import MISSING, ResultCache
+from app.plugins.calculator import BatchResult, BinaryOperation, as_operand_array
+
+# Longer expressions are refused before parsing, which also bounds the nesting depth
+MAX_EXPRESSION_LENGTH = 1000
+# Which calculator plugin implements each arithmetic operator, by class name
+OPERATOR_PLUGINS = {ast.Add: 'Add', ast.Sub: 'Subtract', ast.Mult: 'Multiply', ast.Div: 'Divide'}
+OPERATOR_SYMBOLS = {ast.Add: '+', ast.Sub: '-', ast.Mult: '*', ast.Div: '/'}
+UNARY_OPERATORS = {ast.UAdd: operator.pos, ast.USub: operator.neg}
+
+
+class ExpressionError(ValueError):
+    """The expression is not valid arithmetic, or uses a name that was not given a value."""
+
+
+def _combine(first, second):
+    if first is None:
+        return second
+    if second is None:
+        return first
+    return first | second
+
+
+class CompiledExpression:
+    """An arithmetic expression checked and compiled once into a tree of closures.
+
+    Each node is a function of the variable values returning (values, rejected rows mask or
+    None), so evaluating is one call per node: on floats that is plain float arithmetic, on
+    arrays every operator is a single vectorized NumPy pass.
+    """
+
+    def __init__(self, text, node, variables):
+        self.text = text
+        self.variables = variables  # Names used in the expression, sorted
+        self._node = node
+
+    def evaluate(self, **values) -> BatchResult:
+        """Evaluates with the given variable values (floats, or arrays of one shape that broadcast).
+
+        Division by zero does not raise: like the Divide plugin's batch mode, the rows that hit a zero
+        divisor anywhere in the expression come back as NaN and are counted in ``rejected``.
+        """
+        missing = [name for name in self.variables if name not in values]
+        if missing:
+            raise ExpressionError(f"No value for {', '.join(missing)} in '{self.text}'")
+        env = {name: float(value) if np.ndim(value) == 0 else as_operand_array(value)
+               for name, value in values.items() if name in self.variables}
+        try:
+            result, rejected = self._node(env)
+        except RecursionError:
+            raise ExpressionError(f"The expression '{self.text}' is nested too deeply") from None
+        if np.ndim(result) == 0:
+            return BatchResult(float(result), int(bool(rejected)) if rejected is not None else 0)
+        return BatchResult(result, int(np.count_nonzero(rejected)) if rejected is not None else 0)
+
+    def __repr__(self):
+        return f"CompiledExpression({self.text!r})"
+
+
+class ExpressionEvaluator:
+    """Parses expressions like ``a*b + c/d`` into CompiledExpression objects, cached by their text.
+
+    The operators are carried out by the calculator plugins (Add, Subtract, Multiply, Divide),
+    through their ``apply`` method. Compiled expressions are kept in a bounded LRU cache of
+    CALC_EXPRESSION_CACHE_SIZE (default 256) entries.
+    """
+
+    def __init__(self, operations, cache_size=None):
+        self.operators = {}
+        for operation in operations:
+            for node_type, plugin_name in OPERATOR_PLUGINS.items():
+                if isinstance(operation, BinaryOperation) and type(operation).__name__ == plugin_name:
+                    self.operators[node_type] = operation
+        if cache_size is None:
+            cache_size = int(os.environ.get('CALC_EXPRESSION_CACHE_SIZE', 256))
+        self.cache = ResultCache(max_size=cache_size, policy='lru')
+
+    def compile(self, text) -> CompiledExpression:
+        """The compiled form of ``text``, from the cache when it was compiled before."""
+        text = text.strip()
+        compiled = self.cache.get(text)
+        if compiled is MISSING:
+            compiled = self._compile(text)
+            self.cache.put(text, compiled)
+        return compiled
+
+    def evaluate(self, text, **values) -> BatchResult:
+        return self.compile(text).evaluate(**values)
+
+    def _compile(self, text):
+        if not text:
+            raise ExpressionError("The expression is empty")
+        if len(text) > MAX_EXPRESSION_LENGTH:
+            raise ExpressionError(f"The expression is longer than {MAX_EXPRESSION_LENGTH} characters")
+        try:
+            tree = ast.parse(text, mode='eval')
+        except (SyntaxError, ValueError, RecursionError) as e:
+            raise ExpressionError(f"Invalid expression '{text}': {e}") from None
+        variables = set()
+        try:
+            node = self._build(tree.body, variables)
+        except RecursionError:
+            raise ExpressionError(f"The expression '{text}' is nested too deeply") from None
+        return CompiledExpression(text, node, sorted(variables))
+
+    def _build(self, node, variables):
+        """Turns one checked AST node into its closure; anything but arithmetic is refused."""
+        if isinstance(node, ast.Constant) and type(node.value) in (int, float):
+            try:
+                value = float(node.value)
+            except OverflowError:
+                raise ExpressionError(f"The number {node.value} is too large") from None
+            return lambda env: (value, None)
+        if isinstance(node, ast.Name):
+            name = node.id
+            variables.add(name)
+            return lambda env: (env[name], None)
+        if isinstance(node, ast.UnaryOp) and type(node.op) in UNARY_OPERATORS:
+            unary = UNARY_OPERATORS[type(node.op)]
+            operand = self._build(node.operand, variables)
+
+            def unary_node(env):
+                value, rejected = operand(env)
+                return unary(value), rejected
+            return unary_node
+        if isinstance(node, ast.BinOp) and type(node.op) in OPERATOR_PLUGINS:
+            plugin = self.operators.get(type(node.op))
+            if plugin is None:
+                raise ExpressionError(f"No calculator plugin provides '{OPERATOR_SYMBOLS[type(node.op)]}'")
+            left, right = self._build(node.left, variables), self._build(node.right, variables)
+
+            def binary_node(env):
+                a, a_rejected = left(env)
+                b, b_rejected = right(env)
+                values, rejected = plugin.apply(a, b)
+                return values, _combine(_combine(a_rejected, b_rejected), rejected)
+            return binary_node
+        raise ExpressionError(f"'{ast.unparse(node)}' is not supported, only numbers, names and + - * /")
@@ -1,11 +1,14 @@
 import logging
-from app.commands import Command
+from app.plugins.calculator import BinaryOperation
+
+class Multiply(BinaryOperation):
+    def operate(self, a, b):
+        return a * b
 
-class Multiply(Command):
     def execute(self):
         logging.info("Executing Multiply command.")
         a = float(input("Enter first number: "))
         b = float(input("Enter second number: "))
-        result = a * b
+        result = self.calculate(a, b)
         print(f"The result is {result}")
         logging.info(f"Multiplication result: {result}")
\ No newline at end of file
@@ -1,11 +1,14 @@
 import logging
-from app.commands import Command
+from app.plugins.calculator import BinaryOperation
+
+class Subtract(BinaryOperation):
+    def operate(self, a, b):
+        return a - b
 
-class Subtract(Command):
     def execute(self):
         logging.info("Executing Subtract command.")
         a = float(input("Enter first number: "))
         b = float(input("Enter second number: "))
-        result = a - b
+        result = self.calculate(a, b)
         print(f"The result is {result}")
         logging.info(f"Subtraction result: {result}")
\ No newline at end of file
@@ -1,60 +1,577 @@
+import glob
+import heapq
+import io
 import logging
 import os
+import pickle
+import shutil
+import sys
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
 from app.commands import Command
+from app.instrumentation import metrics
+from app.plugins.csv.manifest import APPENDED, UNCHANGED, BuildManifest, manifest_path_for
 import pandas as pd
 
+# Files bigger than this are sorted with the streaming external sort instead of in memory
+STREAMING_THRESHOLD_BYTES = 256 * 1024 * 1024
+# How many records are printed after a streaming sort unless a preview size is configured
+DEFAULT_STREAMING_PREVIEW_ROWS = 20
+
 
 class CsvCommand(Command):
-    def __init__(self):
-        """This constructor initializes with private properties, that are needed for CSV"""
+    cpu_bound = True  # Runs in a pre-forked worker when WORKER_POOL_SIZE is set
+
+    def __init__(self, streaming=None, chunk_rows=100_000, preview_rows=None,
+                 input_path=None, sort_by=None, columns=None, workers=None, incremental=None):
+        """This constructor initializes with private properties, that are needed for CSV
+
+        ``streaming`` forces the external sort on (True) or off (False); by default it is picked
+        from the input size. ``chunk_rows`` bounds how many rows are held in memory at once.
+        ``preview_rows`` limits how many records are printed (CSV_PREVIEW_ROWS in the environment),
+        by default every record is shown.
+        ``input_path`` may be a file, a directory of ``*.csv`` shards or a glob (CSV_INPUT); several
+        shards are sorted in parallel on ``workers`` processes (CSV_WORKERS, default one per CPU)
+        and merged into one output. ``sort_by`` (CSV_SORT_BY) and ``columns`` (CSV_COLUMNS, comma
+        separated) pick the sort key and the kept columns.
+        ``incremental`` (CSV_INCREMENTAL=1) keeps a manifest next to the output and skips the work
+        when the inputs did not change, or merges only the appended rows into the sorted output.
+        """
         self.__data_dir = './data'
-        self.__input_file_path = './data/gpt_states.csv'
+        self.__input_file_path = input_path or os.environ.get('CSV_INPUT') or './data/gpt_states.csv'
         self.__output_file_path = './data/sorted_states.csv'
-        self.__sort_by = 'Population'
-        self.__columns_to_keep = ['State Abbreviation', 'State Name', 'Population']
+        self.__sort_by = sort_by or os.environ.get('CSV_SORT_BY') or 'Population'
+        if columns is None and os.environ.get('CSV_COLUMNS'):
+            columns = [column.strip() for column in os.environ['CSV_COLUMNS'].split(',')]
+        self.__columns_to_keep = list(columns or ['State Abbreviation', 'State Name', 'Population'])
+        if workers is None and os.environ.get('CSV_WORKERS'):
+            workers = int(os.environ['CSV_WORKERS'])
+        self.__workers = workers or os.cpu_count() or 1
+        if incremental is None:
+            incremental = os.environ.get('CSV_INCREMENTAL', '').lower() in ('1', 'true', 'yes')
+        self.__incremental = incremental
+        self.__streaming = streaming
+        self.__chunk_rows = chunk_rows
+        if preview_rows is None and os.environ.get('CSV_PREVIEW_ROWS'):
+            preview_rows = int(os.environ['CSV_PREVIEW_ROWS'])
+        self.__preview_rows = preview_rows
+
+    def input_files(self):
+        """The input shards in name order: every ``*.csv`` of a directory, the matches of a glob, or the file itself."""
+        if os.path.isdir(self.__input_file_path):
+            return sorted(glob.glob(os.path.join(self.__input_file_path, '*.csv')))
+        if glob.has_magic(self.__input_file_path):
+            return sorted(glob.glob(self.__input_file_path))
+        return [self.__input_file_path]
+
+    def __single_input(self):
+        files = self.input_files()
+        return files[0] if len(files) == 1 else self.__input_file_path
 
     def read_sort_and_reduce(self):
         """
         Reads the CSV file, sorts it by the specified column, and reduces it to specified columns.
         """
         try:
-            df = pd.read_csv(self.__input_file_path)
-            sorted_df = df.sort_values(by=self.__sort_by)
+            df = pd.read_csv(self.__single_input())
+            # A stable sort keeps ties in file order, which the streaming mode reproduces exactly
+            sorted_df = df.sort_values(by=self.__sort_by, kind='stable')
             reduced_df = sorted_df[self.__columns_to_keep]
             return reduced_df
         except Exception as e:
             logging.error(f"Error processing the file: {e}")
             return None
     
+    def use_streaming(self):
+        if self.__streaming is not None:
+            return self.__streaming
+        return os.path.getsize(self.__single_input()) > STREAMING_THRESHOLD_BYTES
+
+    def external_sort(self, output_file_path=None):
+        """
+        Sorts the input with a bounded amount of memory and writes the reduced result to the output.
+
+        The input is read ``chunk_rows`` rows at a time, parsing only the kept columns and the sort
+        key. Each chunk is sorted and spilled to a temporary run file, then the runs are k-way merged
+        into the output. The bytes written match the in-memory path (read_sort_and_reduce + to_csv).
+        """
+        output_file_path = output_file_path or self.__output_file_path
+        usecols = list(dict.fromkeys(self.__columns_to_keep + [self.__sort_by]))
+        dtypes = None
+        with tempfile.TemporaryDirectory(prefix='csv_runs_') as spill_dir:
+            while True:
+                try:
+                    runs, unified = self.__write_sorted_runs(spill_dir, usecols, dtypes)
+                except _WidenToText:
+                    # A pinned numeric column met text further down the file, so it is text after all
+                    unified = {column: str for column in dtypes}
+                if unified is None:
+                    break
+                # Chunks disagreed on a column type: redo the runs with the type the whole file would get
+                dtypes = unified
+            self.__merge_runs(runs, output_file_path)
+        logging.info(f"Externally sorted '{self.__single_input()}' in {len(runs)} runs")
+        return output_file_path
+
+    def process_shards(self, input_files=None, output_file_path=None):
+        """
+        Sorts the shards and merges them into one sorted output, the same bytes as sorting the concatenated shards.
+
+        Shards that fit in memory together (see ``shards_fit_in_memory``) are concatenated and sorted in this
+        process, which is faster than any worker count for them. Otherwise each worker parses only the kept columns and the sort key of a shard, sorts it and spills a
+        run: the rendered records, their byte offsets and a NumPy array of the sorted keys. The merge is
+        split by key range as well: splitter keys sampled from the runs cut the key space into at least one
+        range per worker, every worker sorts the keys of its range of all the runs and copies the records
+        by byte offset, and the range files are concatenated. Ties keep shard order, then row
+        order, so the output matches sorting the concatenated shards. When shards infer different
+        types for a column, the shards that disagree are sorted again with the type the whole data
+        set would get.
+        """
+        input_files = input_files or self.input_files()
+        output_file_path = output_file_path or self.__output_file_path
+        usecols = list(dict.fromkeys(self.__columns_to_keep + [self.__sort_by]))
+        if self.shards_fit_in_memory(input_files):
+            self.__sort_shards_in_memory(input_files, output_file_path, usecols)
+            logging.info(f"Sorted {len(input_files)} shards in memory into '{output_file_path}'")
+            return output_file_path
+        workers = max(1, min(self.__workers, len(input_files)))
+        with tempfile.TemporaryDirectory(prefix='csv_shards_') as spill_dir:
+            jobs = [(path, os.path.join(spill_dir, f'run_{shard:06d}'), usecols, self.__sort_by,
+                     self.__columns_to_keep, None) for shard, path in enumerate(input_files)]
+            with ProcessPoolExecutor(max_workers=workers) if workers > 1 else _InlineExecutor() as executor:
+                sorted_runs = list(executor.map(_sort_shard, jobs))  # (dtypes, run) per shard
+                unified = sorted_runs[0][0]
+                for dtypes, _ in sorted_runs[1:]:
+                    if dtypes != unified:
+                        unified = _unify_dtypes(unified, dtypes)
+                redo = [shard for shard, (dtypes, _) in enumerate(sorted_runs) if dtypes != unified]
+                for shard, result in zip(redo, executor.map(_sort_shard, [jobs[shard][:-1] + (unified,) for shard in redo])):
+                    sorted_runs[shard] = result
+                runs = [run for _, run in sorted_runs]
+                count = max(workers, -(-sum(run[3] for run in runs) // MERGE_RANGE_BYTES))
+                splitters = _key_splitters(runs, count)
+                ranges = [([run[:3] for run in runs], low, high, os.path.join(spill_dir, f'range_{number:04d}.csv'))
+                          for number, (low, high) in enumerate(zip([None] + splitters, splitters + [None]))]
+                range_paths = list(executor.map(_merge_range, ranges))
+            header = pd.DataFrame(columns=self.__columns_to_keep).to_csv(index=False)
+            with open(output_file_path, 'w', newline='', encoding='utf-8') as output:
+                output.write(header)
+            with open(output_file_path, 'ab') as output:
+                for range_path in range_paths:
+                    with open(range_path, 'rb') as part:
+                        shutil.copyfileobj(part, output, 1024 * 1024)
+        logging.info(f"Sorted {len(input_files)} shards on {workers} worker(s) into '{output_file_path}'")
+        return output_file_path
+
+    def shards_fit_in_memory(self, input_files):
+        """
+        True when the shards are sorted in memory: ``streaming`` forces the spilled runs on (True) or
+        off (False), by default the shards' total size is compared with the streaming threshold.
+        """
+        if self.__streaming is not None:
+            return not self.__streaming
+        return sum(os.path.getsize(path) for path in input_files) <= STREAMING_THRESHOLD_BYTES
+
+    def __sort_shards_in_memory(self, input_files, output_file_path, usecols):
+        frames = [pd.read_csv(path, usecols=usecols)[usecols] for path in input_files]
+        unified = frames[0].dtypes.to_dict()
+        for frame in frames[1:]:
+            if frame.dtypes.to_dict() != unified:
+                unified = _unify_dtypes(unified, frame.dtypes.to_dict())
+        # Shards that disagree are read again with the common types, as the worker path does
+        frames = [frame if frame.dtypes.to_dict() == unified
+                  else pd.read_csv(path, usecols=usecols, dtype=unified)[usecols]
+                  for path, frame in zip(input_files, frames)]
+        merged = pd.concat(frames, ignore_index=True).sort_values(by=self.__sort_by, kind='stable')
+        merged[self.__columns_to_keep].to_csv(output_file_path, index=False)
+
+    def __write_sorted_runs(self, spill_dir, usecols, dtypes):
+        runs = []
+        seen_dtypes = None
+        row_offset = 0
+        reader = pd.read_csv(self.__single_input(), usecols=usecols, chunksize=self.__chunk_rows, dtype=dtypes)
+        with reader:
+            for chunk in _checked_chunks(reader, dtypes):
+                chunk = chunk[usecols]
+                if seen_dtypes is None:
+                    seen_dtypes = chunk.dtypes.to_dict()
+                elif chunk.dtypes.to_dict() != seen_dtypes:
+                    return runs, _unify_dtypes(seen_dtypes, chunk.dtypes.to_dict())
+                chunk.index = pd.RangeIndex(row_offset, row_offset + len(chunk))
+                row_offset += len(chunk)
+                runs.append(self.__spill_run(spill_dir, len(runs), chunk.sort_values(by=self.__sort_by, kind='stable')))
+        return runs, None
+
+    def __spill_run(self, spill_dir, run_number, sorted_chunk):
+        keys = sorted_chunk[self.__sort_by]
+        missing = keys.isna().tolist()
+        rendered = sorted_chunk[self.__columns_to_keep].to_csv(index=False, header=False, lineterminator='\n')
+        records = zip(missing, keys.tolist(), sorted_chunk.index.tolist(), _split_csv_records(rendered))
+        run_path = os.path.join(spill_dir, f'run_{run_number:06d}.pkl')
+        with open(run_path, 'wb') as handle:
+            batch = []
+            for is_missing, key, row, line in records:
+                # NaN keys sort last, ties are broken by the original row number
+                batch.append(((is_missing, 0 if is_missing else key, row), line))
+                if len(batch) >= 10_000:
+                    pickle.dump(batch, handle)
+                    batch = []
+            if batch:
+                pickle.dump(batch, handle)
+        return run_path
+
+    def __merge_runs(self, runs, output_file_path):
+        header = pd.DataFrame(columns=self.__columns_to_keep).to_csv(index=False)
+        with open(output_file_path, 'w', newline='', encoding='utf-8', buffering=1024 * 1024) as output:
+            output.write(header)
+            for _, line in heapq.merge(*(_read_run(run) for run in runs), key=lambda record: record[0]):
+                output.write(line)
+                output.write(os.linesep)
+
     def execute(self):
         """
         Executes the command to read, sort, and save the reduced CSV file.
+
+        Returns the sorted frame when it was built in memory, otherwise None. From a worker
+        process its numeric columns come back through shared memory.
         """
         if not os.path.exists(self.__data_dir):
             os.makedirs(self.__data_dir)
             logging.info(f"The directory '{self.__data_dir}' is created")
         elif not os.access(self.__data_dir, os.W_OK):
             logging.error(f"The directory '{self.__data_dir}' is not writable.")
-            return
-        
-        reduced_df = self.read_sort_and_reduce()
-        if reduced_df is not None:
+            return None
+
+        with metrics.timer('csv.process'):
+            return self.__process()
+
+    def __process(self):
+        input_files = self.input_files()
+        if not input_files:
+            logging.error(f"No CSV files match '{self.__input_file_path}'")
+            print(f"No CSV files match '{self.__input_file_path}'")
+            return None
+        manifest = None
+        if self.__incremental:
+            manifest = BuildManifest(manifest_path_for(self.__output_file_path))
+            inputs, change = manifest.classify(input_files, self.__build_settings(), self.__output_file_path)
+            if change == UNCHANGED:
+                manifest.record(inputs, self.__build_settings(), self.__output_file_path, manifest.data['dtypes'])
+                logging.info(f"'{self.__output_file_path}' is up to date, nothing to process")
+                print(f"'{self.__output_file_path}' is up to date, nothing to process")
+                self.__show_output()
+                return None
+            if change == APPENDED and len(input_files) == 1 and not self.use_streaming():
+                if self.merge_appended_rows(manifest.previous_input(input_files[0])['size'], manifest.data['dtypes']):
+                    manifest.record(inputs, self.__build_settings(), self.__output_file_path, manifest.data['dtypes'])
+                    self.__show_output()
+                    return None
+        built = self.__build(input_files)
+        if built is None:
+            return None
+        reduced_df, dtypes = built
+        if manifest is not None:
+            # The fingerprints were taken before the build read the inputs, so later edits still show up
+            manifest.record(inputs, self.__build_settings(), self.__output_file_path, dtypes)
+        self.__show_output(reduced_df)
+        return reduced_df
+
+    def __build(self, input_files):
+        """Writes the output from scratch; returns (frame or None, output dtypes or None), or None on failure."""
+        reduced_df = dtypes = None
+        if len(input_files) > 1 or self.use_streaming():
+            if len(input_files) > 1:
+                self.process_shards(input_files)
+            else:
+                self.external_sort()
+        else:
+            reduced_df = self.read_sort_and_reduce()
+            if reduced_df is None:
+                return None
             reduced_df.to_csv(self.__output_file_path, index=False)
-            logging.info(f"Processed data saved to '{self.__output_file_path}'")
-            print(f"Processed data saved to '{self.__output_file_path}'")
-        
-        df_read_states = pd.read_csv(self.__output_file_path)
-
-        # Print and log each state nicely
-        print(f"States from CSV, sorted by {self.__sort_by}")
-        for index, row in df_read_states.iterrows():
-            # First, print and log the complete record for the state
-            state_info = f"{row['State Abbreviation']}: {row['State Name']}"
-            print(f"Record {index}: {state_info}")
-            logging.info(f"Record {index}: {state_info}")
-
-            # Then, iterate through each field in the row to print and log
-            for field in row.index:
-                field_info = f"    {field}: {row[field]}"
-                print(field_info)
-                logging.info(f"Index: {index}, {field_info}")
\ No newline at end of file
+            # Reuse the frame we already have rather than reading the output back from disk
+            reduced_df = reduced_df.reset_index(drop=True)
+            dtypes = _dtype_names(reduced_df)
+        self.__count_io()
+        logging.info(f"Processed data saved to '{self.__output_file_path}'")
+        print(f"Processed data saved to '{self.__output_file_path}'")
+        return reduced_df, dtypes
+
+    def __show_output(self, frame=None):
+        if frame is not None:
+            self.display(frame)
+        elif len(self.input_files()) > 1 or self.use_streaming():
+            # The sorted output never fits in memory here, so only a preview of it is shown
+            preview_rows = self.__preview_rows if self.__preview_rows is not None else DEFAULT_STREAMING_PREVIEW_ROWS
+            preview_df = pd.read_csv(self.__output_file_path, nrows=preview_rows)
+            self.display(preview_df, totals=self.__output_totals(), preview_rows=preview_rows)
+        else:
+            self.display(pd.read_csv(self.__output_file_path))
+
+    def __build_settings(self):
+        return {'sort_by': self.__sort_by, 'columns': self.__columns_to_keep}
+
+    def merge_appended_rows(self, offset, dtypes):
+        """
+        Merges the rows appended to the input after ``offset`` bytes into the existing sorted output.
+
+        Only the new rows are parsed and sorted; each is inserted after the old rows with the same key,
+        which is where a stable full sort would put it, and the old records are copied through as text.
+        Returns False, leaving the output alone, when that would not match a full rebuild: the sort key
+        is not a kept column, or the new rows parse to different column types than the output has.
+        """
+        if self.__sort_by not in self.__columns_to_keep or not dtypes:
+            return False
+        source = self.__single_input()
+        header = pd.read_csv(source, nrows=0).columns.tolist()
+        with open(source, 'rb') as handle:
+            handle.seek(offset)
+            appended = handle.read()
+        try:
+            new_df = pd.read_csv(io.BytesIO(appended), header=None, names=header)
+        except pd.errors.EmptyDataError:
+            return False
+        new_df = new_df.sort_values(by=self.__sort_by, kind='stable')[self.__columns_to_keep]
+        if _dtype_names(new_df) != dtypes:
+            logging.info("Appended rows change the column types, rebuilding the output")
+            return False
+        old_keys = pd.read_csv(self.__output_file_path, usecols=[self.__sort_by])[self.__sort_by]
+        new_keys = new_df[self.__sort_by]
+        if old_keys.dtype == object and (old_keys.isna().any() or new_keys.isna().any()):
+            return False  # Missing text keys do not compare, leave the ordering to a full sort
+        # side='right' puts new rows after equal old keys; NaN keys land at the very end, after the old NaNs
+        positions = np.searchsorted(old_keys.to_numpy(), new_keys.to_numpy(), side='right').tolist()
+
+        with open(self.__output_file_path, encoding='utf-8', newline='') as handle:
+            old_records = _split_csv_records(handle.read())
+        new_records = _split_csv_records(new_df.to_csv(index=False, header=False, lineterminator=os.linesep))
+        header_record, old_records = old_records[0], old_records[1:]
+        merged = [header_record]
+        previous = 0
+        for position, record in zip(positions, new_records):
+            merged.extend(old_records[previous:position])
+            merged.append(record)
+            previous = position
+        merged.extend(old_records[previous:])
+        temp_path = f"{self.__output_file_path}.tmp"
+        with open(temp_path, 'w', encoding='utf-8', newline='') as handle:
+            handle.write('\n'.join(merged) + '\n')
+        os.replace(temp_path, self.__output_file_path)
+        metrics.increment('csv.bytes_read', len(appended))
+        metrics.increment('csv.bytes_written', os.path.getsize(self.__output_file_path))
+        logging.info(f"Merged {len(new_records)} appended rows into '{self.__output_file_path}'")
+        print(f"Merged {len(new_records)} appended rows into '{self.__output_file_path}'")
+        return True
+
+    def __count_io(self):
+        metrics.increment('csv.bytes_read', sum(os.path.getsize(path) for path in self.input_files()))
+        metrics.increment('csv.bytes_written', os.path.getsize(self.__output_file_path))
+
+    def render_records(self, df):
+        """
+        Formats every record as a block of text in one vectorized pass, no Python loop over rows.
+        """
+        if df.empty:
+            return ""
+        title = pd.Series(df.index.astype(str), index=df.index)
+        for column in self.__columns_to_keep[:2]:
+            title = title + ": " + df[column].astype(str)
+        lines = "Record " + title
+        fields = [f"    {field}: " + df[field].astype(str) for field in df.columns]
+        return "\n".join(lines.str.cat(fields, sep="\n").tolist())
+
+    def display(self, df, totals=None, preview_rows=None):
+        """
+        Prints and logs the records in a single buffered write.
+
+        With ``preview_rows`` set only the first rows are shown, followed by the totals
+        (record count and the sum of every numeric column).
+        """
+        preview_rows = self.__preview_rows if preview_rows is None else preview_rows
+        shown = df if preview_rows is None else df.head(preview_rows)
+        text = f"States from CSV, sorted by {self.__sort_by}\n{self.render_records(shown)}"
+        if preview_rows is not None:
+            total_rows, sums = totals if totals is not None else (len(df), df.select_dtypes('number').sum())
+            text += f"\n... showing {len(shown)} of {total_rows} records"
+            text += "".join(f"\nTotal {column}: {value}" for column, value in sums.items())
+        sys.stdout.write(text + "\n")
+        logging.info(text)
+
+    def __output_totals(self):
+        """Counts the records and sums the numeric columns of the output, a chunk at a time."""
+        total_rows, sums = 0, None
+        with pd.read_csv(self.__output_file_path, chunksize=self.__chunk_rows) as reader:
+            for chunk in reader:
+                total_rows += len(chunk)
+                chunk_sums = chunk.select_dtypes('number').sum()
+                sums = chunk_sums if sums is None else sums.add(chunk_sums, fill_value=0)
+        return total_rows, sums if sums is not None else pd.Series(dtype=float)
+
+class _InlineExecutor:
+    """Runs the shard jobs in this process when there is a single worker, without spawning a pool."""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+    @staticmethod
+    def map(func, jobs):
+        return map(func, jobs)
+
+
+# Every this many sorted keys of a run, one is sampled to pick the splitters of the merge ranges
+SHARD_SAMPLE_ROWS = 1024
+# Upper bound on the bytes one merge range is aimed at, so a range fits in a worker's memory
+MERGE_RANGE_BYTES = 64 * 1024 * 1024
+# Records gathered per write by a range merge
+MERGE_CHUNK_ROWS = 65_536
+
+
+def _sort_shard(job):
+    """Worker side of CsvCommand.process_shards: sorts one shard into a run.
+
+    A run is three files: the rendered records (``<run>.csv``), their byte offsets
+    (``<run>.offsets.npy``) and the sorted keys of the rows that have one (``<run>.keys.npy``).
+    Rows without a key follow in row order. Returns the shard's column dtypes and
+    (run path, rows with a key, rows, bytes, sampled keys).
+    """
+    path, run_path, usecols, sort_by, columns, dtypes = job
+    frame = pd.read_csv(path, usecols=usecols, dtype=dtypes)[usecols]
+    frame = frame.sort_values(by=sort_by, kind='stable')  # Rows without a key go last
+    keys = frame[sort_by]
+    keyed = len(keys) - int(keys.isna().sum())
+    keys = keys.to_numpy()[:keyed]
+    if keys.dtype == object:
+        keys = keys.astype(str)  # Fixed-width unicode sorts in NumPy in the order Python compares str
+    data, offsets = _render_records(frame[columns])
+    with open(f'{run_path}.csv', 'wb') as handle:
+        handle.write(data)
+    np.save(f'{run_path}.offsets.npy', offsets)
+    np.save(f'{run_path}.keys.npy', keys)
+    return frame.dtypes.to_dict(), (run_path, keyed, len(frame), len(data), keys[::SHARD_SAMPLE_ROWS].copy())
+
+
+def _render_records(frame):
+    """The frame as CSV records, each ending in os.linesep, and the int64 offsets of the records (rows + 1)."""
+    rendered = frame.to_csv(index=False, header=False, lineterminator='\n')
+    if '"' in rendered:  # Quoted fields may hold line breaks, so records are split one by one
+        encoded = [f'{record}{os.linesep}'.encode('utf-8') for record in _split_csv_records(rendered)]
+        ends = np.cumsum(np.fromiter(map(len, encoded), dtype=np.int64, count=len(encoded)))
+        data = b''.join(encoded)
+    else:
+        data = rendered.replace('\n', os.linesep).encode('utf-8')
+        ends = np.flatnonzero(np.frombuffer(data, dtype=np.uint8) == ord(os.linesep[-1])) + 1
+    return data, np.concatenate(([0], ends)).astype(np.int64)
+
+
+def _key_splitters(runs, count):
+    """Keys that cut the keyed rows of the runs into ``count`` ranges of about the same size."""
+    samples = [run[-1] for run in runs if len(run[-1])]
+    if not samples:
+        return []
+    samples = np.sort(np.concatenate(samples), kind='stable')
+    return list(np.unique(samples[len(samples) * np.arange(1, count) // count]))
+
+
+def _merge_range(job):
+    """Worker side of CsvCommand.process_shards: merges the rows with low <= key < high of every run into a file.
+
+    None leaves a side open; the last range also takes the rows without a key. The keys of
+    the range are sorted with one stable argsort over the runs in shard order, so ties keep
+    shard order, then row order, and the records are copied by their byte offsets.
+    """
+    runs, low, high, range_path = job
+    keys, keyed_positions, unkeyed_positions, starts, lengths, blobs = [], [], [], [], [], []
+    position = size = 0
+    for run_path, keyed, rows in runs:
+        first, last = 0, keyed
+        if keyed:
+            run_keys = np.load(f'{run_path}.keys.npy', mmap_mode='r')
+            first = 0 if low is None else int(np.searchsorted(run_keys, low, 'left'))
+            last = keyed if high is None else int(np.searchsorted(run_keys, high, 'left'))
+            keys.append(np.array(run_keys[first:last]))
+        stop = rows if high is None else last
+        offsets = np.array(np.load(f'{run_path}.offsets.npy', mmap_mode='r')[first:stop + 1])
+        with open(f'{run_path}.csv', 'rb') as handle:
+            handle.seek(offsets[0])
+            blobs.append(handle.read(offsets[-1] - offsets[0]))
+        starts.append(offsets[:-1] - offsets[0] + size)
+        lengths.append(np.diff(offsets))
+        keyed_positions.append(np.arange(position, position + last - first))
+        unkeyed_positions.append(np.arange(position + last - first, position + stop - first))
+        position += stop - first
+        size += len(blobs[-1])
+    order = np.concatenate(keyed_positions)
+    if keys:
+        order = order[np.argsort(np.concatenate(keys), kind='stable')]
+    order = np.concatenate([order] + unkeyed_positions)
+    blob = np.frombuffer(b''.join(blobs), dtype=np.uint8)
+    starts, lengths = np.concatenate(starts), np.concatenate(lengths)
+    with open(range_path, 'wb') as output:
+        for begin in range(0, len(order), MERGE_CHUNK_ROWS):
+            chunk = order[begin:begin + MERGE_CHUNK_ROWS]
+            output.write(_gather(blob, starts[chunk], lengths[chunk]))
+    return range_path
+
+
+def _gather(blob, starts, lengths):
+    """The byte ranges blob[start:start + length] one after the other, with one vectorized take."""
+    ends = np.cumsum(lengths)
+    total = int(ends[-1]) if len(ends) else 0
+    return blob[np.arange(total) + np.repeat(starts - (ends - lengths), lengths)].tobytes()
+
+
+def _dtype_names(df):
+    return {column: str(dtype) for column, dtype in df.dtypes.items()}
+
+
+def _read_run(run_path):
+    """Streams the records of a spilled run back, one pickled batch at a time."""
+    with open(run_path, 'rb') as handle:
+        while True:
+            try:
+                yield from pickle.load(handle)
+            except EOFError:
+                return
+
+
+def _split_csv_records(rendered):
+    """Splits rendered CSV text into records, keeping quoted line breaks inside their record."""
+    records = []
+    pending = None
+    for line in rendered.split('\n')[:-1]:
+        pending = line if pending is None else f"{pending}\n{line}"
+        if pending.count('"') % 2 == 0:
+            records.append(pending)
+            pending = None
+    return records
+
+
+class _WidenToText(Exception):
+    """Raised when a chunk no longer parses with the dtypes pinned for the file."""
+
+
+def _checked_chunks(reader, dtypes):
+    try:
+        yield from reader
+    except ValueError:
+        if dtypes is None:
+            raise
+        raise _WidenToText() from None
+
+
+def _unify_dtypes(first, other):
+    """Widens per-column dtypes the way whole-file type inference would (int -> float -> str)."""
+    unified = {}
+    for column, dtype in first.items():
+        other_dtype = other[column]
+        if dtype == other_dtype:
+            unified[column] = dtype
+        elif np.issubdtype(dtype, np.number) and np.issubdtype(other_dtype, np.number):
+            unified[column] = np.result_type(dtype, other_dtype)
+        else:
+            unified[column] = str
+    return unified
@@ -0,0 +1,115 @@
+import hashlib
+import json
+import logging
+import os
+
+HASH_BLOCK_BYTES = 1024 * 1024
+UNCHANGED, APPENDED, CHANGED = 'unchanged', 'appended', 'changed'
+
+
+def manifest_path_for(output_path):
+    """The manifest sits next to the output: data/sorted_states.csv -> data/sorted_states.manifest.json."""
+    return os.path.splitext(output_path)[0] + '.manifest.json'
+
+
+def file_stat(path):
+    stat = os.stat(path)
+    return {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+
+
+def hash_file(path, prefix_bytes=None):
+    """sha256 of the whole file and, when ``prefix_bytes`` is given, of its first bytes, in a single read."""
+    digest = hashlib.sha256()
+    prefix_hash = None
+    with open(path, 'rb') as handle:
+        if prefix_bytes is not None:
+            remaining = prefix_bytes
+            while remaining:
+                block = handle.read(min(HASH_BLOCK_BYTES, remaining))
+                if not block:
+                    break
+                digest.update(block)
+                remaining -= len(block)
+            prefix_hash = digest.hexdigest()
+        for block in iter(lambda: handle.read(HASH_BLOCK_BYTES), b''):
+            digest.update(block)
+    return digest.hexdigest(), prefix_hash
+
+
+def _ends_with_newline(path, size):
+    with open(path, 'rb') as handle:
+        handle.seek(size - 1)
+        return handle.read(1) == b'\n'
+
+
+def fingerprint(path, previous=None):
+    """Returns the input's {path, size, mtime_ns, sha256} and how it changed since ``previous``.
+
+    Size and mtime are trusted when both still match, so an unchanged input is not read at all.
+    Otherwise the file is hashed; it counts as APPENDED when it grew, its old bytes hash to the
+    previous digest and they ended with a complete line.
+    """
+    stat = file_stat(path)
+    if previous and previous['size'] == stat['size'] and previous['mtime_ns'] == stat['mtime_ns']:
+        return {'path': path, **stat, 'sha256': previous['sha256']}, UNCHANGED
+    grew = previous is not None and 0 < previous['size'] < stat['size']
+    sha256, prefix_sha256 = hash_file(path, previous['size'] if grew else None)
+    entry = {'path': path, **stat, 'sha256': sha256}
+    if previous is None:
+        return entry, CHANGED
+    if sha256 == previous['sha256']:
+        return entry, UNCHANGED
+    if grew and prefix_sha256 == previous['sha256'] and _ends_with_newline(path, previous['size']):
+        return entry, APPENDED
+    return entry, CHANGED
+
+
+class BuildManifest:
+    """What an output was built from: the input fingerprints, the settings and the output's own size/mtime.
+
+    ``classify`` compares the current inputs against it. A build is only reused when the settings
+    are the same and the output has not been touched since the manifest was written.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.data = self.load()
+
+    def load(self):
+        try:
+            with open(self.path, encoding='utf-8') as handle:
+                return json.load(handle)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError) as e:
+            logging.warning(f"Ignoring unreadable build manifest '{self.path}': {e}")
+            return None
+
+    def previous_input(self, path):
+        for entry in (self.data or {}).get('inputs', []):
+            if entry['path'] == path:
+                return entry
+        return None
+
+    def classify(self, input_paths, settings, output_path):
+        """Returns (input fingerprints, UNCHANGED / APPENDED / CHANGED) for the whole build."""
+        data = self.data
+        reusable = (data is not None and data.get('settings') == settings and os.path.exists(output_path)
+                    and file_stat(output_path) == data.get('output')
+                    and [entry['path'] for entry in data.get('inputs', [])] == list(input_paths))
+        entries, changes = [], set()
+        for path in input_paths:
+            entry, change = fingerprint(path, self.previous_input(path) if reusable else None)
+            entries.append(entry)
+            changes.add(change)
+        if not reusable or CHANGED in changes:
+            return entries, CHANGED
+        return entries, APPENDED if APPENDED in changes else UNCHANGED
+
+    def record(self, inputs, settings, output_path, dtypes=None):
+        """Writes the manifest (atomically) for an output that was just built from ``inputs``."""
+        self.data = {'settings': settings, 'inputs': inputs, 'output': file_stat(output_path), 'dtypes': dtypes}
+        temp_path = f"{self.path}.tmp"
+        with open(temp_path, 'w', encoding='utf-8') as handle:
+            json.dump(self.data, handle, indent=2)
+        os.replace(temp_path, self.path)
@@ -1,14 +1,21 @@
 import logging
 from app.commands import Command, CommandHistoryManager
+from app.commands.history_index import to_epoch
 
 class HistoryCommand(Command):
+    PAGE_SIZE = 20  # Records listed per page by Load History
+
     def __init__(self):
         self.history_manager = CommandHistoryManager()
         self.operations = {
             "1": ("Load History", self.load_history),
             "2": ("Save History", self.save_history),
             "3": ("Clear History", self.clear_history),
-            "4": ("Delete History Record", self.delete_history_record)
+            "4": ("Delete History Record", self.delete_history_record),
+            "5": ("Query History by Time Range", self.query_history),
+            "6": ("Count Command Runs", self.count_history),
+            "7": ("Top Commands", self.top_commands),
+            "8": ("Delete Records by Command", self.delete_by_command)
         }
 
     def execute(self):
@@ -33,13 +40,21 @@ class HistoryCommand(Command):
                 print("Invalid selection. Please try again.")
 
     def load_history(self):
-        history = self.history_manager.get_history()
-        if history:
-            print("Command History:")
-            for index, command_name in enumerate(history, start=1):
-                print(f"{index}. {command_name}")
-        else:
+        total = int(self.history_manager.history_count())
+        if not total:
             print("No history found.")
+            return
+        print("Command History:")
+        page = 0
+        while True:
+            # Only one page is read from the storage at a time
+            records = self.history_manager.history_page(page, self.PAGE_SIZE)
+            for index, (_, command_name) in enumerate(records, start=page * self.PAGE_SIZE + 1):
+                print(f"{index}. {command_name}")
+            page += 1
+            shown = min(page * self.PAGE_SIZE, total)
+            if shown >= total or input(f"Showing {shown} of {total}. Press Enter for more, or 0 to stop: ") == '0':
+                break
 
     def save_history(self):
         self.history_manager.save_history()
@@ -59,8 +74,7 @@ class HistoryCommand(Command):
                 # Adjust for zero-based index
                 del_index = choice - 1
                 if 0 <= del_index < len(history):
-                    self.history_manager.history.drop(self.history_manager.history.index[del_index], inplace=True)
-                    self.history_manager.save_history()
+                    self.history_manager.delete_record(del_index)
                     print("Record deleted successfully.")
                 else:
                     print("Invalid selection. Please try again.")
@@ -68,3 +82,73 @@ class HistoryCommand(Command):
                 print("Please enter a valid number.")
         else:
             print("No history to delete.")
+
+    def print_scope(self):
+        """Queries run on the in-memory history, which holds only the latest records."""
+        print(f"Searching the latest {self.history_manager.max_records} records "
+              "(set HISTORY_MAX_RECORDS to keep more).")
+
+    @staticmethod
+    def read_time_range():
+        """Asks for an optional start and end timestamp; blank means open-ended."""
+        start = input("From (YYYY-MM-DD HH:MM:SS, blank for the beginning): ").strip() or None
+        end = input("To (YYYY-MM-DD HH:MM:SS, blank for now): ").strip() or None
+        for value in (start, end):
+            to_epoch(value)  # Raises ValueError on a malformed timestamp
+        return start, end
+
+    def query_history(self):
+        self.print_scope()
+        try:
+            start, end = self.read_time_range()
+        except ValueError:
+            print("Please enter timestamps as YYYY-MM-DD HH:MM:SS.")
+            return
+        command_name = input("Command (blank for all): ").strip() or None
+        records = self.history_manager.query(start, end, command_name)
+        for timestamp, name in records:
+            print(f"{timestamp}  {name}")
+        print(f"{len(records)} records found.")
+
+    def count_history(self):
+        self.print_scope()
+        command_name = input("Command to count: ").strip()
+        try:
+            start, end = self.read_time_range()
+        except ValueError:
+            print("Please enter timestamps as YYYY-MM-DD HH:MM:SS.")
+            return
+        count = self.history_manager.count(command_name or None, start, end)
+        print(f"{command_name or 'Commands'} ran {count} times.")
+
+    def top_commands(self):
+        self.print_scope()
+        try:
+            n = int(input("How many commands to show: ") or 5)
+        except ValueError:
+            print("Please enter a valid number.")
+            return
+        ranking = self.history_manager.top_commands(n)
+        if not ranking:
+            print("No history found.")
+        for position, (name, count) in enumerate(ranking, start=1):
+            print(f"{position}. {name}: {count}")
+
+    def delete_by_command(self):
+        self.print_scope()
+        command_name = input("Command to delete: ").strip()
+        try:
+            start, end = self.read_time_range()
+        except ValueError:
+            print("Please enter timestamps as YYYY-MM-DD HH:MM:SS.")
+            return
+        low = to_epoch(start) if start else None
+        high = to_epoch(end) if end else None
+
+        def matches(timestamp, name):
+            seconds = to_epoch(timestamp)
+            return (name == command_name and (low is None or seconds >= low)
+                    and (high is None or seconds <= high))
+
+        deleted = self.history_manager.delete_where(matches)
+        print(f"Deleted {deleted} records.")
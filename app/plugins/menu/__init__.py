@@ -7,11 +7,9 @@ class MenuCommand(Command):
         self.command_handler = command_handler
 
     def execute(self):
-        commands = list(self.command_handler.commands.keys())
         # Print the menu dynamically based on registered commands
         print("\nMain Menu:")
-        for index, command_name in enumerate(commands, start=1):
-            print(f"{index}. {command_name.capitalize()}")
+        print(self.command_handler.render_menu(capitalize=True))
         print("Enter the number of the command to execute, or '0' to exit.")
 
         logging.info("Displaying main menu to user.")  # Log displaying the menu
@@ -21,7 +19,9 @@ class MenuCommand(Command):
             if selection == 0:
                 logging.info("User selected to exit the program.")  # Log user's decision to exit
                 sys.exit("Exiting program.")  # Gracefully exit if the user selects '0'
-            command_name = commands[selection - 1]  # Adjust for zero-based indexing
+            command_name = self.command_handler.get_command_by_index(selection - 1)  # Adjust for zero-based indexing
+            if command_name is None:
+                raise IndexError(selection)
             logging.info(f"User selected command: {command_name}")  # Log the command selected by the user
             self.command_handler.execute_command(command_name)
         except (ValueError, IndexError):
@@ -1,7 +1,6 @@
-import pkgutil
-import importlib
 import logging
 from app.commands import Command
+from app.commands.plugin_registry import PluginRegistry
 
 class OpenAICommand(Command):
     def __init__(self, plugins_package='app.plugins.openai'):
@@ -10,28 +9,12 @@ class OpenAICommand(Command):
 
     def load_operations(self):
         operations = {}
-        plugin_paths = [self.plugins_package.replace('.', '/')]
-        found_plugins = pkgutil.iter_modules(plugin_paths)
-        # Sort plugins by name to ensure consistent order
-        sorted_plugins = sorted(found_plugins, key=lambda x: x[1])
-        for index, (finder, name, ispkg) in enumerate(sorted_plugins, start=1):
-            if ispkg:
-                continue  # Skip sub-packages
-            try:
-                plugin_module = importlib.import_module(f"{self.plugins_package}.{name}")
-                for attribute_name in dir(plugin_module):
-                    attribute = getattr(plugin_module, attribute_name)
-                    if issubclass(attribute, Command) and attribute is not Command:
-                        # Use numeric keys for operations based on their sorted order
-                        operations[str(index)] = attribute()
-                logging.info(f"Loaded OpenAI plugin: {name}")
-            except (ImportError, TypeError) as e:
-                if str(e) == "issubclass() arg 1 must be a class":
-                    continue  # Ignore this specific TypeError
-                else:
-                    logging.error(f"Error loading OpenAI plugin {name}: {e}")
-                    print(f"Error loading plugin {name}: {e}")  # Retain print for user feedback
-                    raise
+        # Discovery is shared with the rest of the app, so the package is only scanned once per process
+        registry = PluginRegistry.for_package(self.plugins_package)
+        for index, entry in enumerate(registry, start=1):
+            # Use numeric keys for operations based on their sorted order
+            operations[str(index)] = entry.load()()
+            logging.info(f"Loaded OpenAI plugin: {entry.name}")
         return operations
 
     def execute(self):
@@ -1,7 +1,45 @@
 import logging
+import os
 from app.commands import Command
+from app.plugins.openai.client import ChatClient, ChatClientError
 
 class Chat(Command):
+    """Talks to the configured chat backend, one prompt per line.
+
+    Replies are streamed token by token unless OPENAI_STREAM=0. A stream is never shared:
+    identical prompts sent at the same time (e.g. by several server sessions) are only
+    coalesced into one request when not streaming, through ChatClient.complete. Both
+    modes answer a prompt from the response cache when it was asked before.
+    """
+
+    def __init__(self, client=None, stream=None):
+        # Built on first use from OPENAI_* in .env and kept, so its pooled connections are reused
+        self.client = client
+        self.stream = stream
+
     def execute(self):
-        logging.info("Chat command executed: Engaging with AI.")
-        print(f"Hi this is AI")  # Maintain user interaction
\ No newline at end of file
+        if self.client is None:
+            self.client = ChatClient.from_settings(os.environ)
+        if self.stream is None:
+            self.stream = os.environ.get('OPENAI_STREAM', '1').lower() not in ('0', 'false', 'no')
+        if self.client is None:
+            logging.info("Chat command executed: Engaging with AI.")
+            print(f"Hi this is AI")  # Maintain user interaction
+            return
+        logging.info(f"Chat command executed with model {self.client.model}.")
+        while True:
+            prompt = input("You (empty line to go back): ").strip()
+            if not prompt:
+                break
+            print("AI: ", end='', flush=True)
+            try:
+                if self.stream:
+                    for piece in self.client.stream(prompt):
+                        print(piece, end='', flush=True)  # Tokens show up as they arrive
+                    print()
+                else:
+                    print(self.client.complete(prompt))  # Coalesced with identical prompts in flight
+            except (ChatClientError, OSError) as e:
+                print()
+                logging.error(f"Chat request failed: {e}")
+                print(f"Chat request failed: {e}")
@@ -0,0 +1,356 @@
+"""HTTP client for an OpenAI-compatible chat completions endpoint.
+
+Requests go over a small pool of keep-alive ``http.client`` connections, at most
+``max_connections`` at a time. Identical requests that are in flight together are sent
+once. Finished responses are kept in a content-addressed cache on disk, with a TTL and
+LRU eviction. ``stream`` yields the reply token by token from the server-sent events.
+Request latency, time to first token, cache hits and connection reuse are recorded in
+``app.instrumentation.metrics`` under ``openai.*``.
+"""
+import contextlib
+import hashlib
+import http.client
+import json
+import logging
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from urllib.parse import urlsplit
+from app.instrumentation import metrics
+
+DEFAULT_MODEL = 'gpt-4o-mini'
+DEFAULT_CACHE_DIR = 'data/openai_cache'
+COMPLETIONS_PATH = '/chat/completions'
+# A connection that sat idle in the pool may have been closed by the server in the meantime
+STALE_CONNECTION_ERRORS = (http.client.RemoteDisconnected, http.client.BadStatusLine,
+                           ConnectionResetError, BrokenPipeError)
+
+
+class ChatClientError(RuntimeError):
+    """The backend answered with an error status or a response that is not a chat completion."""
+
+    def __init__(self, message, status=None):
+        super().__init__(message)
+        self.status = status
+
+
+class ConnectionPool:
+    """Keep-alive connections to one host; ``max_connections`` also caps the requests in flight."""
+
+    def __init__(self, base_url, max_connections=4, timeout=30.0):
+        url = urlsplit(base_url)
+        if url.scheme not in ('http', 'https'):
+            raise ValueError(f"Unsupported URL '{base_url}', expected http:// or https://")
+        self.scheme = url.scheme
+        self.host = url.hostname
+        self.port = url.port
+        self.base_path = url.path.rstrip('/')
+        self.timeout = timeout
+        self.max_connections = max_connections
+        self._slots = threading.BoundedSemaphore(max_connections)
+        self._idle = queue.LifoQueue()  # The most recently used connection is the least likely to be stale
+        self.opened = 0
+
+    def _connect(self):
+        connection_class = http.client.HTTPSConnection if self.scheme == 'https' else http.client.HTTPConnection
+        self.opened += 1
+        metrics.increment('openai.connections_opened')
+        return connection_class(self.host, self.port, timeout=self.timeout)
+
+    @contextlib.contextmanager
+    def connection(self):
+        """Borrows a connection (a new one when none is idle); waits while ``max_connections`` are busy.
+
+        The connection goes back to the pool when the block ends normally. After an exception
+        it is closed, since a half-read response would break the next request on it.
+        """
+        start = time.perf_counter()
+        self._slots.acquire()
+        metrics.observe('openai.pool_wait', time.perf_counter() - start)
+        try:
+            try:
+                connection, reused = self._idle.get_nowait(), True
+                metrics.increment('openai.connections_reused')
+            except queue.Empty:
+                connection, reused = self._connect(), False
+            try:
+                yield connection, reused
+            except BaseException:
+                connection.close()
+                raise
+            if connection.sock is not None:  # Closed ones are dropped, not reopened behind the pool's back
+                self._idle.put(connection)
+        finally:
+            self._slots.release()
+
+    @contextlib.contextmanager
+    def request(self, method, path, body, headers):
+        """``with pool.request(...) as response``: the response must be read inside the block.
+
+        A request on a reused connection that the server had already closed is sent again once
+        on a new connection.
+        """
+        for attempt in (1, 2):
+            with self.connection() as (connection, reused):
+                try:
+                    connection.request(method, self.base_path + path, body=body, headers=headers)
+                    response = connection.getresponse()
+                except STALE_CONNECTION_ERRORS:
+                    if not reused or attempt == 2:
+                        raise
+                    connection.close()
+                    logging.info("Pooled OpenAI connection was closed by the server, reconnecting")
+                    continue
+                yield response
+                if response.will_close:
+                    connection.close()
+                return
+
+    def close(self):
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                return
+
+
+class ResponseCache:
+    """Chat responses on disk under the SHA-256 of their request, one JSON file each.
+
+    Entries older than ``ttl`` seconds are treated as missing. When a ``put`` takes the cache
+    past ``max_entries`` the least recently used files are removed; a hit refreshes the
+    file's mtime, which is what recency is read from.
+    """
+
+    def __init__(self, directory=DEFAULT_CACHE_DIR, ttl=86400.0, max_entries=1000):
+        self.directory = directory
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._count = None  # Number of files, counted on the first put
+
+    @staticmethod
+    def key(request) -> str:
+        canonical = json.dumps(request, sort_keys=True, separators=(',', ':'))
+        return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.directory, key[:2], f"{key}.json")
+
+    def get(self, key):
+        path = self._path(key)
+        try:
+            with open(path, 'r', encoding='utf-8') as file:
+                entry = json.load(file)
+        except (OSError, ValueError):
+            metrics.increment('openai.cache_misses')
+            return None
+        if time.time() - entry.get('created', 0) > self.ttl:
+            self._remove(path)
+            metrics.increment('openai.cache_misses')
+            return None
+        with contextlib.suppress(OSError):
+            os.utime(path)
+        metrics.increment('openai.cache_hits')
+        return entry['response']
+
+    def put(self, key, response):
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        is_new = not os.path.exists(path)
+        temporary = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(temporary, 'w', encoding='utf-8') as file:
+            json.dump({'created': time.time(), 'response': response}, file)
+        os.replace(temporary, path)  # Readers never see a half-written entry
+        if is_new:
+            with self._lock:
+                if self._count is None:
+                    self._count = len(self._entries())
+                else:
+                    self._count += 1
+                if self._count > self.max_entries:
+                    self._evict()
+
+    def _entries(self):
+        entries = []
+        if not os.path.isdir(self.directory):
+            return entries
+        for prefix in os.scandir(self.directory):
+            if prefix.is_dir():
+                entries.extend(entry for entry in os.scandir(prefix.path) if entry.name.endswith('.json'))
+        return entries
+
+    def _evict(self):
+        entries = sorted(self._entries(), key=lambda entry: entry.stat().st_mtime)
+        excess = len(entries) - self.max_entries
+        for entry in entries[:max(excess, 0)]:
+            self._remove(entry.path)
+            metrics.increment('openai.cache_evictions')
+        self._count = len(entries) - max(excess, 0)
+
+    @staticmethod
+    def _remove(path):
+        with contextlib.suppress(OSError):
+            os.remove(path)
+
+    def clear(self):
+        with self._lock:
+            for entry in self._entries():
+                self._remove(entry.path)
+            self._count = 0
+
+
+class ChatClient:
+    """Chat completions over a ConnectionPool, with a ResponseCache and coalescing of identical requests."""
+
+    def __init__(self, base_url, api_key=None, model=DEFAULT_MODEL, max_connections=4, timeout=30.0, cache=None):
+        self.pool = ConnectionPool(base_url, max_connections=max_connections, timeout=timeout)
+        self.api_key = api_key
+        self.model = model
+        self.cache = cache
+        self._lock = threading.Lock()
+        self._in_flight = {}  # cache key -> Future of the request being sent for it
+
+    @classmethod
+    def from_settings(cls, settings):
+        """A client configured from the OPENAI_* settings, or None when no backend is configured.
+
+        OPENAI_BASE_URL defaults to the OpenAI API when only OPENAI_API_KEY is set.
+        """
+        base_url = settings.get('OPENAI_BASE_URL')
+        api_key = settings.get('OPENAI_API_KEY')
+        if not base_url and not api_key:
+            return None
+        cache = None
+        if settings.get('OPENAI_CACHE', '1').lower() not in ('0', 'false', 'no'):
+            cache = ResponseCache(settings.get('OPENAI_CACHE_DIR', DEFAULT_CACHE_DIR),
+                                  ttl=float(settings.get('OPENAI_CACHE_TTL', 86400)),
+                                  max_entries=int(settings.get('OPENAI_CACHE_MAX_ENTRIES', 1000)))
+        return cls(base_url or 'https://api.openai.com/v1', api_key=api_key,
+                   model=settings.get('OPENAI_MODEL', DEFAULT_MODEL),
+                   max_connections=int(settings.get('OPENAI_MAX_CONNECTIONS', 4)),
+                   timeout=float(settings.get('OPENAI_TIMEOUT', 30)), cache=cache)
+
+    def _request(self, prompt, params):
+        messages = [{'role': 'user', 'content': prompt}] if isinstance(prompt, str) else list(prompt)
+        return {'model': self.model, 'messages': messages, **params}
+
+    def _headers(self):
+        headers = {'Content-Type': 'application/json', 'Accept': 'application/json'}
+        if self.api_key:
+            headers['Authorization'] = f"Bearer {self.api_key}"
+        return headers
+
+    def complete(self, prompt, **params) -> str:
+        """The reply to ``prompt`` (a string or a list of chat messages); extra params go into the request."""
+        request = self._request(prompt, params)
+        key = ResponseCache.key(request)
+        if self.cache is not None:
+            cached = self.cache.get(key)
+            if cached is not None:
+                return cached
+        with self._lock:
+            future = self._in_flight.get(key)
+            leader = future is None
+            if leader:
+                future = self._in_flight[key] = Future()
+        if not leader:
+            metrics.increment('openai.coalesced')
+            return future.result()
+        try:
+            reply = self._post(request)
+            if self.cache is not None:
+                self.cache.put(key, reply)
+            future.set_result(reply)
+            return reply
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                del self._in_flight[key]
+
+    def complete_many(self, prompts, **params) -> list:
+        """Replies to several prompts, in order; they share the pool and duplicates are sent once."""
+        keys = [ResponseCache.key(self._request(prompt, params)) for prompt in prompts]
+        unique = dict(zip(keys, prompts))
+        if not unique:
+            return []
+        workers = min(self.pool.max_connections, len(unique))
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='openai') as executor:
+            replies = dict(zip(unique, executor.map(lambda prompt: self.complete(prompt, **params),
+                                                    unique.values())))
+        return [replies[key] for key in keys]
+
+    def stream(self, prompt, **params):
+        """Yields the reply to ``prompt`` piece by piece as the server sends it.
+
+        A cached reply is yielded in one piece. A streamed reply is cached once it is complete.
+        """
+        request = self._request(prompt, params)
+        key = ResponseCache.key(request)
+        if self.cache is not None:
+            cached = self.cache.get(key)
+            if cached is not None:
+                yield cached
+                return
+        body = json.dumps({**request, 'stream': True}).encode('utf-8')
+        headers = {**self._headers(), 'Accept': 'text/event-stream'}
+        pieces = []
+        start = time.perf_counter()
+        with metrics.timer('openai.request'), self.pool.request('POST', COMPLETIONS_PATH, body, headers) as response:
+            if response.status != 200:
+                self._raise_for_status(response)
+            for line in response:
+                line = line.strip()
+                if not line.startswith(b'data:'):
+                    continue
+                data = line[len(b'data:'):].strip()
+                if data == b'[DONE]':
+                    break
+                piece = self._delta(data)
+                if piece:
+                    if not pieces:
+                        metrics.observe('openai.first_token', time.perf_counter() - start)
+                    pieces.append(piece)
+                    yield piece
+            response.read()  # Drain what is left so the connection can be reused
+        if self.cache is not None:
+            self.cache.put(key, ''.join(pieces))
+
+    def _post(self, request):
+        body = json.dumps(request).encode('utf-8')
+        with metrics.timer('openai.request'), \
+                self.pool.request('POST', COMPLETIONS_PATH, body, self._headers()) as response:
+            payload = response.read()
+            metrics.increment('openai.bytes_read', len(payload))
+            if response.status != 200:
+                raise ChatClientError(self._error_message(response.status, payload), response.status)
+        try:
+            return json.loads(payload)['choices'][0]['message']['content']
+        except (ValueError, KeyError, IndexError, TypeError):
+            raise ChatClientError(f"Unexpected chat completion response: {payload[:200]!r}") from None
+
+    @staticmethod
+    def _delta(data):
+        try:
+            return json.loads(data)['choices'][0]['delta'].get('content') or ''
+        except (ValueError, KeyError, IndexError, TypeError, AttributeError):
+            raise ChatClientError(f"Unexpected stream event: {data[:200]!r}") from None
+
+    def _raise_for_status(self, response):
+        payload = response.read()
+        raise ChatClientError(self._error_message(response.status, payload), response.status)
+
+    @staticmethod
+    def _error_message(status, payload):
+        try:
+            detail = json.loads(payload)['error']['message']
+        except (ValueError, KeyError, TypeError):
+            detail = payload[:200].decode('utf-8', 'replace')
+        return f"HTTP {status}: {detail}"
+
+    def close(self):
+        self.pool.close()
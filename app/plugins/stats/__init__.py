@@ -0,0 +1,65 @@
+import logging
+import os
+from app.commands import Command
+from app.instrumentation import metrics
+
+DEFAULT_SNAPSHOT_PATH = 'logs/metrics.json'
+
+class StatsCommand(Command):
+    def __init__(self):
+        self.operations = {
+            "1": ("Show Command Latency", self.show_latency),
+            "2": ("Show Counters", self.show_counters),
+            "3": ("Save Snapshot", self.save_snapshot),
+            "4": ("Reset Statistics", self.reset_statistics),
+        }
+
+    def execute(self):
+        while True:
+            print("\nStatistics Operations:")
+            for key, (name, _) in self.operations.items():
+                print(f"{key}. {name}")
+            print("0. Back")
+
+            choice = input("Select an operation: ")
+            if choice == '0':
+                logging.info("User selected to go back from StatsCommand.")
+                break  # Exit to the main menu
+
+            operation = self.operations.get(choice)
+            if operation:
+                _, operation_func = operation
+                logging.info(f"Executing stats operation: {operation[0]}")
+                operation_func()
+            else:
+                logging.warning("Invalid selection in StatsCommand.")
+                print("Invalid selection. Please try again.")
+
+    def show_latency(self):
+        if not metrics.enabled:
+            print("Metrics are off, remove METRICS=0 from .env to collect them.")
+            return
+        timers = metrics.snapshot()['timers']
+        if not timers:
+            print("No timings recorded yet.")
+            return
+        print(f"{'timer':<24} {'count':>7} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}")
+        for name, summary in timers.items():
+            print(f"{name:<24} {summary['count']:>7} {summary['p50'] * 1e3:>9.3f} "
+                  f"{summary['p95'] * 1e3:>9.3f} {summary['p99'] * 1e3:>9.3f}")
+
+    def show_counters(self):
+        counters = metrics.snapshot()['counters']
+        if not counters:
+            print("No counters recorded yet.")
+            return
+        for name, value in counters.items():
+            print(f"{name}: {value}")
+
+    def save_snapshot(self):
+        path = metrics.write_snapshot(os.environ.get('METRICS_SNAPSHOT', DEFAULT_SNAPSHOT_PATH))
+        print(f"Snapshot saved to '{path}'.")
+
+    def reset_statistics(self):
+        metrics.reset()
+        print("Statistics reset successfully.")
@@ -0,0 +1,249 @@
+"""REPL server: one warm App serving many clients at once over a Unix or TCP socket.
+
+Start it with `python main.py --serve ADDRESS` and connect with `python client.py ADDRESS`
+(see client.py for the address format and the line protocol). The plugins are imported
+and the history is loaded once, when the server starts.
+
+Every connection is a session with its own main menu loop on the event loop. Commands run
+through CommandHandler.execute_command on the AsyncCommandDispatcher's thread pool, at most
+SERVER_MAX_COMMANDS at once, so they are timed and the cpu_bound ones go to the worker pool
+just like in the local REPL. While a
+command runs, its input() waits for the client's answer and its print() output is sent to
+that client only. All sessions add to the one shared CommandHistoryManager.
+"""
+import asyncio
+import contextlib
+import itertools
+import json
+import logging
+import os
+import threading
+import time
+from app.commands import CommandHistoryManager
+from app.commands.dispatcher import AsyncCommandDispatcher
+from app.commands.session import CommandSession, using_session
+from app.instrumentation import metrics
+
+# Hundreds of clients may connect at once; Unix sockets refuse connections beyond the backlog
+BACKLOG = 1024
+
+
+class ClientConnection:
+    """The event-loop side of one client: sends JSON line messages and reads its answers."""
+
+    def __init__(self, reader, writer):
+        self.reader = reader
+        self.writer = writer
+        self.loop = asyncio.get_running_loop()
+        self.loop_thread = threading.get_ident()
+        self.closed = False
+
+    def send(self, **message):
+        """Queues one message for the client; only called on the event loop."""
+        if not self.closed:
+            self.writer.write(json.dumps(message).encode('utf-8') + b'\n')
+
+    async def receive(self):
+        """The client's next answer, or None once it has disconnected.
+
+        Besides {"input": ...} messages plain text lines are accepted, so `nc` works as a client.
+        """
+        try:
+            line = await self.reader.readline()
+        except ConnectionError:
+            line = b''
+        if not line:
+            self.closed = True
+            return None
+        text = line.decode('utf-8', 'replace').rstrip('\r\n')
+        if text.startswith('{'):
+            try:
+                return str(json.loads(text).get('input', ''))
+            except (ValueError, AttributeError):
+                pass
+        return text
+
+    async def ask(self, output, prompt):
+        """Sends the pending output and ``prompt``, then waits for the answer."""
+        output.flush()
+        self.send(prompt=prompt)
+        try:
+            await self.writer.drain()
+        except ConnectionError:
+            self.closed = True
+            return None
+        return await self.receive()
+
+
+class RemoteOutput:
+    """Output of a session: printed text is collected and sent to the client on flush."""
+
+    def __init__(self, connection: ClientConnection):
+        self.connection = connection
+        self._parts = []
+        self._lock = threading.Lock()
+
+    def write(self, text):
+        with self._lock:
+            self._parts.append(text)
+        return len(text)
+
+    def flush(self):
+        with self._lock:
+            text = ''.join(self._parts)
+            self._parts.clear()
+        if not text:
+            return
+        if threading.get_ident() == self.connection.loop_thread:
+            self.connection.send(output=text)
+        else:
+            # From a command's thread; the loop sends it before anything that thread schedules later
+            self.connection.loop.call_soon_threadsafe(lambda: self.connection.send(output=text))
+
+
+class RemoteSession(CommandSession):
+    """A CommandSession whose answers come from a connected client instead of a script."""
+
+    def __init__(self, connection: ClientConnection, session_id: int):
+        super().__init__(output=RemoteOutput(connection))
+        self.connection = connection
+        self.id = session_id
+        self.started = time.time()
+        self.commands_run = 0
+
+    async def ask(self, prompt):
+        return await self.connection.ask(self.output, prompt)
+
+    def next_input(self, prompt=''):
+        """Called by input() in a command running on the dispatcher's threads."""
+        if threading.get_ident() == self.connection.loop_thread:
+            raise RuntimeError("input() would block the event loop; async commands must not prompt")
+        answer = asyncio.run_coroutine_threadsafe(self.ask(prompt), self.connection.loop).result()
+        if answer is None:
+            raise EOFError(f"Session {self.id}: the client disconnected")
+        return answer
+
+
+class ReplServer:
+    """Serves the App's commands to many concurrent client sessions; see the module docstring."""
+
+    def __init__(self, app, max_commands=None):
+        self.app = app
+        if max_commands is None:
+            max_commands = int(os.environ.get('SERVER_MAX_COMMANDS', 64))
+        # A command waiting for its client's answer holds a thread, so this also caps those
+        self.dispatcher = AsyncCommandDispatcher(app.command_handler, max_concurrency=max_commands)
+        self.history = CommandHistoryManager()
+        self.sessions = {}
+        self._session_ids = itertools.count(1)
+        self._server = None
+
+    def warm_up(self):
+        """Loads the plugins, imports every command and reads the history before the first client."""
+        start = time.perf_counter()
+        self.app.load_plugins()
+        for command in self.app.command_handler.commands.values():
+            getattr(command, 'instance', None)  # LazyCommand imports its plugin here
+        self.history.count()
+        logging.info(f"REPL server warmed up in {time.perf_counter() - start:.3f}s")
+
+    async def start(self, address):
+        """Listens on ``address``: a Unix socket path, or a (host, port) pair for TCP."""
+        self.warm_up()
+        self.dispatcher.start()  # Routes input() and print() through the sessions
+        if isinstance(address, str):
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(address)  # Left over from a server that did not shut down cleanly
+            self._server = await asyncio.start_unix_server(self.handle_client, path=address, backlog=BACKLOG)
+        else:
+            host, port = address
+            self._server = await asyncio.start_server(self.handle_client, host, port, backlog=BACKLOG)
+        logging.info(f"REPL server listening on {address}")
+        return self._server
+
+    @property
+    def addresses(self):
+        return [sock.getsockname() for sock in self._server.sockets] if self._server else []
+
+    async def serve_forever(self, address):
+        await self.start(address)
+        try:
+            async with self._server:
+                await self._server.serve_forever()
+        finally:
+            self.close()
+
+    async def stop(self):
+        """Stops listening and ends the open sessions; a command waiting for input gets an EOFError."""
+        if self._server is not None:
+            self._server.close()
+            for session in list(self.sessions.values()):
+                session.connection.writer.close()
+            await self._server.wait_closed()
+        self.close()
+
+    def close(self):
+        self.dispatcher.close()
+
+    async def handle_client(self, reader, writer):
+        connection = ClientConnection(reader, writer)
+        session = RemoteSession(connection, next(self._session_ids))
+        self.sessions[session.id] = session
+        metrics.increment('server.sessions')
+        logging.info(f"Session {session.id} connected")
+        try:
+            with using_session(session):  # print() in this task goes to the client
+                self.app.print_main_menu()
+                while True:
+                    user_input = await session.ask(">>> ")
+                    if user_input is None:
+                        break
+                    if not await self.handle_input(session, user_input.strip()):
+                        break
+                session.output.flush()
+                connection.send(close=True)
+                await writer.drain()
+        except ConnectionError:
+            pass  # The client went away in the middle of a reply
+        finally:
+            del self.sessions[session.id]
+            logging.info(f"Session {session.id} closed after {session.commands_run} commands")
+            writer.close()
+            with contextlib.suppress(ConnectionError):
+                await writer.wait_closed()
+
+    async def handle_input(self, session, user_input):
+        """One line at the session's main prompt, handled like App.start; False ends the session."""
+        if user_input.lower() == 'exit':
+            logging.info(f"Session {session.id} exiting.")
+            print("Exiting application.")
+            return False
+        try:
+            index = int(user_input) - 1
+        except ValueError:
+            logging.error("Only numbers are allowed, wrong input.")
+            print("Only numbers are allowed, wrong input.")
+            return True
+        if index < 0:
+            self.app.print_main_menu()
+            return True
+        command_name = self.app.command_handler.get_command_by_index(index)
+        if not command_name:
+            logging.warning("Invalid selection. Please enter a valid number.")
+            print("Invalid selection. Please enter a valid number.")
+            return True
+        result = await self.dispatcher.submit(command_name, session=session)
+        if result.status == 'exit':
+            return False  # The exit command (or menu -> 0) ends this session, not the server
+        if result.status == 'error':
+            print(f"Command failed: {result.error}")
+            return not session.connection.closed
+        # Writing the history may hit the disk; keep it off the event loop
+        await asyncio.get_running_loop().run_in_executor(None, self.history.add_command, command_name)
+        session.commands_run += 1
+        self.app.print_main_menu()
+        return True
+
+    def stats(self):
+        """Open sessions plus the dispatcher's queue depth and per-command wall times."""
+        return {'sessions': len(self.sessions), **self.dispatcher.stats()}
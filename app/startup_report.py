@@ -0,0 +1,111 @@
+"""Startup report: what the app imports before the first prompt, and how long that takes.
+
+Run with `python -m app.startup_report [--top N]`. A fresh interpreter is started with
+`-X importtime` and goes through the same steps as `python main.py` up to the first
+prompt (App(), load_plugins, the main menu, the history manager). The report lists the
+slowest imports by cumulative and by self time and whether pandas or NumPy were loaded.
+`measure_cold_start` times the real `python main.py` until it prints its prompt.
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+
+HEAVY_MODULES = ('pandas', 'numpy')
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PROMPT = b'>>> '
+
+# Everything App.start does before it waits for input, with the menu sent to /dev/null
+STARTUP_SCRIPT = '''
+import contextlib, io, json, sys, time
+start = time.perf_counter()
+from app import App
+from app.commands import CommandHistoryManager
+app = App()
+app.load_plugins()
+with contextlib.redirect_stdout(io.StringIO()):
+    app.print_main_menu()
+CommandHistoryManager()
+print(json.dumps({'seconds': time.perf_counter() - start,
+                  'heavy_modules': [name for name in %r if name in sys.modules]}))
+''' % (HEAVY_MODULES,)
+
+
+def parse_importtime(lines):
+    """`-X importtime` lines -> [(module, self microseconds, cumulative microseconds, depth)]."""
+    imports = []
+    for line in lines:
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        depth = (len(name) - len(name.lstrip())) // 2
+        imports.append((name.strip(), int(self_us), int(cumulative_us), depth))
+    return imports
+
+
+def startup_profile(env=None):
+    """Runs STARTUP_SCRIPT in a fresh interpreter; returns its timing, the heavy modules loaded and the imports.
+
+    ``env`` adds to the environment of the interpreter, e.g. a PLUGIN_MANIFEST_PATH.
+    """
+    completed = subprocess.run([sys.executable, '-X', 'importtime', '-c', STARTUP_SCRIPT], cwd=ROOT_DIR,
+                               env={**os.environ, **(env or {})}, capture_output=True, text=True, check=True)
+    profile = json.loads(completed.stdout.strip().splitlines()[-1])
+    profile['imports'] = parse_importtime(completed.stderr.splitlines())
+    return profile
+
+
+def measure_cold_start(timeout=30.0):
+    """Seconds from launching `python main.py` until it prints its first prompt; the app is then told to exit."""
+    start = time.perf_counter()
+    process = subprocess.Popen([sys.executable, 'main.py'], cwd=ROOT_DIR, stdin=subprocess.PIPE,
+                               stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+    output = b''
+    try:
+        while PROMPT not in output:
+            chunk = process.stdout.read1(4096)
+            if not chunk:
+                raise RuntimeError(f"main.py exited before its first prompt: {output[-200:]!r}")
+            output += chunk
+            if time.perf_counter() - start > timeout:
+                raise TimeoutError(f"No prompt from main.py within {timeout} seconds")
+        elapsed = time.perf_counter() - start
+        process.communicate(b'exit\n', timeout=timeout)
+    finally:
+        if process.poll() is None:
+            process.kill()
+            process.wait()
+    return elapsed
+
+
+def format_report(profile, cold_start=None, top=15):
+    imports = profile['imports']
+    lines = [f"Startup to first prompt: {profile['seconds'] * 1e3:.1f} ms in-process"]
+    if cold_start is not None:
+        lines.append(f"Cold start of main.py to first prompt: {cold_start * 1e3:.1f} ms")
+    lines.append(f"Imports: {len(imports)} modules, "
+                 f"{sum(item[1] for item in imports) / 1e3:.1f} ms")
+    heavy = ', '.join(profile['heavy_modules']) or 'none'
+    lines.append(f"Heavy modules loaded: {heavy}")
+    for title, column in (('cumulative', 2), ('self', 1)):
+        lines.append(f"\nSlowest imports by {title} time:")
+        ranked = sorted(imports, key=lambda item, column=column: item[column], reverse=True)
+        for name, self_us, cumulative_us, _ in ranked[:top]:
+            lines.append(f"{cumulative_us / 1e3:>9.1f} ms cumulative {self_us / 1e3:>8.1f} ms self  {name}")
+    return lines
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--top', type=int, default=15, help='imports listed per table')
+    parser.add_argument('--skip-cold-start', action='store_true', help='do not launch main.py')
+    args = parser.parse_args(argv)
+    cold_start = None if args.skip_cold_start else measure_cold_start()
+    print('\n'.join(format_report(startup_profile(), cold_start, args.top)))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
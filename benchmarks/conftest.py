@@ -0,0 +1,81 @@
+"""pytest plumbing for the benchmark suite: the ``benchmark`` fixture, baselines and the report"""
+import pytest
+from benchmarks.harness import (DEFAULT_BASELINE_PATH, DEFAULT_THRESHOLD, BenchmarkResult, find_missing_baselines,
+                                find_regressions, format_report, load_baselines, run_rounds, save_baselines)
+
+RESULTS_KEY = pytest.StashKey[list]()
+BASELINES_KEY = pytest.StashKey[dict]()
+REGRESSIONS_KEY = pytest.StashKey[list]()
+MISSING_KEY = pytest.StashKey[list]()
+
+
+def pytest_addoption(parser):
+    group = parser.getgroup('benchmark')
+    group.addoption('--benchmark-save', action='store_true', help='store this run as the new baseline')
+    group.addoption('--benchmark-baseline', default=DEFAULT_BASELINE_PATH, help='baseline JSON file')
+    group.addoption('--benchmark-threshold', type=float, default=DEFAULT_THRESHOLD,
+                    help='allowed slowdown of the median before a regression is flagged (0.25 = 25%%)')
+
+
+def pytest_configure(config):
+    config.stash[RESULTS_KEY] = []
+    config.stash[BASELINES_KEY] = {}
+    config.stash[REGRESSIONS_KEY] = []
+    config.stash[MISSING_KEY] = []
+
+
+class Benchmark:
+    """Callable like pytest-benchmark's fixture: ``benchmark(func, *args)`` or ``benchmark.pedantic(...)``."""
+
+    def __init__(self, name, results):
+        self.name = name
+        self.results = results
+
+    def __call__(self, func, *args, **kwargs):
+        return self.pedantic(func, args=args, kwargs=kwargs)
+
+    def pedantic(self, func, args=(), kwargs=None, setup=None, rounds=None, warmup_rounds=1):
+        value, timings = run_rounds(func, args, kwargs, setup=setup, rounds=rounds, warmup_rounds=warmup_rounds)
+        self.results.append(BenchmarkResult(self.name, timings))
+        return value
+
+
+@pytest.fixture
+def benchmark(request):
+    return Benchmark(request.node.nodeid.rsplit('/', 1)[-1], request.config.stash[RESULTS_KEY])
+
+
+def pytest_sessionfinish(session):
+    config = session.config
+    results = config.stash[RESULTS_KEY]
+    if not results:
+        return
+    baselines = config.stash[BASELINES_KEY] = load_baselines(config.getoption('benchmark_baseline'))
+    if config.getoption('benchmark_save'):
+        save_baselines(results, config.getoption('benchmark_baseline'))
+        return
+    regressions = find_regressions(results, baselines, config.getoption('benchmark_threshold'))
+    config.stash[REGRESSIONS_KEY] = regressions
+    # Without a baseline nothing is compared, so the gate must not pass silently
+    config.stash[MISSING_KEY] = find_missing_baselines(results, baselines)
+    if regressions or config.stash[MISSING_KEY]:
+        session.exitstatus = pytest.ExitCode.TESTS_FAILED
+
+
+def pytest_terminal_summary(terminalreporter, config):
+    results = config.stash[RESULTS_KEY]
+    if not results:
+        return
+    baseline_path = config.getoption('benchmark_baseline')
+    terminalreporter.section('benchmarks')
+    for line in format_report(results, config.stash[BASELINES_KEY]):
+        terminalreporter.write_line(line)
+    if config.getoption('benchmark_save'):
+        terminalreporter.write_line(f"Baseline saved to '{baseline_path}'.")
+    for name, baseline, median in config.stash[REGRESSIONS_KEY]:
+        terminalreporter.write_line(f"REGRESSION {name}: {median * 1e3:.3f} ms, baseline {baseline * 1e3:.3f} ms",
+                                    red=True, bold=True)
+    missing = config.stash[MISSING_KEY]
+    if missing:
+        terminalreporter.write_line(f"NO BASELINE for {len(missing)} benchmarks in '{baseline_path}': "
+                                    f"{', '.join(missing)}. Record one with --benchmark-save.", red=True, bold=True)
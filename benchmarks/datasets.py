@@ -0,0 +1,41 @@
+"""Generated data sets shared by the benchmark modules"""
+import os
+
+import numpy as np
+import pandas as pd
+from faker import Faker
+
+from app.commands import CommandHistoryManager, Singleton
+from app.commands.history_store import create_history_backend
+
+
+def generate_states(path, rows, seed=0):
+    """Writes ``rows`` records shaped like data/gpt_states.csv, with names drawn from Faker."""
+    fake = Faker('en_US')
+    Faker.seed(seed)
+    states = [(fake.state_abbr(), fake.state()) for _ in range(200)]
+    cities = [fake.city() for _ in range(200)]
+    rng = np.random.default_rng(seed)
+    picks = rng.integers(0, len(states), rows)
+    pd.DataFrame({
+        'State Abbreviation': [states[pick][0] for pick in picks],
+        'State Name': [states[pick][1] for pick in picks],
+        'Population': rng.integers(500_000, 40_000_000, rows),
+        'Capital': [cities[pick] for pick in picks],
+    }).to_csv(path, index=False)
+    return path
+
+
+def generate_shards(directory, shards, rows):
+    return [generate_states(os.path.join(directory, f'part-{shard:04d}.csv'), rows, seed=shard)
+            for shard in range(shards)]
+
+
+def make_manager(history_file, size, backend='csv', max_records=None):
+    """A fresh (non-singleton) manager over a history holding ``size`` records, MAX records raised to match."""
+    if not os.path.exists(history_file):
+        log = create_history_backend(backend, history_file, max_records=size)
+        log.rewrite([('2024-03-20 16:05:50', 'greet')] * size)
+        log.close()
+    Singleton._instances.pop(CommandHistoryManager, None)
+    return CommandHistoryManager(history_file=history_file, max_records=max_records or size, backend=backend)
@@ -0,0 +1,126 @@
+"""Timing, JSON baselines and regression checks for the pytest benchmark suite.
+
+The suite lives in `benchmarks/test_*.py` and is run with `pytest benchmarks -m benchmark`
+(`-m "benchmark and not slow"` skips the 1e6 record cases). Each benchmark is timed for a
+number of rounds and summarized by its median. `--benchmark-save` writes the medians to
+`benchmarks/baselines.json`; later runs compare against that file and fail when a median
+is more than `--benchmark-threshold` (default 25%) slower than its baseline. Baselines are
+machine specific and not committed, so a run fails as well when a benchmark has none yet.
+"""
+import json
+import os
+import platform
+import statistics
+import time
+from datetime import datetime
+
+DEFAULT_BASELINE_PATH = os.path.join(os.path.dirname(__file__), 'baselines.json')
+DEFAULT_THRESHOLD = 0.25
+
+
+class BenchmarkResult:
+    def __init__(self, name, timings):
+        self.name = name
+        self.timings = timings  # Seconds per round
+
+    @property
+    def median(self):
+        return statistics.median(self.timings)
+
+    def stats(self):
+        return {
+            'rounds': len(self.timings),
+            'min': min(self.timings),
+            'median': self.median,
+            'mean': statistics.mean(self.timings),
+            'stdev': statistics.stdev(self.timings) if len(self.timings) > 1 else 0.0,
+        }
+
+
+def run_rounds(func, args=(), kwargs=None, setup=None, rounds=None, warmup_rounds=1,
+               min_rounds=5, max_rounds=100, min_time=0.2):
+    """Calls ``func`` repeatedly and returns (last return value, per-round seconds).
+
+    With ``rounds`` set exactly that many rounds are timed, otherwise rounds are added until
+    ``min_time`` has passed (between ``min_rounds`` and ``max_rounds``). ``setup`` runs before
+    every round, outside the timing, and may return the (args, kwargs) for that round.
+    """
+    kwargs = kwargs or {}
+
+    def one_round():
+        call_args, call_kwargs = args, kwargs
+        if setup is not None:
+            prepared = setup()
+            if prepared is not None:
+                call_args, call_kwargs = prepared
+        start = time.perf_counter()
+        value = func(*call_args, **call_kwargs)
+        return value, time.perf_counter() - start
+
+    for _ in range(warmup_rounds):
+        one_round()
+    timings = []
+    value = None
+    while True:
+        value, elapsed = one_round()
+        timings.append(elapsed)
+        if rounds is not None:
+            if len(timings) >= rounds:
+                break
+        elif len(timings) >= max_rounds or (len(timings) >= min_rounds and sum(timings) >= min_time):
+            break
+    return value, timings
+
+
+def load_baselines(path=DEFAULT_BASELINE_PATH):
+    """Benchmark name -> stats from a saved baseline file, empty when there is none."""
+    if not os.path.exists(path):
+        return {}
+    with open(path, encoding='utf-8') as handle:
+        return json.load(handle).get('benchmarks', {})
+
+
+def save_baselines(results, path=DEFAULT_BASELINE_PATH):
+    """Writes the results as the new baseline, keeping baselines of benchmarks that did not run."""
+    benchmarks = load_baselines(path)
+    benchmarks.update({result.name: result.stats() for result in results})
+    document = {
+        'saved_at': datetime.now().isoformat(timespec='seconds'),
+        'machine': {'python': platform.python_version(), 'platform': platform.platform(),
+                    'processor': platform.processor()},
+        'benchmarks': dict(sorted(benchmarks.items())),
+    }
+    temp_path = f"{path}.tmp"
+    with open(temp_path, 'w', encoding='utf-8') as handle:
+        json.dump(document, handle, indent=2)
+    os.replace(temp_path, path)
+    return path
+
+
+def find_regressions(results, baselines, threshold=DEFAULT_THRESHOLD):
+    """(name, baseline median, median) for every result slower than its baseline by more than ``threshold``."""
+    regressions = []
+    for result in results:
+        baseline = baselines.get(result.name)
+        if baseline and result.median > baseline['median'] * (1 + threshold):
+            regressions.append((result.name, baseline['median'], result.median))
+    return regressions
+
+
+def find_missing_baselines(results, baselines):
+    """Names of the results that have no baseline to compare against."""
+    return [result.name for result in results if result.name not in baselines]
+
+
+def format_report(results, baselines):
+    lines = [f"{'benchmark':<64} {'rounds':>6} {'median ms':>10} {'baseline ms':>12} {'change':>8}"]
+    for result in results:
+        baseline = baselines.get(result.name)
+        if baseline:
+            change = f"{result.median / baseline['median'] - 1:+.1%}"
+            baseline_ms = f"{baseline['median'] * 1e3:.3f}"
+        else:
+            change = baseline_ms = '-'
+        lines.append(f"{result.name:<64} {len(result.timings):>6} {result.median * 1e3:>10.3f} "
+                     f"{baseline_ms:>12} {change:>8}")
+    return lines
@@ -0,0 +1,28 @@
+"""Benchmarks: compiled calculator expressions on scalars and on million-element columns"""
+import numpy as np
+import pytest
+from app.plugins.calculator import CalculatorCommand
+
+pytestmark = pytest.mark.benchmark
+
+
+@pytest.fixture(scope='module')
+def evaluator():
+    return CalculatorCommand().expressions
+
+
+def test_expression_scalar(benchmark, evaluator):
+    """1000 evaluations of a cached expression on floats, so the per-call cost is median / 1000."""
+    def evaluate():
+        for _ in range(1_000):
+            evaluator.evaluate('a*b + c/d', a=2.0, b=3.0, c=1.0, d=4.0)
+
+    benchmark(evaluate)
+
+
+@pytest.mark.parametrize('rows', [1_000_000])
+def test_expression_columns(benchmark, evaluator, rows):
+    rng = np.random.default_rng(0)
+    a, b, c, d = (rng.random(rows) for _ in range(4))
+    result = benchmark(evaluator.evaluate, 'a*b + c/d', a=a, b=b, c=c, d=d)
+    assert result.rejected == 0
@@ -0,0 +1,97 @@
+"""Benchmarks: CsvCommand sorting, sharded processing and printing on generated state data sets"""
+import contextlib
+import logging
+import os
+import numpy as np
+import pandas as pd
+import pytest
+from app.plugins.csv import CsvCommand
+from benchmarks.datasets import generate_shards, generate_states
+
+pytestmark = pytest.mark.benchmark
+
+SIZES = [10_000, 100_000, pytest.param(1_000_000, marks=pytest.mark.slow)]
+
+
+@pytest.fixture(scope='module', params=SIZES)
+def csv_command(request, tmp_path_factory):
+    data_dir = tmp_path_factory.mktemp('csv')
+    csv_command = CsvCommand()
+    csv_command._CsvCommand__data_dir = str(data_dir)  # Override private attributes
+    csv_command._CsvCommand__input_file_path = generate_states(str(data_dir / 'gpt_states.csv'), request.param)
+    csv_command._CsvCommand__output_file_path = str(data_dir / 'sorted_states.csv')
+    return csv_command
+
+
+def test_read_sort_and_reduce(benchmark, csv_command):
+    reduced = benchmark.pedantic(csv_command.read_sort_and_reduce, rounds=5)
+    assert reduced['Population'].is_monotonic_increasing
+
+
+@pytest.fixture(scope='module')
+def shard_paths(tmp_path_factory):
+    return generate_shards(str(tmp_path_factory.mktemp('shards')), shards=16, rows=25_000)
+
+
+@pytest.mark.parametrize('workers, streaming', [(1, False)] + [(workers, True) for workers in
+                                                                 sorted({1, 2, os.cpu_count() or 1})])
+def test_process_shards(benchmark, shard_paths, workers, streaming, tmp_path):
+    """16 shards of 25k rows, sorted in memory (streaming=False) or through run files on the workers.
+
+    The worker path only beats the in-memory sort on several cores and data too large for memory.
+    """
+    output_path = str(tmp_path / 'sorted_states.csv')
+    csv_command = CsvCommand(workers=workers, streaming=streaming)
+    benchmark.pedantic(csv_command.process_shards, args=(shard_paths, output_path), rounds=3)
+
+
+def make_frame(rows):
+    rng = np.random.default_rng(0)
+    return pd.DataFrame({
+        'State Abbreviation': np.char.add('S', np.arange(rows).astype(str)),
+        'State Name': np.char.add('State ', np.arange(rows).astype(str)),
+        'Population': rng.integers(1_000, 40_000_000, rows),
+    })
+
+
+def legacy_display(df_read_states, sort_by='Population'):
+    """The per-row, per-field print/logging loop CsvCommand.execute used to run."""
+    print(f"States from CSV, sorted by {sort_by}")
+    for index, row in df_read_states.iterrows():
+        state_info = f"{row['State Abbreviation']}: {row['State Name']}"
+        print(f"Record {index}: {state_info}")
+        logging.info(f"Record {index}: {state_info}")
+        for field in row.index:
+            field_info = f"    {field}: {row[field]}"
+            print(field_info)
+            logging.info(f"Index: {index}, {field_info}")
+
+
+@pytest.fixture
+def quiet_output(tmp_path):
+    """stdout to /dev/null and logging to a temporary file, so printing pays for real I/O calls."""
+    root = logging.getLogger()
+    handler = logging.FileHandler(tmp_path / 'bench.log')
+    level = root.level
+    root.addHandler(handler)
+    root.setLevel(logging.INFO)
+    with open(os.devnull, 'w', encoding='utf-8') as devnull, contextlib.redirect_stdout(devnull):
+        yield
+    root.removeHandler(handler)
+    root.setLevel(level)
+    handler.close()
+
+
+@pytest.mark.usefixtures('quiet_output')
+@pytest.mark.parametrize('display', ['legacy', 'bulk', 'preview'])
+@pytest.mark.parametrize('rows', [10_000, pytest.param(1_000_000, marks=pytest.mark.slow)])
+def test_display(benchmark, display, rows):
+    """Printing the sorted records: the old iterrows loop, the bulk renderer and a 20 row preview."""
+    if display == 'legacy' and rows > 10_000:
+        pytest.skip("the iterrows loop takes minutes at this size")
+    frame = make_frame(rows)
+    if display == 'legacy':
+        benchmark.pedantic(legacy_display, args=(frame,), rounds=3)
+    else:
+        preview_rows = 20 if display == 'preview' else None
+        benchmark.pedantic(CsvCommand().display, args=(frame,), kwargs={'preview_rows': preview_rows}, rounds=3)
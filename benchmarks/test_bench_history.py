@@ -0,0 +1,99 @@
+"""Benchmarks: CommandHistoryManager add/load/startup from 1e3 to 1e6 records, and shared history appends"""
+import multiprocessing
+import os
+import pytest
+from app.commands import CommandHistoryManager, Singleton
+from app.commands.history_store import SharedHistoryLog
+from benchmarks.datasets import make_manager
+from util.constants import MAX_HISTORY_RECORDS
+
+pytestmark = pytest.mark.benchmark
+
+SIZES = [1_000, 10_000, 100_000, pytest.param(1_000_000, marks=pytest.mark.slow)]
+
+
+@pytest.fixture(params=['csv', 'columnar'])
+def backend(request):
+    return request.param
+
+
+@pytest.fixture(params=SIZES)
+def history_file(request, tmp_path_factory, backend):
+    """A history of the given number of records, written once per size and backend."""
+    path = str(tmp_path_factory.mktemp('history') / 'command_history')
+    make_manager(path, request.param, backend).log.close()
+    Singleton._instances.pop(CommandHistoryManager, None)
+    return path, request.param
+
+
+@pytest.fixture
+def history_manager(history_file, backend):
+    """A manager over the pre-filled history with MAX records raised to match, so nothing is compacted away."""
+    path, size = history_file
+    manager = make_manager(path, size, backend)
+    yield manager
+    manager.log.close()
+    Singleton._instances.pop(CommandHistoryManager, None)
+
+
+def test_add_command(benchmark, history_manager):
+    """100 add_command calls on a full history, so the per-call cost is median / 100; flat as the size grows."""
+    def add_commands():
+        for _ in range(100):
+            history_manager.add_command('calculator')
+
+    benchmark(add_commands)
+
+
+def test_load_history(benchmark, history_manager):
+    frame = benchmark.pedantic(history_manager.load_history, rounds=5)
+    assert len(frame) == history_manager.log.max_records
+
+
+def test_startup(benchmark, history_file, backend):
+    """Constructing a manager with the default MAX records and reading its history once.
+
+    The columnar backend memory-maps only the tail, so its startup does not depend on the size.
+    """
+    path, _ = history_file
+
+    def start():
+        manager = make_manager(path, 0, backend, max_records=MAX_HISTORY_RECORDS)
+        records = manager.get_history()
+        manager.log.close()
+        return records
+
+    assert len(benchmark.pedantic(start, rounds=5)) == MAX_HISTORY_RECORDS
+    Singleton._instances.pop(CommandHistoryManager, None)
+
+
+def write_records(path, writer, count, max_records):
+    log = SharedHistoryLog(path, max_records=max_records)
+    for index in range(count):
+        log.append('2024-03-20 16:05:50', f'writer{writer}-{index}')
+    log.close()
+
+
+def append_from_processes(path, processes, count, max_records):
+    """Every process appends ``count`` records to one shared history directory."""
+    workers = [multiprocessing.Process(target=write_records, args=(path, writer, count, max_records))
+               for writer in range(processes)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+
+
+@pytest.mark.parametrize('processes', sorted({1, 2, 4, os.cpu_count() or 1}))
+def test_shared_appends(benchmark, tmp_path, processes):
+    """2000 appends per writer process to a SharedHistoryLog; none may be lost in the merged history."""
+    directories = iter(range(1_000))
+
+    def setup():
+        path = str(tmp_path / f'history-{next(directories)}.d')
+        return (path, processes, 2_000, processes * 2_000), {}
+
+    benchmark.pedantic(append_from_processes, setup=setup, rounds=3)
+    path = str(tmp_path / 'check.d')
+    append_from_processes(path, processes, 2_000, processes * 2_000)
+    assert len(SharedHistoryLog(path, max_records=processes * 2_000).read_tail()) == processes * 2_000
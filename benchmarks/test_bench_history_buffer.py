@@ -0,0 +1,105 @@
+"""Benchmarks: add / get / clear on the in-memory history structures.
+
+Compares the original pandas approach (concat + tail on every add), a deque of
+(timestamp, command) tuples and the NumPy ring buffer used by CommandHistoryManager.
+"""
+from collections import deque
+import pandas as pd
+import pytest
+from app.commands.history_buffer import HistoryRingBuffer
+from app.commands.history_store import HISTORY_COLUMNS
+
+pytestmark = pytest.mark.benchmark
+
+COMMANDS = ['greet', 'calculator', 'csv', 'history', 'menu']
+TIMESTAMP = '2024-03-20 16:05:50'
+SECONDS = 1_710_950_750
+
+
+class PandasHistory:
+    """The original implementation: a DataFrame trimmed with concat(...).tail(N)."""
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.frame = pd.DataFrame(columns=HISTORY_COLUMNS)
+
+    def fill(self, commands):
+        self.frame = pd.DataFrame({'Timestamp': [TIMESTAMP] * len(commands), 'Command': commands})
+
+    def add(self, command):
+        new_entry = pd.DataFrame({'Timestamp': [TIMESTAMP], 'Command': [command]})
+        self.frame = pd.concat([self.frame, new_entry], ignore_index=True).tail(self.capacity)
+
+    def get(self):
+        return self.frame['Command'].tolist()
+
+    def clear(self):
+        self.frame = pd.DataFrame(columns=HISTORY_COLUMNS)
+
+
+class DequeHistory:
+    def __init__(self, capacity):
+        self.records = deque(maxlen=capacity)
+
+    def fill(self, commands):
+        self.records.extend((TIMESTAMP, command) for command in commands)
+
+    def add(self, command):
+        self.records.append((TIMESTAMP, command))
+
+    def get(self):
+        return [command for _, command in self.records]
+
+    def clear(self):
+        self.records.clear()
+
+
+class RingHistory:
+    def __init__(self, capacity):
+        self.buffer = HistoryRingBuffer(capacity)
+
+    def fill(self, commands):
+        for command in commands:
+            self.buffer.append(SECONDS, command)
+
+    def add(self, command):
+        self.buffer.append(SECONDS, command)
+
+    def get(self):
+        return self.buffer.commands()
+
+    def clear(self):
+        self.buffer.clear()
+
+
+IMPLEMENTATIONS = {'pandas': PandasHistory, 'deque': DequeHistory, 'ring': RingHistory}
+
+
+@pytest.fixture(params=[5, 1_000, pytest.param(100_000, marks=pytest.mark.slow)])
+def capacity(request):
+    return request.param
+
+
+@pytest.fixture(params=list(IMPLEMENTATIONS))
+def history(request, capacity):
+    """A full history of ``capacity`` records in the given implementation."""
+    history = IMPLEMENTATIONS[request.param](capacity)
+    history.fill([COMMANDS[index % len(COMMANDS)] for index in range(capacity)])
+    return history
+
+
+def test_add(benchmark, history):
+    """1000 adds to a full history, so the per-call cost is median / 1000."""
+    def add():
+        for _ in range(1_000):
+            history.add('greet')
+
+    benchmark(add)
+
+
+def test_get(benchmark, history, capacity):
+    assert len(benchmark(history.get)) == capacity
+
+
+def test_clear(benchmark, history):
+    benchmark.pedantic(history.clear, setup=lambda: history.add('greet'), rounds=100)
@@ -0,0 +1,64 @@
+"""Benchmarks: command latency with logging off, synchronous file logging and the async pipeline"""
+import contextlib
+import logging
+import os
+import pytest
+from app.commands import CommandHandler
+from app.logging_pipeline import LogPipeline
+from app.plugins.greet import GreetCommand
+
+pytestmark = pytest.mark.benchmark
+
+FORMAT = '%(asctime)s - %(levelname)s - %(message)s'
+CALLS = 1_000
+
+
+@pytest.fixture
+def handler():
+    handler = CommandHandler()
+    handler.register_command('greet', GreetCommand())
+    return handler
+
+
+@pytest.fixture(params=['off', 'sync', 'async'])
+def logging_mode(request, tmp_path):
+    """The root logger at INFO with no handler (logging disabled), a FileHandler or the LogPipeline handler."""
+    root = logging.getLogger()
+    level = root.level
+    root.setLevel(logging.INFO)
+    null_handler = logging.NullHandler()  # Stops logging.info() from calling basicConfig() itself
+    root.addHandler(null_handler)
+    pipeline = None
+    if request.param == 'off':
+        logging.disable(logging.CRITICAL)
+        handler = None
+    elif request.param == 'sync':
+        handler = logging.FileHandler(tmp_path / 'sync.log')
+        handler.setFormatter(logging.Formatter(FORMAT))
+    else:
+        pipeline = LogPipeline(str(tmp_path / 'async.log'), queue_size=CALLS * 20).start()
+        handler = pipeline.handler
+    if handler is not None:
+        root.addHandler(handler)
+    with open(os.devnull, 'w', encoding='utf-8') as devnull, contextlib.redirect_stdout(devnull):
+        yield pipeline
+    logging.disable(logging.NOTSET)
+    for added in (handler, null_handler):
+        if added is not None:
+            root.removeHandler(added)
+    if pipeline is not None:
+        pipeline.stop()
+    elif handler is not None:
+        handler.close()
+    root.setLevel(level)
+
+
+def test_greet_command(benchmark, handler, logging_mode):
+    """1000 greet commands through CommandHandler, so the per-call cost is median / 1000."""
+    def run():
+        for _ in range(CALLS):
+            handler.execute_command('greet')
+
+    benchmark(run)
+    if logging_mode is not None:
+        assert logging_mode.dropped == 0
@@ -0,0 +1,116 @@
+"""Benchmark: many concurrent client sessions against the REPL server.
+
+A server is started with `python main.py --serve` on a temporary Unix socket, with its
+history in the same temporary directory. Every simulated session connects, then runs
+`rounds` times the greet command and an Add in the calculator (5 prompts). A round of
+the benchmark is the whole load test; the p50/p95/p99 latency from sending an answer to
+receiving the next prompt is checked against the round time.
+"""
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import time
+import pytest
+
+pytestmark = pytest.mark.benchmark
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# Answers to the main prompt and the calculator prompts: greet, then calculator -> Add 3 4 -> back
+SCENARIO = ['6', '2', '1', '3', '4', '0']
+
+
+async def _open(address):
+    if isinstance(address, str):
+        return await asyncio.open_unix_connection(address)
+    return await asyncio.open_connection(*address)
+
+
+async def _next_prompt(reader):
+    """Reads messages until the server prompts; returns False when it closed the session instead."""
+    while True:
+        line = await reader.readline()
+        if not line:
+            return False
+        message = json.loads(line)
+        if 'prompt' in message:
+            return True
+        if message.get('close'):
+            return False
+
+
+async def run_session(address, rounds, latencies, connect_times):
+    start = time.perf_counter()
+    reader, writer = await _open(address)
+    await _next_prompt(reader)
+    connect_times.append(time.perf_counter() - start)
+    for answer in SCENARIO * rounds:
+        sent = time.perf_counter()
+        writer.write(json.dumps({'input': answer}).encode() + b'\n')
+        if not await _next_prompt(reader):
+            raise RuntimeError(f"The server closed the session after {answer!r}")
+        latencies.append(time.perf_counter() - sent)
+    writer.write(b'{"input": "exit"}\n')
+    await writer.drain()
+    while await reader.readline():
+        pass
+    writer.close()
+    await writer.wait_closed()
+
+
+def percentile(ordered, fraction):
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))] if ordered else 0.0
+
+
+async def load_test(address, sessions=200, rounds=10):
+    """Runs ``sessions`` concurrent sessions; returns the throughput and latency statistics."""
+    latencies, connect_times = [], []
+    start = time.perf_counter()
+    await asyncio.gather(*(run_session(address, rounds, latencies, connect_times) for _ in range(sessions)))
+    elapsed = time.perf_counter() - start
+    latencies.sort()
+    connect_times.sort()
+    return {
+        'sessions': sessions,
+        'requests': len(latencies),
+        'seconds': elapsed,
+        'throughput': len(latencies) / elapsed,
+        'connect_p50': percentile(connect_times, 0.50),
+        'connect_p99': percentile(connect_times, 0.99),
+        'p50': percentile(latencies, 0.50),
+        'p95': percentile(latencies, 0.95),
+        'p99': percentile(latencies, 0.99),
+        'max': latencies[-1] if latencies else 0.0,
+    }
+
+
+def start_server(directory, timeout=30.0):
+    """`python main.py --serve` on a Unix socket in ``directory``; returns (process, socket path)."""
+    path = os.path.join(directory, 'repl.sock')
+    environment = dict(os.environ, HISTORY_FILE=os.path.join(directory, 'command_history.csv'))
+    process = subprocess.Popen([sys.executable, 'main.py', '--serve', f"unix:{path}"], cwd=ROOT_DIR,
+                               env=environment, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.perf_counter() + timeout
+    while not os.path.exists(path):
+        if process.poll() is not None or time.perf_counter() > deadline:
+            process.kill()
+            raise RuntimeError("The REPL server did not start")
+        time.sleep(0.05)
+    return process, path
+
+
+@pytest.fixture(scope='module')
+def server_path(tmp_path_factory):
+    process, path = start_server(str(tmp_path_factory.mktemp('server')))
+    yield path
+    process.terminate()
+    process.wait()
+
+
+@pytest.mark.parametrize('sessions', [50, pytest.param(200, marks=pytest.mark.slow)])
+def test_concurrent_sessions(benchmark, server_path, sessions):
+    """``sessions`` concurrent sessions running the scenario twice each."""
+    stats = benchmark.pedantic(lambda: asyncio.run(load_test(server_path, sessions, rounds=2)), rounds=3)
+    assert stats['requests'] == sessions * 2 * len(SCENARIO)
+    assert stats['p50'] <= stats['p95'] <= stats['p99'] <= stats['max'] <= stats['seconds']
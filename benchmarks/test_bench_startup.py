@@ -0,0 +1,58 @@
+"""Benchmarks: App construction with plugin loading, and REPL command dispatch"""
+import os
+import subprocess
+import sys
+import pytest
+from app import App
+from app.commands import Command, CommandHandler
+
+pytestmark = pytest.mark.benchmark
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+COLD_START = "from app import App; App().load_plugins()"
+
+
+class NoopCommand(Command):
+    def execute(self):
+        pass
+
+
+def start_app():
+    app = App()
+    app.load_plugins()
+    return app
+
+
+def start_app_process():
+    subprocess.run([sys.executable, '-c', COLD_START], cwd=ROOT_DIR, check=True,
+                   stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+
+def test_app_cold_startup(benchmark):
+    """A new interpreter importing the app, building App() and loading the plugins.
+
+    Every round is a fresh process, so nothing is cached in memory; the interpreter's own
+    startup is included, as it is for a user starting `python main.py`.
+    """
+    benchmark.pedantic(start_app_process, rounds=5)
+
+
+def test_app_warm_startup(benchmark):
+    """App() plus load_plugins in a process that already started once.
+
+    The plugin registry is built once per process, so this measures only what every App() repeats.
+    """
+    app = benchmark.pedantic(start_app, rounds=10)
+    assert 'menu' in app.command_handler.commands
+
+
+def test_command_dispatch(benchmark):
+    """1000 execute_command calls through the handler, so the per-call cost is median / 1000."""
+    handler = CommandHandler()
+    handler.register_command('noop', NoopCommand())
+
+    def dispatch():
+        for _ in range(1_000):
+            handler.execute_command('noop')
+
+    benchmark(dispatch)
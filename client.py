@@ -0,0 +1,75 @@
+# client.py
+"""Thin client for the REPL server started with `python main.py --serve ADDRESS`.
+
+Run `python client.py [ADDRESS]`; ADDRESS is `unix:PATH` or `tcp:HOST:PORT` (REPL_ADDRESS
+from the environment, or DEFAULT_ADDRESS). Only the standard library is imported, so the
+client is connected and showing the menu within milliseconds.
+
+The server sends one JSON object per line: {"output": text} to print, {"prompt": text}
+when it waits for an answer and {"close": true} when the session is over. Answers are sent
+back as {"input": text} lines.
+"""
+import json
+import os
+import socket
+import sys
+
+DEFAULT_ADDRESS = 'tcp:127.0.0.1:8765'
+
+
+def parse_address(text):
+    """'unix:PATH' -> PATH; 'tcp:HOST:PORT' or 'HOST:PORT' -> (HOST, PORT)."""
+    if text.startswith('unix:'):
+        return text[len('unix:'):]
+    if text.startswith('tcp:'):
+        text = text[len('tcp:'):]
+    host, separator, port = text.rpartition(':')
+    if not separator or not port.isdigit():
+        raise ValueError(f"Invalid address '{text}', expected unix:PATH or tcp:HOST:PORT")
+    return host or '127.0.0.1', int(port)
+
+
+def connect(address, timeout=None) -> socket.socket:
+    """A socket connected to ``address`` as returned by parse_address."""
+    if isinstance(address, str):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(timeout)
+        sock.connect(address)
+        return sock
+    return socket.create_connection(address, timeout=timeout)
+
+
+def run(sock, read_input=input, output=sys.stdout):
+    """Relays the session on ``sock`` to the terminal until the server or the user ends it."""
+    messages = sock.makefile('rb')
+    for line in messages:
+        message = json.loads(line)
+        if 'output' in message:
+            output.write(message['output'])
+            output.flush()
+        if 'prompt' in message:
+            try:
+                answer = read_input(message['prompt'])
+            except (EOFError, KeyboardInterrupt):
+                output.write("\n")
+                return
+            sock.sendall(json.dumps({'input': answer}).encode('utf-8') + b'\n')
+        if message.get('close'):
+            return
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    address = parse_address(argv[0] if argv else os.environ.get('REPL_ADDRESS', DEFAULT_ADDRESS))
+    try:
+        sock = connect(address)
+    except OSError as e:
+        print(f"Cannot connect to the REPL server at {address}: {e}", file=sys.stderr)
+        return 1
+    with sock:
+        run(sock)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,6 +1,47 @@
 # main.py
-from app import App    
+import argparse
+import sys
+from app import App
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description="Advanced Python calculator REPL.")
+    parser.add_argument('--batch', metavar='SCRIPT',
+                        help="run the commands in SCRIPT (plain or JSONL, '-' for stdin) without prompting")
+    parser.add_argument('--output', metavar='FILE', help="write batch results to FILE instead of stdout")
+    parser.add_argument('--results', choices=['text', 'jsonl'], default='text', help="batch results format")
+    parser.add_argument('--serve', metavar='ADDRESS',
+                        help="serve the REPL to many clients on unix:PATH or tcp:HOST:PORT (see client.py)")
+    return parser.parse_args()
+
+def run_batch(args):
+    script = sys.stdin if args.batch == '-' else open(args.batch, encoding='utf-8')
+    output = open(args.output, 'w', encoding='utf-8') if args.output else sys.stdout
+    try:
+        summary = App().run_batch(script, output=output, results_format=args.results)
+    finally:
+        if script is not sys.stdin:
+            script.close()
+        if output is not sys.stdout:
+            output.close()
+    return 0 if summary['failed'] == 0 else 1
+
+def run_server(args):
+    import asyncio  # pylint: disable=import-outside-toplevel
+    from client import parse_address  # pylint: disable=import-outside-toplevel
+    from app.server import ReplServer  # pylint: disable=import-outside-toplevel
+    address = parse_address(args.serve)
+    print(f"Serving the REPL on {args.serve}, press Ctrl+C to stop.")
+    try:
+        asyncio.run(ReplServer(App()).serve_forever(address))
+    except KeyboardInterrupt:
+        print("Server stopped.")
+    return 0
 
 # You must put this in your main.py because this forces the program to start when you run it from the command line.
 if __name__ == "__main__":
+    arguments = parse_arguments()
+    if arguments.batch:
+        sys.exit(run_batch(arguments))
+    if arguments.serve:
+        sys.exit(run_server(arguments))
     app = App().start()  # Instantiate an instance of App
@@ -0,0 +1,13 @@
+"""Shared pytest fixtures"""
+import pytest
+from app.commands import CommandHistoryManager, Singleton
+
+
+@pytest.fixture
+def history_manager(tmp_path):
+    """A fresh CommandHistoryManager writing to a temporary file instead of data/."""
+    Singleton._instances.pop(CommandHistoryManager, None)
+    manager = CommandHistoryManager(history_file=str(tmp_path / 'command_history.csv'), max_records=5)
+    yield manager
+    manager.log.close()
+    Singleton._instances.pop(CommandHistoryManager, None)
@@ -1,5 +1,12 @@
 """Test the app"""
+import io
+import json
+import os
+import sys
+import pytest
 from app import App
+from app.commands.plugin_cache import LazyCommand, PluginManifest
+from app.commands.plugin_registry import PluginRegistry
 
 def test_app_start_exit_command(capfd, monkeypatch):
     """Test that the REPL exits correctly on 'exit' command."""
@@ -44,3 +51,116 @@ def test_app_start_unknown_command(capfd, monkeypatch):
     # Verify that the unknown command was handled as expected
     captured = capfd.readouterr()
     assert "Invalid selection. Please enter a valid number." in captured.out or "Only numbers are allowed, wrong input." in captured.out
+
+def _write_plugin(root, name, message):
+    """Writes a one-command plugin package under root/fakeplugins"""
+    plugin_dir = root / "fakeplugins" / name
+    plugin_dir.mkdir(parents=True, exist_ok=True)
+    (plugin_dir / "__init__.py").write_text(
+        "from app.commands import Command\n\n"
+        f"class {name.capitalize()}Command(Command):\n"
+        "    def execute(self):\n"
+        f"        print({message!r})\n"
+    )
+
+def test_plugin_manifest_cache_and_invalidation(tmp_path, monkeypatch):
+    """The manifest is reused while plugin files are unchanged and dropped once one changes."""
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / "fakeplugins").mkdir()
+    (tmp_path / "fakeplugins" / "__init__.py").write_text("")
+    _write_plugin(tmp_path, "hello", "hi")
+    manifest = PluginManifest("fakeplugins", str(tmp_path / "manifest.json"))
+    assert manifest.load() is None
+
+    manifest.save({"hello": ["fakeplugins.hello", "HelloCommand"]})
+    assert manifest.load() == {"hello": ["fakeplugins.hello", "HelloCommand"]}
+
+    os.utime(tmp_path / "fakeplugins" / "hello" / "__init__.py", ns=(1, 1))  # Touched, same content
+    assert manifest.load() is not None
+
+    _write_plugin(tmp_path, "hello", "changed")
+    assert manifest.load() is None
+
+    manifest.save({"hello": ["fakeplugins.hello", "HelloCommand"]})
+    _write_plugin(tmp_path, "other", "new plugin")
+    assert manifest.load() is None
+
+def test_load_plugins_registers_lazy_commands(tmp_path, capfd, monkeypatch):
+    """Plugins come from the manifest as proxies and are only imported when executed."""
+    monkeypatch.setenv("PLUGIN_MANIFEST_PATH", str(tmp_path / "manifest.json"))
+    PluginRegistry.clear_cache()
+    app = App()
+    app.load_plugins()
+    assert (tmp_path / "manifest.json").exists()
+
+    PluginRegistry.clear_cache()  # Simulate a new process
+    cached_app = App()
+    monkeypatch.setattr(PluginRegistry, "_scan_module", lambda *_: pytest.fail("manifest should have been used"))
+    cached_app.load_plugins()
+    greet = cached_app.command_handler.commands["greet"]
+    assert isinstance(greet, LazyCommand) and not greet.is_loaded
+    cached_app.command_handler.execute_command("greet")
+    assert greet.is_loaded
+    assert "Hello, World!" in capfd.readouterr().out
+
+def test_plugin_discovery_imports_nothing(tmp_path, monkeypatch):
+    """Command classes are found in the plugin sources; the plugin and its imports stay unimported."""
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / "fakeplugins").mkdir()
+    (tmp_path / "fakeplugins" / "__init__.py").write_text("")
+    (tmp_path / "fakeplugins" / "base.py").write_text(
+        "from abc import abstractmethod\nfrom app.commands import Command\n\n"
+        "class Operation(Command):\n    @abstractmethod\n    def run(self):\n        pass\n\n"
+        "    def execute(self):\n        self.run()\n")
+    (tmp_path / "fakeplugins" / "heavy.py").write_text(
+        "import module_that_is_not_installed\nfrom . import base\n\n"
+        "class Helper:\n    pass\n\nclass HeavyCommand(base.Operation):\n    def run(self):\n        pass\n")
+    registry = PluginRegistry("fakeplugins").discover()
+    assert [entry.entry_point for entry in registry] == ["fakeplugins.heavy:HeavyCommand"]
+    assert "fakeplugins.heavy" not in sys.modules
+
+def test_plugin_registry_lookup_and_timings():
+    """The registry is shared per process and answers name and index lookups."""
+    PluginRegistry.clear_cache()
+    registry = PluginRegistry.for_package('app.plugins.calculator')
+    assert PluginRegistry.for_package('app.plugins.calculator') is registry
+    assert registry.names() == ['add', 'divide', 'multiply', 'subtract']
+    assert registry.by_index(1).name == 'divide'
+    assert registry.get('add').entry_point == 'app.plugins.calculator.add:Add'
+    assert registry.by_index(10) is None and registry.get('missing') is None
+    assert set(registry.load_times) == set(registry.names())
+    assert all(seconds >= 0 for seconds in registry.load_times.values())
+
+    registry.register('add', 'app.plugins.calculator.multiply:Multiply')  # Entry-point style override
+    assert registry.by_index(0).load().__name__ == 'Multiply'
+    PluginRegistry.clear_cache()
+
+def test_app_run_batch_jsonl(history_manager):
+    """Batch mode feeds scripted answers to the commands and reports one JSON result per command."""
+    script = [
+        'greet',
+        '# comments and blank lines are skipped',
+        '',
+        '{"command": "calculator", "inputs": ["3", "6", "7", "0"]}',
+        'unknown',
+        'calculator 1 2',  # Runs out of scripted input
+        'exit',
+        'greet',  # Never reached
+    ]
+    output = io.StringIO()
+    summary = App().run_batch(script, output=output, results_format='jsonl')
+
+    results = [json.loads(line) for line in output.getvalue().splitlines()]
+    assert [result['status'] for result in results] == ['ok', 'ok', 'error', 'error', 'exit']
+    assert results[0]['output'] == "Hello, World!\n"
+    assert "The result is 42.0" in results[1]['output']
+    assert "Available commands" not in output.getvalue()  # The main menu is never printed
+    assert summary['executed'] == 2 and summary['failed'] == 3
+    assert history_manager.get_history() == ['greet', 'calculator']
+
+def test_app_run_batch_text_output(capfd):
+    """In text mode the commands' output is streamed straight through."""
+    output = io.StringIO()
+    App().run_batch(['greet', 'goodbye'], output=output)
+    assert output.getvalue() == "Hello, World!\nGoodbye\n"
+    assert capfd.readouterr().out == ""
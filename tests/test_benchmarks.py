@@ -0,0 +1,23 @@
+"""Test the baseline and regression logic behind the benchmark suite"""
+from benchmarks.harness import (BenchmarkResult, find_missing_baselines, find_regressions, load_baselines, run_rounds,
+                                save_baselines)
+
+
+def test_run_rounds_counts_only_timed_rounds():
+    """Warmup rounds run the function but are not timed."""
+    calls = []
+    value, timings = run_rounds(calls.append, args=(1,), rounds=3, warmup_rounds=2)
+    assert value is None and len(timings) == 3 and len(calls) == 5
+
+
+def test_regressions_flagged_against_saved_baseline(tmp_path):
+    """Only medians slower than the baseline by more than the threshold are flagged."""
+    path = str(tmp_path / 'baselines.json')
+    save_baselines([BenchmarkResult('dispatch', [1.0, 1.0, 1.0]), BenchmarkResult('load', [2.0])], path)
+    baselines = load_baselines(path)
+    assert baselines['dispatch']['median'] == 1.0 and baselines['load']['rounds'] == 1
+
+    results = [BenchmarkResult('dispatch', [1.2, 1.2]), BenchmarkResult('load', [3.0]), BenchmarkResult('new', [9.0])]
+    assert find_regressions(results, baselines, threshold=0.25) == [('load', 2.0, 3.0)]
+    assert find_missing_baselines(results, baselines) == ['new']
+    assert find_missing_baselines(results, load_baselines(str(tmp_path / 'missing.json'))) == ['dispatch', 'load', 'new']
@@ -1,13 +1,25 @@
 """Test all the commands of the app"""
+import array
+import asyncio
 import logging
 import sys
+import time
 from unittest.mock import MagicMock, patch
+import numpy as np
 import pandas as pd
 import pytest
 from app import App
 
 from app.commands import Command, CommandHandler, CommandHistoryManager
+from app.commands.dispatcher import AsyncCommandDispatcher
+from app.commands.session import CommandSession, session_io, using_session
+from app.commands.result_cache import ResultCache
+from app.plugins.cache import CacheCommand
 from app.plugins.calculator import CalculatorCommand
+from app.plugins.calculator.add import Add
+from app.plugins.calculator.divide import Divide
+from app.plugins.calculator.expression import ExpressionError
+from app.plugins.calculator.multiply import Multiply
 from app.plugins.csv import CsvCommand
 from app.plugins.history import HistoryCommand
 from app.plugins.menu import MenuCommand
@@ -15,7 +27,7 @@ from app.plugins.openai import OpenAICommand
 
 def test_app_greet_command(capfd, monkeypatch, caplog):
     """Test that the REPL correctly handles the 'greet' command and its logging."""
-    inputs = iter(['5', 'exit'])
+    inputs = iter(['6', 'exit'])
     monkeypatch.setattr('builtins.input', lambda _: next(inputs))
 
     with caplog.at_level(logging.INFO):
@@ -32,7 +44,7 @@ def test_app_greet_command(capfd, monkeypatch, caplog):
 
 def test_app_menu_command(capfd, monkeypatch, caplog):
     """Test that the REPL correctly handles the 'menu' command and its logging."""
-    inputs = iter(['8','0','exit'])
+    inputs = iter(['10','0','exit'])
     monkeypatch.setattr('builtins.input', lambda _: next(inputs))
 
     with caplog.at_level(logging.INFO):
@@ -238,7 +250,7 @@ def test_csv_command(capfd, tmpdir, caplog):
 
 def test_app_divide_command_success(capfd, monkeypatch, caplog):
     """Test successful division."""
-    inputs = iter(['1', '2', '2', '2', '0', 'exit'])  # Simulate user inputs for the numbers and exiting
+    inputs = iter(['2', '2', '2', '2', '0', 'exit'])  # Simulate user inputs for the numbers and exiting
     monkeypatch.setattr('builtins.input', lambda _: next(inputs))
 
     with caplog.at_level(logging.INFO):
@@ -257,7 +269,7 @@ def test_app_divide_command_zero_division(capfd, monkeypatch, caplog):
     """Test division by zero scenario."""
     # Ensure the sequence of inputs matches the expected application flow.
     # The addition of 'exit' at the end ensures the application loop can terminate gracefully.
-    inputs = iter(['1', '2', '10', '0', '0', 'exit'])
+    inputs = iter(['2', '2', '10', '0', '0', 'exit'])
     monkeypatch.setattr('builtins.input', lambda _: next(inputs))
 
     with caplog.at_level(logging.WARNING):
@@ -270,7 +282,7 @@ def test_app_divide_command_zero_division(capfd, monkeypatch, caplog):
 def test_app_multiply_command(capfd, monkeypatch, caplog):
     """Test that the REPL correctly handles the 'multiply' command and its logging."""
     # Assuming '3' selects the Multiply command in your command list, followed by the numbers to multiply
-    inputs = iter(['1', '3', '5', '4', '0', 'exit'])  # Adjust '3' if the position of Multiply command differs
+    inputs = iter(['2', '3', '5', '4', '0', 'exit'])  # Adjust '3' if the position of Multiply command differs
     monkeypatch.setattr('builtins.input', lambda _: next(inputs))
 
     with caplog.at_level(logging.INFO):
@@ -288,7 +300,7 @@ def test_app_multiply_command(capfd, monkeypatch, caplog):
 def test_app_subtract_command(capfd, monkeypatch, caplog):
     """Test that the REPL correctly handles the 'subtract' command and its logging."""
     # Assuming '4' selects the Subtract command in your command list, followed by the numbers to subtract
-    inputs = iter(['1', '4', '10', '3', '0', 'exit'])  # Adjust '4' if the position of Subtract command differs
+    inputs = iter(['2', '4', '10', '3', '0', 'exit'])  # Adjust '4' if the position of Subtract command differs
     monkeypatch.setattr('builtins.input', lambda _: next(inputs))
 
     with caplog.at_level(logging.INFO):
@@ -306,7 +318,7 @@ def test_app_subtract_command(capfd, monkeypatch, caplog):
 def test_app_goodbye_command(capfd, monkeypatch, caplog):
     """Test that the REPL correctly handles the 'goodbye' command and its logging."""
     # Assuming '5' selects the GoodbyeCommand in your command list, followed by an 'exit' command
-    inputs = iter(['4', '0', 'exit'])  # Adjust '5' if the position of GoodbyeCommand differs
+    inputs = iter(['5', '0', 'exit'])  # Adjust '5' if the position of GoodbyeCommand differs
     monkeypatch.setattr('builtins.input', lambda _: next(inputs))
 
     with caplog.at_level(logging.INFO):
@@ -332,13 +344,13 @@ def mock_command_history_manager():
 def test_app_history_command_operations(mock_command_history_manager, capfd, caplog):
     """Test history command in REPL"""
     # Setup the input values for the test to simulate user selecting 'Load History' and then 'Back'
-    with patch('builtins.input', side_effect=['6', '1', '0']):
+    with patch('builtins.input', side_effect=['9', '1', '0']):
         history_command = HistoryCommand()
         history_command.execute()
 
     # Capture and assert the expected output for loading the history
     captured = capfd.readouterr()
-    expected_output_lines = ["Command History Operations:", "1. Load History", "2. Save History", "3. Clear History", "4. Delete History Record"]
+    expected_output_lines = ["Command History Operations:", "1. Load History", "2. Save History", "3. Clear History", "4. Delete History Record", "7. Top Commands"]
     for expected_line in expected_output_lines:
         assert expected_line in captured.out
 
@@ -352,10 +364,23 @@ def test_app_history_command_operations(mock_command_history_manager, capfd, cap
     captured = capfd.readouterr()
     assert "History cleared successfully." in captured.out
 
+def test_history_command_count_and_top(history_manager, capfd):
+    """The query operations of HistoryCommand count runs and rank commands."""
+    for name in ['greet', 'calculator', 'greet']:
+        history_manager.add_command(name)
+    with patch('builtins.input', side_effect=['6', 'greet', '', '', '7', '', '8', 'greet', '', '', '0']):
+        HistoryCommand().execute()
+    out = capfd.readouterr().out
+    assert "Searching the latest 5 records" in out
+    assert "greet ran 2 times." in out
+    assert "1. greet: 2" in out and "2. calculator: 1" in out
+    assert "Deleted 2 records." in out
+    assert history_manager.get_history() == ['calculator']
+
 def test_app_chat_command(capfd, monkeypatch, caplog):
     """Test that the REPL correctly handles the 'chat' command and its logging."""
     # Assuming '2' selects the Chat command in your command list
-    inputs = iter(['7', '1', '0', 'exit'])  # Adjust '2' if the position of Chat command differs
+    inputs = iter(['8', '1', '0', 'exit'])  # Adjust '2' if the position of Chat command differs
     monkeypatch.setattr('builtins.input', lambda _: next(inputs))
 
     with caplog.at_level(logging.INFO):
@@ -368,3 +393,387 @@ def test_app_chat_command(capfd, monkeypatch, caplog):
 
         # Now, check the log messages for the execution of the Chat command
         assert "Chat command executed: Engaging with AI." in caplog.text
+
+def test_calculator_batch_evaluate():
+    """Batch evaluation works on NumPy arrays and buffer-protocol objects alike."""
+    result = Add().evaluate(np.array([1.0, 2.0, 3.0]), array.array('d', [4.0, 5.0, 6.0]))
+    assert result.values.tolist() == [5.0, 7.0, 9.0]
+    assert result.rejected == 0
+    assert Multiply().evaluate(memoryview(array.array('d', [2.0, 3.0])), [4.0, 5.0]).values.tolist() == [8.0, 15.0]
+
+def test_calculator_batch_divide_by_zero():
+    """Zero divisors are rejected row by row, as NaN or masked, and counted."""
+    result = Divide().evaluate(np.array([1.0, 4.0, 9.0]), np.array([0.0, 2.0, 0.0]))
+    assert result.rejected == 2
+    assert np.isnan(result.values[0]) and np.isnan(result.values[2])
+    assert result.values[1] == 2.0
+
+    masked = Divide().evaluate([1.0, 4.0], [0.0, 2.0], masked=True)
+    assert masked.values.mask.tolist() == [True, False]
+    assert masked.rejected == 1
+
+    scalar = Divide().evaluate(np.array([1.0, 4.0, 9.0]), 0.0, masked=True)  # One divisor for every row
+    assert scalar.rejected == 3 and scalar.values.mask.tolist() == [True, True, True]
+
+def test_calculator_batch_from_file(capfd, monkeypatch, tmp_path):
+    """The calculator sends a whole file of operand pairs through the selected operation."""
+    operands_file = tmp_path / "operands.csv"
+    operands_file.write_text("10,2\n9,0\n1,4\n")
+    inputs = iter(['b', '2', str(operands_file), '0'])  # '2' selects Divide
+    monkeypatch.setattr('builtins.input', lambda _: next(inputs))
+
+    CalculatorCommand().execute()
+
+    captured = capfd.readouterr()
+    assert "Processed 3 rows, 1 rejected." in captured.out
+    results = pd.read_csv(tmp_path / "operands_results.csv")
+    assert results['result'].tolist()[0] == 5.0
+    assert results['result'].isna().tolist() == [False, True, False]
+
+def _csv_command_for(tmp_path, **kwargs):
+    """Builds a CsvCommand that reads and writes inside tmp_path"""
+    csv_command = CsvCommand(**kwargs)
+    csv_command._CsvCommand__data_dir = str(tmp_path)
+    csv_command._CsvCommand__input_file_path = str(tmp_path / "gpt_states.csv")
+    csv_command._CsvCommand__output_file_path = str(tmp_path / "sorted_states.csv")
+    return csv_command
+
+def test_csv_external_sort_matches_in_memory(tmp_path):
+    """The streaming external sort writes exactly the same bytes as the in-memory path."""
+    rng = np.random.default_rng(7)
+    rows = 2_000
+    population = rng.integers(0, 50, rows).astype(float)  # Lots of ties
+    population[rng.integers(0, rows, 20)] = np.nan  # Missing values appear in some chunks only
+    pd.DataFrame({
+        "State Abbreviation": [f"S{i}" for i in range(rows)],
+        "State Name": [f'Name "{i}"\nline' if i % 97 == 0 else f"Name, {i}" for i in range(rows)],
+        "Population": population,
+        "Capital": ["x"] * rows,
+    }).to_csv(tmp_path / "gpt_states.csv", index=False)
+
+    in_memory = _csv_command_for(tmp_path).read_sort_and_reduce()
+    in_memory.to_csv(tmp_path / "expected.csv", index=False)
+    _csv_command_for(tmp_path, streaming=True, chunk_rows=150).external_sort()
+
+    assert (tmp_path / "sorted_states.csv").read_bytes() == (tmp_path / "expected.csv").read_bytes()
+
+def test_csv_command_streaming_execute(capfd, tmp_path):
+    """execute() goes through the external sort when streaming is enabled."""
+    pd.DataFrame({
+        "State Abbreviation": ["CA", "OR", "TX"],
+        "State Name": ["California", "Oregon", "Texas"],
+        "Population": [39538223, 4237256, 29145505],
+    }).to_csv(tmp_path / "gpt_states.csv", index=False)
+
+    _csv_command_for(tmp_path, streaming=True, chunk_rows=1).execute()
+
+    assert pd.read_csv(tmp_path / "sorted_states.csv")["State Abbreviation"].tolist() == ["OR", "TX", "CA"]
+    assert "Processed data saved to" in capfd.readouterr().out
+
+def test_csv_command_preview_mode(capfd, caplog, tmp_path):
+    """Preview mode prints only the first records followed by the totals, in one log entry."""
+    pd.DataFrame({
+        "State Abbreviation": ["CA", "OR", "TX"],
+        "State Name": ["California", "Oregon", "Texas"],
+        "Population": [300, 100, 200],
+    }).to_csv(tmp_path / "gpt_states.csv", index=False)
+
+    with caplog.at_level(logging.INFO):
+        _csv_command_for(tmp_path, preview_rows=1).execute()
+
+    captured = capfd.readouterr()
+    assert "Record 0: OR: Oregon\n    State Abbreviation: OR\n    State Name: Oregon\n    Population: 100" in captured.out
+    assert "TX: Texas" not in captured.out
+    assert "... showing 1 of 3 records" in captured.out
+    assert "Total Population: 600" in captured.out
+    assert len([record for record in caplog.records if "Record 0" in record.getMessage()]) == 1
+
+def test_command_handler_index_registry(capfd):
+    """Index lookups and the cached menu follow registrations and unregistrations."""
+    handler = CommandHandler()
+    for name in ['greet', 'csv', 'exit']:
+        handler.register_command(name, MockCommand())
+    handler.register_command('csv', MockCommand())  # Re-registering keeps the position
+    assert handler.get_command_by_index(1) == 'csv'
+    assert handler.get_index_of_command('exit') == 2
+    assert handler.render_menu() == "1. greet\n2. csv\n3. exit"
+    assert handler.render_menu() is handler.render_menu()  # Cached until registrations change
+
+    assert handler.unregister_command('greet')
+    assert not handler.unregister_command('greet')
+    assert handler.get_command_by_index(0) == 'csv'
+    assert handler.get_index_of_command('exit') == 1
+    assert handler.get_command_by_index(2) is None and handler.get_command_by_index(-1) is None
+    assert handler.render_menu(capitalize=True) == "1. Csv\n2. Exit"
+
+    handler.list_commands()
+    assert capfd.readouterr().out == "1. csv\n2. exit\n"
+
+class SlowAsyncCommand(Command):
+    """Stands in for a remote call: awaits instead of blocking"""
+    async def execute(self):  # pylint: disable=invalid-overridden-method
+        await asyncio.sleep(0.2)
+        print(f"async done {input('Name: ')}")
+
+class SlowSyncCommand(Command):
+    """A legacy blocking command"""
+    def execute(self):
+        time.sleep(0.2)
+        print(f"sync done {input('Name: ')}")
+
+def test_async_dispatcher_runs_commands_concurrently():
+    """Async and legacy commands overlap, each with its own scripted input and output."""
+    handler = CommandHandler()
+    handler.register_command('remote', SlowAsyncCommand())
+    handler.register_command('blocking', SlowSyncCommand())
+
+    async def run():
+        async with AsyncCommandDispatcher(handler, max_concurrency=4) as dispatcher:
+            requests = [('remote', [f'r{i}']) for i in range(4)] + [('blocking', [f'b{i}']) for i in range(4)]
+            start = time.perf_counter()
+            results = await dispatcher.run_many(requests + [('missing', [])])
+            return results, time.perf_counter() - start, dispatcher.stats()
+
+    results, elapsed, stats = asyncio.run(run())
+    assert [result.output for result in results[:8]] == [f"async done r{i}\n" for i in range(4)] + \
+        [f"sync done b{i}\n" for i in range(4)]
+    assert results[8].status == 'error'
+    assert elapsed < 0.2 * 8 / 2  # Bounded to 4 at a time, so roughly two rounds instead of eight
+    assert stats['max_queue_depth'] >= 4 and stats['queue_depth'] == 0
+    assert stats['commands']['remote']['calls'] == 4
+    assert stats['commands']['blocking']['mean'] >= 0.2
+
+def test_async_dispatcher_restarts_after_close():
+    """A closed dispatcher starts a new thread pool, on a new event loop as well."""
+    handler = CommandHandler()
+    handler.register_command('blocking', SlowSyncCommand())
+    dispatcher = AsyncCommandDispatcher(handler, max_concurrency=2)
+
+    async def run(name):
+        async with dispatcher:
+            return await dispatcher.submit('blocking', [name])
+
+    assert asyncio.run(run('first')).output == "sync done first\n"
+    assert asyncio.run(run('second')).output == "sync done second\n"
+
+def test_execute_command_runs_async_commands(capfd, monkeypatch):
+    """The synchronous REPL path still runs commands that define async execute()."""
+    monkeypatch.setattr('builtins.input', lambda _: 'repl')
+    handler = CommandHandler()
+    handler.register_command('remote', SlowAsyncCommand())
+    handler.execute_command('remote')
+    assert "async done repl" in capfd.readouterr().out
+
+def test_result_cache_lru_and_lfu_eviction():
+    """LRU drops the least recently used entry, LFU the least frequently used one."""
+    lru = ResultCache(max_size=2, policy='lru')
+    lru.put('a', 1)
+    lru.put('b', 2)
+    lru.get('a')
+    lru.put('c', 3)
+    assert 'a' in lru and 'b' not in lru
+
+    lfu = ResultCache(max_size=2, policy='lfu')
+    lfu.put('a', 1)
+    lfu.put('b', 2)
+    lfu.get('a')
+    lfu.get('a')
+    lfu.get('b')
+    lfu.put('c', 3)  # 'b' was used less often than 'a'
+    assert 'a' in lfu and 'b' not in lfu and 'c' in lfu
+    assert lfu.stats()['evictions'] == 1 and lfu.stats()['hits'] == 3
+
+def test_calculator_cache_is_bit_identical(monkeypatch, tmp_path):
+    """Cached results are the exact same floats, signed zeros included, and survive a restart."""
+    cache = ResultCache(max_size=16, persist_path=str(tmp_path / "calculator_cache.json"))
+    monkeypatch.setattr('app.plugins.calculator._result_cache', cache)
+    add = Add()
+    assert add.calculate(0.1, 0.2) == 0.1 + 0.2
+    assert add.calculate(0.1, 0.2) == 0.1 + 0.2
+    assert str(add.calculate(-0.0, -0.0)) == "-0.0"
+    assert str(add.calculate(0.0, -0.0)) == "0.0"
+    assert cache.stats()['hits'] == 1 and cache.stats()['misses'] == 3
+
+    cache.save()
+    restored = ResultCache(max_size=16, persist_path=cache.persist_path)
+    monkeypatch.setattr('app.plugins.calculator._result_cache', restored)
+    assert Multiply().calculate(3.0, 1 / 3) == 3.0 * (1 / 3)
+    assert add.calculate(0.1, 0.2) == 0.1 + 0.2
+    assert restored.stats()['hits'] == 1
+
+def test_cache_command_statistics(capfd, monkeypatch):
+    """The cache REPL command reports the counters and can clear the cache."""
+    cache = ResultCache(max_size=4)
+    monkeypatch.setattr('app.plugins.calculator._result_cache', cache)
+    Divide().calculate(1.0, 4.0)
+    Divide().calculate(1.0, 4.0)
+    inputs = iter(['1', '2', '1', '0'])
+    monkeypatch.setattr('builtins.input', lambda _: next(inputs))
+    CacheCommand().execute()
+
+    out = capfd.readouterr().out
+    assert "Entries: 1/4 (LRU)" in out
+    assert "Hits: 1, Misses: 1, Evictions: 0" in out
+    assert "Cache cleared successfully." in out
+    assert "Entries: 0/4 (LRU)" in out
+
+@pytest.mark.parametrize("workers, streaming", [(2, True), (1, None)])
+def test_csv_shards_merge_like_one_file(tmp_path, workers, streaming):
+    """Shards sorted on a process pool, or in memory, give the same bytes as sorting the concatenated data."""
+    rng = np.random.default_rng(3)
+    shards_dir = tmp_path / "shards"
+    shards_dir.mkdir()
+    frames = []
+    for shard in range(4):
+        rows = 300
+        population = rng.integers(0, 40, rows).astype(float if shard == 2 else int)  # One shard infers floats
+        frame = pd.DataFrame({
+            "Region": [f"R{shard}"] * rows,
+            "State Abbreviation": [f"S{shard}-{i}" for i in range(rows)],
+            "Population": population,
+        })
+        frame.to_csv(shards_dir / f"part-{shard:02d}.csv", index=False)
+        frames.append(frame)
+    pd.concat(frames, ignore_index=True).to_csv(tmp_path / "all.csv", index=False)
+    expected = pd.read_csv(tmp_path / "all.csv").sort_values(by="Population", kind="stable")
+    expected[["Region", "State Abbreviation", "Population"]].to_csv(tmp_path / "expected.csv", index=False)
+
+    csv_command = CsvCommand(input_path=str(shards_dir / "part-*.csv"), sort_by="Population",
+                             columns=["Region", "State Abbreviation", "Population"], workers=workers,
+                             streaming=streaming)
+    assert len(csv_command.input_files()) == 4
+    assert csv_command.shards_fit_in_memory(csv_command.input_files()) == (streaming is None)
+    csv_command.process_shards(output_file_path=str(tmp_path / "sorted.csv"))
+
+    assert (tmp_path / "sorted.csv").read_bytes() == (tmp_path / "expected.csv").read_bytes()
+
+def test_csv_shards_text_keys_over_many_ranges(tmp_path, monkeypatch):
+    """Text keys, missing keys and quoted line breaks survive a merge split into many key ranges."""
+    monkeypatch.setattr("app.plugins.csv.MERGE_RANGE_BYTES", 256)
+    monkeypatch.setattr("app.plugins.csv.SHARD_SAMPLE_ROWS", 8)
+    rng = np.random.default_rng(5)
+    frames = []
+    for shard in range(3):
+        names = [f"N{value}" for value in rng.integers(0, 50, 120)]
+        names[::17] = [None] * len(names[::17])
+        frame = pd.DataFrame({"State Name": names,
+                              "Note": [f"line {i}\nof {shard}" if i % 9 == 0 else f"x{i}" for i in range(120)]})
+        frame.to_csv(tmp_path / f"part-{shard}.csv", index=False)
+        frames.append(frame)
+    pd.concat(frames, ignore_index=True).to_csv(tmp_path / "all.csv", index=False)
+    expected = pd.read_csv(tmp_path / "all.csv").sort_values(by="State Name", kind="stable")
+    expected.to_csv(tmp_path / "expected.csv", index=False)
+
+    csv_command = CsvCommand(sort_by="State Name", columns=["State Name", "Note"], workers=1, streaming=True)
+    csv_command.process_shards([str(tmp_path / f"part-{shard}.csv") for shard in range(3)], str(tmp_path / "out.csv"))
+
+    assert (tmp_path / "out.csv").read_bytes() == (tmp_path / "expected.csv").read_bytes()
+
+def test_csv_command_directory_input_execute(capfd, tmp_path, monkeypatch):
+    """A directory of shards is processed by execute(), with the key and columns taken from the environment."""
+    monkeypatch.setenv("CSV_SORT_BY", "Population")
+    monkeypatch.setenv("CSV_COLUMNS", "State Name,Population")
+    for shard, rows in enumerate([[("Texas", 300), ("Oregon", 100)], [("Ohio", 200)]]):
+        pd.DataFrame(rows, columns=["State Name", "Population"]).to_csv(tmp_path / f"{shard}.csv", index=False)
+    csv_command = _csv_command_for(tmp_path, workers=1)
+    csv_command._CsvCommand__input_file_path = str(tmp_path)
+    csv_command._CsvCommand__output_file_path = str(tmp_path / "out" / "sorted_states.csv")
+    (tmp_path / "out").mkdir()
+    csv_command.execute()
+
+    assert pd.read_csv(tmp_path / "out" / "sorted_states.csv")["State Name"].tolist() == ["Oregon", "Ohio", "Texas"]
+    assert "... showing 3 of 3 records" in capfd.readouterr().out
+
+def test_csv_incremental_skips_and_merges_appends(capfd, tmp_path):
+    """Unchanged input is skipped, appended rows are merged into exactly what a full rebuild writes."""
+    rng = np.random.default_rng(11)
+    def rows(start, count):
+        return pd.DataFrame({
+            "State Abbreviation": [f"S{i}" for i in range(start, start + count)],
+            "State Name": [f"Name, {i}" for i in range(start, start + count)],
+            "Population": rng.integers(0, 30, count),  # Ties between old and new rows
+        })
+    rows(0, 200).to_csv(tmp_path / "gpt_states.csv", index=False)
+
+    _csv_command_for(tmp_path, incremental=True).execute()
+    assert (tmp_path / "sorted_states.manifest.json").exists()
+    _csv_command_for(tmp_path, incremental=True).execute()
+    assert "is up to date, nothing to process" in capfd.readouterr().out
+
+    rows(200, 50).to_csv(tmp_path / "gpt_states.csv", mode="a", header=False, index=False)
+    csv_command = _csv_command_for(tmp_path, incremental=True)
+    with patch.object(CsvCommand, "read_sort_and_reduce", side_effect=AssertionError("full re-sort")):
+        csv_command.execute()
+    assert "Merged 50 appended rows" in capfd.readouterr().out
+
+    _csv_command_for(tmp_path).read_sort_and_reduce().to_csv(tmp_path / "expected.csv", index=False)
+    assert (tmp_path / "sorted_states.csv").read_bytes() == (tmp_path / "expected.csv").read_bytes()
+
+def test_csv_incremental_rebuilds_edited_input(capfd, tmp_path):
+    """An edit that is not a pure append triggers a full rebuild."""
+    frame = pd.DataFrame({"State Abbreviation": ["CA", "OR"], "State Name": ["California", "Oregon"],
+                          "Population": [300, 100]})
+    frame.to_csv(tmp_path / "gpt_states.csv", index=False)
+    _csv_command_for(tmp_path, incremental=True).execute()
+
+    frame.assign(Population=[100, 3000]).to_csv(tmp_path / "gpt_states.csv", index=False)
+    _csv_command_for(tmp_path, incremental=True).execute()
+
+    assert pd.read_csv(tmp_path / "sorted_states.csv")["State Abbreviation"].tolist() == ["CA", "OR"]
+    assert capfd.readouterr().out.count("Processed data saved to") == 2
+
+def test_expression_evaluator_scalars_and_arrays():
+    """Expressions compile once, run through the operator plugins and vectorize over arrays."""
+    evaluator = CalculatorCommand().expressions
+    compiled = evaluator.compile("a*b + c/d")
+    assert evaluator.compile(" a*b + c/d ") is compiled and compiled.variables == ['a', 'b', 'c', 'd']
+    assert compiled.evaluate(a=2, b=3, c=1, d=4) == (6.25, 0)
+    assert evaluator.evaluate("-(2 - 5) * 2").values == 6.0
+
+    rng = np.random.default_rng(5)
+    a, b, c, d = (rng.random(1_000) for _ in range(4))
+    d[[3, 500]] = 0.0
+    result = compiled.evaluate(a=a, b=b, c=c, d=d)
+    expected = a * b + Divide().evaluate(c, d).values  # Same NaN rows as the Divide plugin's batch mode
+    assert np.array_equal(result.values, expected, equal_nan=True)
+    assert result.rejected == 2
+
+    scalar = evaluator.evaluate("x / (y - 1)", x=1.0, y=1.0)
+    assert np.isnan(scalar.values) and scalar.rejected == 1
+    assert evaluator.evaluate("a / 0", a=a).rejected == 1_000  # A constant zero divisor rejects every row
+
+def test_expression_evaluator_refuses_non_arithmetic():
+    """Only numbers, names and + - * / are accepted; nothing is ever executed."""
+    evaluator = CalculatorCommand().expressions
+    for text in ['__import__("os").system("true")', 'a ** 2', 'a.real', 'True + 1', '', 'x' * 2_000, '(1']:
+        with pytest.raises(ExpressionError):
+            evaluator.compile(text)
+    with pytest.raises(ExpressionError):
+        evaluator.evaluate("a + b", a=1.0)
+
+def test_calculator_expression_menu(capfd, monkeypatch):
+    """The 'e' entry prompts for the expression and each of its variables."""
+    inputs = iter(['e', 'a*b + c/d', '2', '3', '1', '4', 'e', '1 / (a - a)', '5', 'e', 'a +', '0'])
+    monkeypatch.setattr('builtins.input', lambda _: next(inputs))
+    CalculatorCommand().execute()
+
+    out = capfd.readouterr().out
+    assert "e. Evaluate expression" in out
+    assert "The result is 6.25" in out
+    assert "Cannot divide by zero." in out
+    assert "Invalid expression:" in out
+
+
+def test_session_io_restores_only_its_own_patches(monkeypatch):
+    """Scripted input only applies inside a session, and streams swapped in meanwhile are kept."""
+    monkeypatch.setattr('builtins.input', lambda prompt: 'typed')
+    original_stdout = sys.stdout
+    with session_io():
+        with using_session(CommandSession(['scripted'])):
+            assert input('? ') == 'scripted'
+        assert input('? ') == 'typed'
+    assert sys.stdout is original_stdout and input('? ') == 'typed'
+    replacement = MagicMock()
+    with session_io():
+        monkeypatch.setattr(sys, 'stdout', replacement)
+    assert sys.stdout is replacement
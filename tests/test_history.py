@@ -0,0 +1,317 @@
+"""Test the command history storage"""
+import multiprocessing
+import os
+import sqlite3
+import time
+from unittest.mock import patch
+import pandas as pd
+import pytest
+from app.commands import CommandHistoryManager, Singleton
+from app.commands.history_buffer import HistoryRingBuffer
+from app.commands.history_store import AppendOnlyHistoryLog, ColumnarHistoryLog, SharedHistoryLog, SqliteHistoryLog
+from app.plugins.history import HistoryCommand
+from app.commands.history_store import main as history_store_main
+
+
+def test_add_command_appends_single_lines(history_manager):
+    """add_command should append to the file rather than rewrite it."""
+    history_manager.add_command('greet')
+    history_manager.add_command('calculator')
+    with open(history_manager.history_file, encoding='utf-8') as handle:
+        lines = handle.read().splitlines()
+    assert lines[0] == 'Timestamp,Command'
+    assert [line.split(',')[1] for line in lines[1:]] == ['greet', 'calculator']
+    assert history_manager.get_history() == ['greet', 'calculator']
+
+
+def test_history_keeps_max_records(history_manager):
+    """Only the latest MAX records are kept in memory and returned by load_history."""
+    for index in range(8):
+        history_manager.add_command(f'command{index}')
+    assert history_manager.get_history() == [f'command{index}' for index in range(3, 8)]
+    loaded = history_manager.load_history()
+    assert isinstance(loaded, pd.DataFrame)
+    assert loaded['Command'].tolist() == [f'command{index}' for index in range(3, 8)]
+
+
+def test_delete_and_clear_history(history_manager):
+    """Deleting and clearing rewrite the log with the remaining records."""
+    for name in ['greet', 'csv', 'exit']:
+        history_manager.add_command(name)
+    history_manager.delete_record(1)
+    assert history_manager.load_history()['Command'].tolist() == ['greet', 'exit']
+    history_manager.clear_history()
+    assert history_manager.get_history() == []
+    assert history_manager.load_history().empty
+
+
+def test_log_compaction_keeps_latest_records(tmp_path):
+    """Compaction trims the file to the latest records without losing later appends."""
+    log = AppendOnlyHistoryLog(str(tmp_path / 'history.csv'), max_records=3, compact_threshold=6)
+    for index in range(7):
+        log.append('2024-03-20 16:05:50', f'command{index}')
+    log.wait_for_compaction()
+    log.append('2024-03-20 16:05:51', 'latest')
+    log.close()
+    records = AppendOnlyHistoryLog(log.path, max_records=100).read_tail()
+    assert [command for _, command in records] == ['command4', 'command5', 'command6', 'latest']
+
+
+def test_columnar_backend_round_trip(tmp_path):
+    """The columnar backend stores epoch seconds and dictionary codes and survives reopening."""
+    Singleton._instances.pop(CommandHistoryManager, None)
+    manager = CommandHistoryManager(history_file=str(tmp_path / 'history'), max_records=3, backend='columnar')
+    for name in ['greet', 'csv', 'greet', 'exit']:
+        manager.add_command(name)
+    manager.log.close()
+    Singleton._instances.pop(CommandHistoryManager, None)
+    assert os.path.getsize(tmp_path / 'history' / 'timestamps.i8') == 4 * 8
+    assert os.path.getsize(tmp_path / 'history' / 'commands.u4') == 4 * 4
+
+    log = ColumnarHistoryLog(str(tmp_path / 'history'), max_records=3)
+    assert [command for _, command in log.read_tail()] == ['csv', 'greet', 'exit']
+    frame = log.load_frame()
+    assert frame['Command'].dtype == 'category'
+    assert frame['Command'].tolist() == ['csv', 'greet', 'exit']
+    assert [record[0] for record in log.read_tail()] == frame['Timestamp'].tolist()
+
+
+def test_columnar_backend_repairs_partial_append(tmp_path):
+    """A half-written row at the end of a column is dropped when the log is opened."""
+    log = ColumnarHistoryLog(str(tmp_path / 'history'), max_records=10)
+    log.append('2024-03-20 16:05:50', 'greet')
+    log.close()
+    with open(tmp_path / 'history' / 'timestamps.i8', 'ab') as handle:
+        handle.write(b'\x01\x02\x03')
+    assert ColumnarHistoryLog(log.path, max_records=10).read_tail() == [('2024-03-20 16:05:50', 'greet')]
+
+
+def test_columnar_rewrite_commits_both_or_neither(tmp_path, monkeypatch):
+    """A crash before the marker keeps the previous rewrite; later files of that rewrite are removed."""
+    log = ColumnarHistoryLog(str(tmp_path / 'history'), max_records=10)
+    log.rewrite([('2024-03-20 16:05:50', 'greet'), ('2024-03-20 16:05:51', 'csv')])
+    committed = log.read_tail()
+
+    replace = os.replace
+
+    def crash_before_marker(source, target):
+        if target.endswith('columns.json'):
+            raise OSError("power cut")  # Both columns are written, the marker is not
+        replace(source, target)
+    with patch('os.replace', crash_before_marker), pytest.raises(OSError):
+        log.rewrite([('2024-03-20 16:05:52', 'exit')])
+    reopened = ColumnarHistoryLog(log.path, max_records=10)
+    assert reopened.read_tail() == committed
+    assert sorted(os.listdir(log.path)) == ['columns.json', 'columns.json.tmp', 'commands.1.u4', 'dictionary.json',
+                                            'timestamps.1.i8']
+    reopened.rewrite([('2024-03-20 16:05:53', 'menu')])
+    reopened.append('2024-03-20 16:05:54', 'exit')
+    assert [command for _, command in ColumnarHistoryLog(log.path, max_records=10).read_tail()] == ['menu', 'exit']
+
+
+def test_migrate_csv_to_columnar_and_back(tmp_path, capsys):
+    """The migration tool copies the full history between formats without changing it."""
+    csv_path, columnar_path, back_path = tmp_path / 'history.csv', tmp_path / 'history', tmp_path / 'back.csv'
+    csv_path.write_text('Timestamp,Command\n' + ''.join(f'2024-03-20 16:05:{index:02d},command{index % 3}\n'
+                                                        for index in range(50)))
+    assert history_store_main(['migrate', '--source-path', str(csv_path), '--target-path', str(columnar_path)]) == 0
+    assert 'Migrated 50 records' in capsys.readouterr().out
+    history_store_main(['migrate', '--from', 'columnar', '--to', 'csv',
+                        '--source-path', str(columnar_path), '--target-path', str(back_path)])
+    assert back_path.read_text() == csv_path.read_text()
+
+
+def _seed(manager, count):
+    """Gives the manager `count` records one minute apart, cycling through three commands."""
+    names = ['greet', 'calculator', 'csv']
+    manager.history = pd.DataFrame({
+        'Timestamp': [f'2024-03-20 {10 + index // 60:02d}:{index % 60:02d}:00' for index in range(count)],
+        'Command': [names[index % 3] for index in range(count)],
+    })
+
+
+def test_history_queries_use_the_indexes(history_manager):
+    """Range, count and top-N queries answer from the time and per-command indexes."""
+    _seed(history_manager, 5)  # greet 10:00, calculator 10:01, csv 10:02, greet 10:03, calculator 10:04
+    assert history_manager.count('greet') == 2
+    assert history_manager.count('calculator', '2024-03-20 10:01:00', '2024-03-20 10:03:59') == 1
+    assert history_manager.count(start='2024-03-20 10:02:00') == 3
+    assert history_manager.query('2024-03-20 10:02:00', '2024-03-20 10:03:00') == [
+        ('2024-03-20 10:02:00', 'csv'), ('2024-03-20 10:03:00', 'greet')]
+    assert history_manager.top_commands(2) == [('calculator', 2), ('greet', 2)]
+
+    # Evictions by add_command keep the indexes in step with the in-memory records
+    history_manager.add_command('csv')
+    history_manager.add_command('csv')
+    assert history_manager.get_history() == ['csv', 'greet', 'calculator', 'csv', 'csv']
+    assert history_manager.top_commands(1) == [('csv', 3)]
+    assert history_manager.count('greet', end='2024-03-20 10:02:59') == 0
+
+
+def test_delete_where_rebuilds_index(history_manager):
+    """delete_where removes matching records from memory, the file and the indexes."""
+    _seed(history_manager, 5)
+    assert history_manager.delete_where(lambda timestamp, command: command == 'greet') == 2
+    assert history_manager.count('greet') == 0
+    assert history_manager.load_history()['Command'].tolist() == ['calculator', 'csv', 'calculator']
+    assert history_manager.query(command='calculator')[0] == ('2024-03-20 10:01:00', 'calculator')
+
+
+def test_ring_buffer_wraps_and_evicts_oldest():
+    """Appends past the capacity overwrite the oldest slot; names are interned once."""
+    buffer = HistoryRingBuffer(3, [('2024-03-20 16:05:50', 'greet')])
+    for seconds, name in enumerate(['csv', 'greet', 'calculator', 'csv']):
+        buffer.append(1_710_950_000 + seconds, name)
+    assert len(buffer) == 3
+    assert buffer.commands() == ['greet', 'calculator', 'csv']
+    assert buffer.records()[0] == ('2024-03-20 15:53:21', 'greet')
+    assert buffer.nbytes() == 3 * 12
+    assert buffer.to_frame()['Command'].cat.categories.tolist() == ['greet', 'csv', 'calculator']
+    del buffer[1]
+    assert buffer.commands() == ['greet', 'csv']
+    buffer.clear()
+    assert not buffer.commands() and not buffer.records()
+
+
+def _write_shared_history(path, writer, count):
+    """Child process body for the stress test: appends `count` records, compacting often."""
+    log = SharedHistoryLog(path, max_records=100_000, compact_threshold=25)
+    for index in range(count):
+        log.append('2024-03-20 16:05:50', f'writer{writer}-{index}')
+    log.close()
+
+
+def test_shared_history_keeps_all_concurrent_writes(tmp_path):
+    """N processes append (and compact each other's segments) in parallel; every record survives."""
+    path, writers, count = str(tmp_path / 'history.d'), 6, 200
+    processes = [multiprocessing.Process(target=_write_shared_history, args=(path, writer, count))
+                 for writer in range(writers)]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join(timeout=60)
+        assert process.exitcode == 0
+
+    commands = [command for _, command in SharedHistoryLog(path, max_records=100_000).read_tail()]
+    assert len(commands) == writers * count
+    for writer in range(writers):
+        # Each writer's records are all there and in the order they were written
+        assert [command for command in commands if command.startswith(f'writer{writer}-')] == \
+            [f'writer{writer}-{index}' for index in range(count)]
+
+
+def test_shared_history_rewrite_replaces_all_segments(tmp_path):
+    """A rewrite (clear/delete) replaces the merged history of every writer."""
+    first = SharedHistoryLog(str(tmp_path / 'history.d'), max_records=10)
+    second = SharedHistoryLog(first.path, max_records=10)
+    first.append('2024-03-20 16:05:50', 'greet')
+    second.append('2024-03-20 16:05:51', 'csv')
+    assert [command for _, command in first.read_tail()] == ['greet', 'csv']
+    first.rewrite([('2024-03-20 16:05:52', 'menu')])
+    second.append('2024-03-20 16:05:53', 'exit')  # Its segment was folded away; a new one is started
+    assert second.read_tail() == [('2024-03-20 16:05:52', 'menu'), ('2024-03-20 16:05:53', 'exit')]
+    first.close()
+    second.close()
+
+
+def _shared_managers(path):
+    """Two CommandHistoryManager instances, as if in two processes, on one shared history directory."""
+    def create():
+        Singleton._instances.pop(CommandHistoryManager, None)
+        return CommandHistoryManager(history_file=str(path), max_records=10, backend='shared')
+    managers = create(), create()
+    Singleton._instances.pop(CommandHistoryManager, None)
+    return managers
+
+
+def test_shared_history_edits_keep_others_records(tmp_path):
+    """Save, delete and clear work on the merged history, not on one instance's view of it."""
+    first, second = managers = _shared_managers(tmp_path / 'history.d')
+    first.add_command('a1')
+    second.add_command('b1')
+    second.add_command('b2')
+
+    def merged():
+        return [command for _, command in SharedHistoryLog(first.history_file, max_records=10).read_tail()]
+    assert merged() == ['a1', 'b1', 'b2']
+    first.save_history()  # A compaction: nothing is lost
+    second.save_history()
+    assert merged() == ['a1', 'b1', 'b2'] and first.get_history() == ['a1', 'b1', 'b2']
+    assert first.delete_where(lambda timestamp, command: command == 'b1') == 1
+    second.delete_record(0)  # 'a1', the oldest of the merged records
+    assert merged() == ['b2'] and second.get_history() == ['b2']
+    first.clear_history()
+    assert merged() == []
+    for manager in managers:
+        manager.log.close()
+
+
+def test_shared_history_reads_see_other_instances(tmp_path):
+    """Reads merge again once another instance appended, so queries cover every instance."""
+    first, second = managers = _shared_managers(tmp_path / 'history.d')
+    first.add_command('greet')
+    assert first.get_history() == ['greet']  # Read and cached
+    second.add_command('csv')
+    second.add_command('greet')
+    assert first.get_history() == ['greet', 'csv', 'greet']
+    assert first.count('greet') == 2 and first.top_commands(1) == [('greet', 2)]
+    assert [command for _, command in first.query(command='csv')] == ['csv']
+    for manager in managers:
+        manager.log.close()
+
+
+def test_shared_history_rewrite_orders_before_appends(tmp_path, monkeypatch):
+    """Rewritten records stay older than later appends when local time is ahead of UTC."""
+    monkeypatch.setenv('TZ', 'Asia/Kolkata')
+    time.tzset()
+    try:
+        log = SharedHistoryLog(str(tmp_path / 'history.d'), max_records=2)
+        now = time.strftime('%Y-%m-%d %H:%M:%S')  # Local wall-clock time, as the history writes it
+        log.rewrite([(now, 'greet'), (now, 'csv')])
+        log.append(now, 'menu')
+        assert [command for _, command in log.read_tail()] == ['csv', 'menu']
+        log.compact()
+        assert [command for _, command in log.read_tail()] == ['csv', 'menu']
+        log.close()
+    finally:
+        monkeypatch.undo()
+        time.tzset()
+
+
+def test_sqlite_backend_batches_and_pages(tmp_path):
+    """Appends are inserted in batches; reads flush and page through the latest records."""
+    log = SqliteHistoryLog(str(tmp_path / 'history.db'), max_records=10, batch_size=4, flush_interval=60)
+    for index in range(3):
+        log.append(f'2024-03-20 16:05:5{index}', f'command{index}')
+    with sqlite3.connect(log.path) as other:
+        assert other.execute('SELECT COUNT(*) FROM history').fetchone()[0] == 0  # Still buffered
+        assert other.execute('PRAGMA journal_mode').fetchone()[0] == 'wal'
+        indexes = {row[0] for row in other.execute("SELECT name FROM sqlite_master WHERE type = 'index'")}
+        assert {'history_timestamp', 'history_command'} <= indexes
+    for index in range(3, 25):
+        log.append('2024-03-20 16:06:00', f'command{index}')
+    assert log.count() == 10
+    assert [command for _, command in log.read_page(0, 3)] == ['command15', 'command16', 'command17']
+    assert log.read_tail()[-1] == ('2024-03-20 16:06:00', 'command24')
+    log.close()
+    assert SqliteHistoryLog(log.path, max_records=10).load_frame()['Command'].tolist() == \
+        [f'command{index}' for index in range(15, 25)]
+
+
+def test_history_backend_from_settings_paged_listing(tmp_path, capfd):
+    """configure() picks the backend from the .env settings; Load History lists it page by page."""
+    Singleton._instances.pop(CommandHistoryManager, None)
+    manager = CommandHistoryManager.configure({'HISTORY_BACKEND': 'sqlite', 'HISTORY_MAX_RECORDS': '50',
+                                               'HISTORY_FILE': str(tmp_path / 'history.db')})
+    try:
+        assert isinstance(manager.log, SqliteHistoryLog) and manager.max_records == 50
+        assert CommandHistoryManager.configure({}) is manager
+        for index in range(5):
+            manager.add_command(f'command{index}')
+        with patch.object(HistoryCommand, 'PAGE_SIZE', 2), patch('builtins.input', side_effect=['1', '', '0', '0']):
+            HistoryCommand().execute()
+        out = capfd.readouterr().out
+        assert "1. command0" in out and "4. command3" in out and "5. command4" not in out
+    finally:
+        manager.log.close()
+        Singleton._instances.pop(CommandHistoryManager, None)
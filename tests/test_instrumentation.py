@@ -0,0 +1,71 @@
+"""Test the metrics and profiling surface"""
+import json
+from unittest.mock import patch
+import pytest
+from app.commands import CommandHandler, Command
+from app.instrumentation import LatencyHistogram, Metrics, metrics
+from app.plugins.stats import StatsCommand
+
+
+class _NoopCommand(Command):
+    def execute(self):
+        pass
+
+
+@pytest.fixture
+def global_metrics():
+    """The process-wide metrics, emptied and enabled for the test."""
+    enabled = metrics.enabled
+    metrics.enabled = True
+    metrics.reset()
+    yield metrics
+    metrics.reset()
+    metrics.enabled = enabled
+
+
+def test_histogram_percentiles_within_bucket_error():
+    """Percentiles are bucket upper bounds, so they land within one bucket (~6%) of the true value."""
+    histogram = LatencyHistogram()
+    for micros in range(1, 1001):
+        histogram.record(micros / 1e6)
+    summary = histogram.summary()
+    assert summary['count'] == 1000
+    assert 500e-6 <= summary['p50'] <= 500e-6 * 1.07
+    assert 950e-6 <= summary['p95'] <= 950e-6 * 1.07
+    assert summary['p99'] <= summary['max'] == 1000e-6
+
+
+def test_disabled_metrics_record_nothing():
+    """A disabled Metrics hands out a no-op timer and ignores counters."""
+    disabled = Metrics(enabled=False)
+    with disabled.timer('command.greet'):
+        disabled.increment('csv.bytes_read', 10)
+    assert not disabled.histograms and not disabled.counters
+
+
+def test_command_timer_and_snapshot(global_metrics, tmp_path):
+    """Every executed command gets a latency histogram, and the snapshot is written as JSON."""
+    handler = CommandHandler()
+    handler.register_command('noop', _NoopCommand())
+    for _ in range(3):
+        handler.execute_command('noop')
+    global_metrics.increment('csv.bytes_read', 42)
+
+    path = global_metrics.write_snapshot(str(tmp_path / 'metrics.json'))
+    with open(path, encoding='utf-8') as handle:
+        snapshot = json.load(handle)
+    assert snapshot['timers']['command.noop']['count'] == 3
+    assert snapshot['counters'] == {'csv.bytes_read': 42}
+
+
+def test_stats_command_shows_latency_and_counters(global_metrics, capfd):
+    """The stats command prints per-timer percentiles and the counters."""
+    global_metrics.observe('history.add', 0.002)
+    global_metrics.increment('history.bytes_written', 30)
+    with patch('builtins.input', side_effect=['1', '2', '4', '0']):
+        StatsCommand().execute()
+    out = capfd.readouterr().out
+    assert "history.add" in out and "p95 ms" in out
+    assert "history.bytes_written: 30" in out
+    assert "Statistics reset successfully." in out
+    assert not global_metrics.histograms
@@ -0,0 +1,70 @@
+"""Test the queue-based logging pipeline"""
+import json
+import logging
+import queue
+from app.logging_pipeline import BoundedQueueHandler, LogPipeline
+
+
+def _logger_for(pipeline, name):
+    logger = logging.getLogger(name)
+    logger.propagate = False
+    logger.setLevel(logging.INFO)
+    logger.addHandler(pipeline.handler)
+    return logger
+
+
+def test_pipeline_writes_batched_json_lines(tmp_path):
+    """Records logged from the hot path end up in the file as JSON lines once the writer drains."""
+    pipeline = LogPipeline(str(tmp_path / "app.log"), json_lines=True, flush_interval=0.05).start()
+    logger = _logger_for(pipeline, "test.pipeline.json")
+    for index in range(100):
+        logger.info("Executing command %d", index)
+    pipeline.stop()
+
+    lines = (tmp_path / "app.log").read_text().splitlines()
+    assert len(lines) == 100 and pipeline.written == 100
+    first = json.loads(lines[0])
+    assert first['message'] == "Executing command 0" and first['level'] == "INFO"
+
+
+def test_pipeline_rotates_by_size(tmp_path):
+    """Once the file passes max_bytes it is rotated to app.log.1, keeping backup_count files."""
+    pipeline = LogPipeline(str(tmp_path / "app.log"), max_bytes=2_000, backup_count=2, batch_size=10)
+    logger = _logger_for(pipeline, "test.pipeline.rotate")
+    for index in range(200):
+        logger.info("line %03d %s", index, "x" * 40)
+        if index % 10 == 9:
+            pipeline._drain()  # Write synchronously so the test does not depend on timing
+    pipeline.stop()
+
+    assert (tmp_path / "app.log.1").exists() and (tmp_path / "app.log.2").exists()
+    assert not (tmp_path / "app.log.3").exists()
+    assert (tmp_path / "app.log").stat().st_size <= 2_000
+    assert "line 199" in (tmp_path / "app.log").read_text()
+
+
+def test_queue_full_policies():
+    """drop_new keeps the queued records, drop_old keeps the newest ones; both count drops."""
+    record = lambda message: logging.LogRecord("test", logging.INFO, __file__, 1, message, None, None)  # pylint: disable=unnecessary-lambda-assignment
+    drop_new = BoundedQueueHandler(queue.Queue(maxsize=2), policy='drop_new')
+    drop_old = BoundedQueueHandler(queue.Queue(maxsize=2), policy='drop_old')
+    for message in ['a', 'b', 'c']:
+        drop_new.emit(record(message))
+        drop_old.emit(record(message))
+    assert [drop_new.queue.get_nowait().msg for _ in range(2)] == ['a', 'b']
+    assert [drop_old.queue.get_nowait().msg for _ in range(2)] == ['b', 'c']
+    assert drop_new.dropped == 1 and drop_old.dropped == 1
+
+
+def test_pipeline_blocks_by_default_and_reports_drops(tmp_path, capsys):
+    """The default policy waits for room; records dropped on opt-in policies are reported at stop()."""
+    pipeline = LogPipeline(str(tmp_path / "app.log"))
+    assert pipeline.handler.policy == 'block' and pipeline.handler.block_timeout > 0
+    pipeline = LogPipeline(str(tmp_path / "app.log"), queue_size=2, policy='drop_new')  # Not started: nothing drains
+    logger = _logger_for(pipeline, "test.drops")
+    for number in range(5):
+        logger.info("line %d", number)
+    pipeline.stop()
+    assert pipeline.dropped == 3
+    assert "3 log records were dropped" in capsys.readouterr().err
+    assert "3 log records were dropped" in (tmp_path / "app.log").read_text()
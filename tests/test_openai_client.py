@@ -0,0 +1,155 @@
+"""Tests for the OpenAI chat client, against a stub chat completions server on localhost."""
+# pylint: disable=redefined-outer-name
+import json
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from concurrent.futures import ThreadPoolExecutor
+import pytest
+from app.plugins.openai.chat import Chat
+from app.plugins.openai.client import ChatClient, ChatClientError, ResponseCache
+
+
+class StubChatHandler(BaseHTTPRequestHandler):
+    """Answers /v1/chat/completions with 'echo: <last message>', streamed word by word when asked."""
+    protocol_version = 'HTTP/1.1'  # Keep-alive, like the real API
+
+    def do_POST(self):  # pylint: disable=invalid-name
+        """One chat completion, streamed or not, after the server's configured delay."""
+        server = self.server
+        request = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+        with server.lock:
+            server.requests.append(request)
+            server.connections.add(self.client_address)
+        time.sleep(server.delay)
+        prompt = request['messages'][-1]['content']
+        if prompt == 'fail':
+            self._send(500, {'error': {'message': 'stub failure'}})
+        elif request.get('stream'):
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/event-stream')
+            self.send_header('Transfer-Encoding', 'chunked')
+            self.end_headers()
+            for word in f"echo: {prompt}".split(' '):
+                event = {'choices': [{'delta': {'content': word + ' '}}]}
+                self._chunk(f"data: {json.dumps(event)}\n\n".encode())
+            self._chunk(b"data: [DONE]\n\n")
+            self._chunk(b'')
+        else:
+            self._send(200, {'choices': [{'message': {'role': 'assistant', 'content': f"echo: {prompt}"}}]})
+
+    def _send(self, status, payload):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _chunk(self, data):
+        self.wfile.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+
+    def log_message(self, format, *args):  # pylint: disable=redefined-builtin
+        pass
+
+
+@pytest.fixture
+def stub_server():
+    """A local stand-in for the chat completions API on a free port; its base URL is server.url."""
+    server = ThreadingHTTPServer(('127.0.0.1', 0), StubChatHandler)
+    server.daemon_threads = True
+    server.lock = threading.Lock()
+    server.requests = []
+    server.connections = set()
+    server.delay = 0.0
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    server.url = f"http://127.0.0.1:{server.server_address[1]}/v1"
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def test_chat_client_reuses_connections_and_caches(stub_server, tmp_path):
+    """Sequential requests share one keep-alive connection; a repeated prompt is answered from disk."""
+    cache = ResponseCache(str(tmp_path), ttl=60, max_entries=10)
+    client = ChatClient(stub_server.url, api_key='test', max_connections=2, cache=cache)
+    assert client.complete('one') == 'echo: one'
+    assert client.complete('two') == 'echo: two'
+    assert client.complete('one') == 'echo: one'
+    assert len(stub_server.requests) == 2
+    assert client.pool.opened == 1 and len(stub_server.connections) == 1
+    assert stub_server.requests[0]['model'] == client.model
+    with pytest.raises(ChatClientError, match='HTTP 500: stub failure'):
+        client.complete('fail')
+    assert client.complete('three') == 'echo: three'
+    client.close()
+
+
+def test_chat_client_coalesces_and_limits_concurrency(stub_server):
+    """Identical prompts in flight together are sent once; no more than max_connections are open."""
+    stub_server.delay = 0.2
+    client = ChatClient(stub_server.url, max_connections=2)
+    with ThreadPoolExecutor(max_workers=6) as executor:
+        replies = list(executor.map(lambda _: client.complete('same'), range(6)))
+    assert replies == ['echo: same'] * 6
+    assert len(stub_server.requests) == 1
+    stub_server.delay = 0.05
+    prompts = ['a', 'b', 'c', 'a', 'd', 'e']
+    assert client.complete_many(prompts) == [f"echo: {prompt}" for prompt in prompts]
+    assert sorted(request['messages'][0]['content'] for request in stub_server.requests[1:]) == list('abcde')
+    assert client.pool.opened <= 2
+    client.close()
+
+
+def test_response_cache_ttl_and_lru(tmp_path):
+    """Entries expire after the TTL and the least recently used one is evicted first."""
+    cache = ResponseCache(str(tmp_path), ttl=60, max_entries=2)
+    keys = [ResponseCache.key({'prompt': prompt}) for prompt in 'abc']
+    cache.put(keys[0], 'A')
+    cache.put(keys[1], 'B')
+    old = time.time() - 30
+    os.utime(cache._path(keys[1]), (old, old))  # pylint: disable=protected-access
+    assert cache.get(keys[0]) == 'A'  # Most recently used now
+    cache.put(keys[2], 'C')  # Evicts the least recently used entry
+    assert cache.get(keys[1]) is None
+    assert cache.get(keys[0]) == 'A' and cache.get(keys[2]) == 'C'
+    expired = ResponseCache(str(tmp_path), ttl=0, max_entries=2)
+    time.sleep(0.01)
+    assert expired.get(keys[0]) is None
+    assert not os.path.exists(cache._path(keys[0]))  # pylint: disable=protected-access
+
+
+def test_chat_streams_reply(stub_server, tmp_path, capfd, monkeypatch):
+    """The chat prints the streamed reply and goes back on an empty line; the reply is then cached."""
+    client = ChatClient(stub_server.url, cache=ResponseCache(str(tmp_path)))
+    inputs = iter(['hello there', 'hello there', ''])
+    monkeypatch.setattr('builtins.input', lambda _: next(inputs))
+    Chat(client).execute()
+    captured = capfd.readouterr()
+    assert captured.out.count("AI: echo: hello there") == 2
+    assert len(stub_server.requests) == 1 and stub_server.requests[0]['stream'] is True
+    assert list(client.stream('hello there')) == ['echo: hello there ']
+    client.close()
+
+
+def test_chat_without_streaming_completes(stub_server, capfd, monkeypatch):
+    """With streaming off the chat sends plain completions, which identical prompts in flight share."""
+    monkeypatch.setenv('OPENAI_STREAM', '0')
+    client = ChatClient(stub_server.url)
+    inputs = iter(['hello there', ''])
+    monkeypatch.setattr('builtins.input', lambda _: next(inputs))
+    Chat(client).execute()
+    assert "AI: echo: hello there" in capfd.readouterr().out
+    assert len(stub_server.requests) == 1 and 'stream' not in stub_server.requests[0]
+    client.close()
+
+
+def test_chat_without_backend(capfd, monkeypatch):
+    """Without an API key or base URL the chat command keeps its offline greeting."""
+    monkeypatch.delenv('OPENAI_BASE_URL', raising=False)
+    monkeypatch.delenv('OPENAI_API_KEY', raising=False)
+    Chat().execute()
+    captured = capfd.readouterr()
+    assert "Hi this is AI" in captured.out
@@ -0,0 +1,153 @@
+"""Tests for the REPL server and its thin client, over a Unix socket in a temporary directory."""
+# pylint: disable=redefined-outer-name,unused-argument
+import asyncio
+import io
+import json
+import os
+import pytest
+from app import App
+from app.commands import Command
+from app.commands.worker_pool import PreforkWorkerPool
+from app.instrumentation import metrics
+from app.server import ReplServer
+from client import connect, parse_address, run
+
+
+async def _session(path, answers):
+    """Plays one session; returns everything the server sent as output."""
+    reader, writer = await asyncio.open_unix_connection(path)
+    answers = iter(answers)
+    output = []
+    while True:
+        line = await reader.readline()
+        if not line:
+            break
+        message = json.loads(line)
+        output.append(message.get('output', ''))
+        if 'prompt' in message:
+            writer.write(json.dumps({'input': next(answers)}).encode() + b'\n')
+        if message.get('close'):
+            break
+    writer.close()
+    await writer.wait_closed()
+    return ''.join(output)
+
+
+class PidCommand(Command):
+    """Prints the process it runs in."""
+    cpu_bound = True
+
+    def execute(self):
+        print(f"pid {os.getpid()}")
+
+
+def test_server_runs_concurrent_sessions(history_manager, tmp_path):
+    """Sessions get their own prompts and output while sharing one history."""
+    path = str(tmp_path / 'repl.sock')
+
+    async def scenario():
+        server = ReplServer(App(), max_commands=8)
+        await server.start(path)
+        try:
+            outputs = await asyncio.gather(*(
+                _session(path, ['6', '2', '1', str(number), '4', '0', 'x', 'exit']) for number in range(20)))
+            assert not server.sessions
+            return outputs
+        finally:
+            await server.stop()
+
+    outputs = asyncio.run(scenario())
+    for number, output in enumerate(outputs):
+        assert "Hello, World!" in output
+        assert f"The result is {number + 4:.1f}" in output
+        assert "Only numbers are allowed, wrong input." in output
+        assert output.endswith("Exiting application.\n")
+    # 40 commands went into the shared history, which keeps the latest max_records=5
+    history = history_manager.get_history()
+    assert len(history) == 5 and set(history) <= {'greet', 'calculator'}
+    assert history_manager.history_count() == 5
+
+
+def test_server_session_ends_on_exit_and_disconnect(history_manager, tmp_path):
+    """The exit command ends only its own session; a client leaving mid-command frees its thread."""
+    path = str(tmp_path / 'repl.sock')
+
+    async def scenario():
+        server = ReplServer(App(), max_commands=1)
+        await server.start(path)
+        try:
+            exited = await _session(path, ['4'])
+            reader, writer = await asyncio.open_unix_connection(path)
+            writer.write(b'2\n')  # Plain text answers work too; the calculator then waits for input
+            while 'Select an operation' not in json.loads(await reader.readline()).get('prompt', ''):
+                pass
+            writer.close()
+            await writer.wait_closed()
+            greeted = await asyncio.wait_for(_session(path, ['6', 'exit']), timeout=5)
+            return exited, greeted
+        finally:
+            await server.stop()
+
+    exited, greeted = asyncio.run(scenario())
+    assert "Exiting..." in exited
+    assert "Hello, World!" in greeted
+
+
+def test_thin_client(history_manager, tmp_path):
+    """client.py parses addresses and plays a session through the prompts of a running server."""
+    path = str(tmp_path / 'repl.sock')
+    assert parse_address(f"unix:{path}") == path
+    assert parse_address('tcp:localhost:8765') == ('localhost', 8765)
+    assert parse_address(':9000') == ('127.0.0.1', 9000)
+    with pytest.raises(ValueError):
+        parse_address('localhost')
+
+    async def scenario():
+        server = ReplServer(App())
+        await server.start(path)
+        try:
+            answers = iter(['6', 'exit'])
+            output = io.StringIO()
+
+            def play():
+                with connect(path, timeout=5) as sock:
+                    run(sock, read_input=lambda prompt: output.write(prompt) and next(answers), output=output)
+            await asyncio.to_thread(play)
+            return output.getvalue()
+        finally:
+            await server.stop()
+
+    output = asyncio.run(scenario())
+    assert "Available commands:" in output
+    assert ">>> Hello, World!" in output
+    assert output.endswith("Exiting application.\n")
+
+
+def test_server_runs_commands_like_the_repl(history_manager, tmp_path):
+    """Commands are timed and cpu_bound ones run in the worker pool, as with App.start."""
+    path = str(tmp_path / 'repl.sock')
+    app = App()
+    app.command_handler.register_command('pid', PidCommand())
+    pool = PreforkWorkerPool(1, command_handler=app.command_handler).start()
+    app.command_handler.worker_pool = pool
+    enabled, metrics.enabled = metrics.enabled, True
+    metrics.reset()
+
+    async def scenario():
+        server = ReplServer(app)
+        await server.start(path)
+        try:
+            number = app.command_handler.get_index_of_command('pid') + 1
+            return await _session(path, [str(number), 'exit'])
+        finally:
+            await server.stop()
+
+    try:
+        output = asyncio.run(scenario())
+        assert f"pid {pool.workers[0].pid}" in output
+        assert metrics.snapshot()['timers']['command.pid']['count'] == 1
+        assert history_manager.get_history() == ['pid']
+    finally:
+        pool.close()
+        metrics.reset()
+        metrics.enabled = enabled
@@ -0,0 +1,58 @@
+"""Test the startup time budget and the deferred heavy imports"""
+import os
+import subprocess
+import sys
+from app.lazy_import import LazyModule
+from app.startup_report import ROOT_DIR, measure_cold_start, parse_importtime, startup_profile
+from util.constants import STARTUP_BUDGET_SECONDS
+
+
+def test_lazy_module_imports_on_first_use(monkeypatch):
+    """Attribute access imports the wrapped module once."""
+    monkeypatch.delitem(sys.modules, 'colorsys', raising=False)
+    colorsys = LazyModule('colorsys')
+    assert not colorsys.loaded
+    assert colorsys.rgb_to_hsv(1.0, 0.0, 0.0) == (0.0, 1.0, 1.0)
+    assert colorsys.loaded
+
+
+def test_history_is_read_on_first_use(history_manager):
+    """Constructing the manager does not touch the log; the first query reads it."""
+    assert history_manager._buffer is None
+    assert history_manager.get_history() == []
+    assert history_manager._buffer is not None
+
+
+def test_parse_importtime():
+    """-X importtime lines become (module, self us, cumulative us, depth) rows."""
+    lines = ["import time: self [us] | cumulative | imported package",
+             "import time:       120 |        120 |   _json",
+             "import time:       400 |        520 | json"]
+    assert parse_importtime(lines) == [('_json', 120, 120, 1), ('json', 400, 520, 0)]
+
+
+def test_startup_skips_pandas_and_numpy(tmp_path):
+    """Reaching the first prompt imports neither pandas nor NumPy, with or without a plugin manifest."""
+    env = {'PLUGIN_MANIFEST_PATH': str(tmp_path / 'plugin_manifest.json')}
+    assert startup_profile(env)['heavy_modules'] == []  # Cold: the plugins are discovered from their sources
+    assert (tmp_path / 'plugin_manifest.json').exists()
+    assert startup_profile(env)['heavy_modules'] == []  # Warm: the plugins come from the manifest
+
+
+def test_first_command_skips_pandas(tmp_path):
+    """Reading an existing history and indexing the first command must not import pandas."""
+    history_file = tmp_path / 'command_history.csv'
+    history_file.write_text('timestamp,command\n2024-01-01 00:00:00,add\n2024-01-01 00:00:01,subtract\n')
+    script = ('import sys\nfrom app.commands import CommandHistoryManager\n'
+              f'manager = CommandHistoryManager(history_file={str(history_file)!r})\n'
+              "manager.add_command('add')\nassert manager.count('add') == 2\nprint('pandas' in sys.modules)")
+    completed = subprocess.run([sys.executable, '-c', script], cwd=ROOT_DIR, capture_output=True, text=True,
+                               check=True)
+    assert completed.stdout.strip() == 'False'
+
+
+def test_cold_start_within_budget():
+    """`python main.py` shows its prompt within STARTUP_BUDGET_SECONDS (override it in the environment)."""
+    budget = float(os.environ.get('STARTUP_BUDGET_SECONDS', STARTUP_BUDGET_SECONDS))
+    elapsed = measure_cold_start()
+    assert elapsed <= budget, f"Cold start took {elapsed:.3f}s, budget is {budget:.3f}s"
@@ -0,0 +1,128 @@
+"""Tests for the pre-forked worker pool and the commands dispatched to it."""
+# pylint: disable=redefined-outer-name
+import mmap
+import os
+import numpy as np
+import pandas as pd
+import pytest
+from app import App
+from app.commands import Command, CommandHandler
+from app.commands.worker_pool import SHARED_MEMORY_DIR, PreforkWorkerPool, WorkerCrashedError, get_worker_pool
+from app.plugins.calculator import CalculatorCommand
+
+
+def make_result(rows):
+    """A result with a large array and a frame, plus the pid of the process that built it."""
+    return {'array': np.arange(rows, dtype=np.float64),
+            'frame': pd.DataFrame({'x': np.arange(rows), 'label': ['row'] * rows}, index=np.arange(rows) * 2),
+            'pid': os.getpid()}
+
+
+def fail():
+    """A task that raises."""
+    raise ValueError("bad operand")
+
+
+def crash():
+    """A task that kills its worker."""
+    os._exit(3)  # pylint: disable=protected-access
+
+
+class PidCommand(Command):
+    """Prints the process it runs in and returns a large array."""
+    cpu_bound = True
+
+    def execute(self):
+        print(f"pid {os.getpid()}")
+        return np.arange(100_000, dtype=np.float64)
+
+
+class CrashingCommand(Command):
+    """Kills the worker it runs in."""
+    cpu_bound = True
+
+    def execute(self):
+        crash()
+
+
+def shared_blocks():
+    """Names of the shared memory blocks that currently exist."""
+    return set(os.listdir(SHARED_MEMORY_DIR)) if os.path.isdir(SHARED_MEMORY_DIR) else set()
+
+
+@pytest.fixture
+def pool():
+    """Two workers recycled after 3 tasks, for a handler with the pid and crash commands."""
+    handler = CommandHandler()
+    handler.register_command('pid', PidCommand())
+    handler.register_command('crash', CrashingCommand())
+    pool = PreforkWorkerPool(2, max_tasks_per_worker=3, command_handler=handler).start()
+    handler.worker_pool = pool
+    yield pool
+    pool.close()
+    assert get_worker_pool() is None
+
+
+def test_worker_pool_results_errors_and_crashes(pool):
+    """Results come back through shared memory; errors are re-raised and crashed workers replaced."""
+    before = shared_blocks()
+    result = pool.run(make_result, 100_000)
+    assert result['pid'] != os.getpid()
+    np.testing.assert_array_equal(result['array'], np.arange(100_000, dtype=np.float64))
+    assert list(result['frame'].columns) == ['x', 'label'] and result['frame'].index[-1] == 199_998
+    assert result['frame']['x'].sum() == sum(range(100_000)) and result['frame']['label'].iloc[0] == 'row'
+    assert shared_blocks() == before  # Every block was released
+    with pytest.raises(ValueError, match='bad operand'):
+        pool.run(fail)
+    with pytest.raises(WorkerCrashedError, match='exited with code 3'):
+        pool.run(crash)
+    assert pool.crashed == 1 and len(pool.workers) == 2
+    assert pool.run(make_result, 10)['array'].tolist() == list(range(10))
+
+
+def test_worker_pool_recycles_workers(pool):
+    """A worker is replaced after max_tasks_per_worker tasks; workers are not children of the app."""
+    first = set(pool.stats()['workers'])
+    pids = {pool.run(os.getpid) for _ in range(6)}  # 3 tasks per worker, then it is replaced
+    assert pids <= first
+    assert pool.run(os.getppid) != os.getpid()  # Forked by the fork server, not from the app's threads
+    assert pool.recycled == 2 and not first & set(pool.stats()['workers'])
+
+
+def test_command_handler_dispatches_cpu_bound_commands(pool, capfd):
+    """cpu_bound commands print through the REPL and return their result via shared memory."""
+    handler = pool.command_handler
+    result = handler.execute_command('pid')
+    out = capfd.readouterr().out
+    assert out.startswith('pid ') and int(out.split()[1]) in {worker.pid for worker in pool.workers}
+    assert isinstance(result.base, mmap.mmap) and result[-1] == 99_999.0
+    handler.execute_command('crash')  # Reported, the REPL keeps going
+    assert "Command crash failed" in capfd.readouterr().out
+    handler.execute_command('pid')
+    assert capfd.readouterr().out.startswith('pid ')
+
+
+def test_calculator_batch_runs_in_worker(pool, tmp_path):
+    """The calculator's batch mode evaluates the operand file in a worker."""
+    input_path = tmp_path / 'operands.csv'
+    pd.DataFrame({'a': np.arange(20_000.0), 'b': np.arange(20_000.0) % 5}).to_csv(input_path, header=False, index=False)
+    calculator = CalculatorCommand()
+    result = calculator.run_batch(calculator.operations['2'], str(input_path))  # Divide
+    assert result.rejected == 4_000 and len(result.values) == 20_000
+    assert np.isnan(result.values[0]) and result.values[7] == 3.5
+    assert pd.read_csv(tmp_path / 'operands_results.csv')['result'].iloc[7] == 3.5
+
+
+def test_app_forks_workers_after_loading_plugins(monkeypatch, capfd):
+    """WORKER_POOL_SIZE starts the pool once the plugins are loaded; other commands stay in the app."""
+    monkeypatch.setenv('WORKER_POOL_SIZE', '1')
+    app = App()
+    app.load_plugins()
+    pool = app.command_handler.worker_pool
+    try:
+        assert len(pool.workers) == 1 and pool.max_tasks_per_worker is None
+        assert app.command_handler.commands['csv'].is_loaded  # Imported before the fork
+        app.command_handler.execute_command('greet')  # Not cpu_bound, runs right here
+        assert "Hello, World!" in capfd.readouterr().out
+    finally:
+        pool.close()
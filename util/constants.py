@@ -1 +1,2 @@
-MAX_HISTORY_RECORDS = 5  # Limit to the last 5 commands
\ No newline at end of file
+MAX_HISTORY_RECORDS = 5  # Limit to the last 5 commands
+STARTUP_BUDGET_SECONDS = 1.0  # Cold start of main.py to the first prompt, checked by tests/test_startup.py